@@ -1,31 +1,73 @@
 #!/usr/bin/env python
 
 import sys
-PY3 = sys.version > '3'
 
 import platform
 import glob
+import os
+import json
+import array
+import collections
 import logging
 import serial
 import threading
 import time
-if PY3:
-    import queue
-else:
-    import Queue
+import queue
 
 from struct import * #pack()
 
+#numpy is optional. When it's available ContactBatch fields are numpy views
+#over the frame, otherwise they're copied into array.array columns.
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 SENSEL_LOGGING_LEVEL = logging.WARNING #(DEBUG/INFO/WARNING/ERROR/CRITICAL)
 
 SENSEL_BAUD = 115200
 SENSEL_TIMEOUT = 1
+
+#Port auto-detection probes candidate ports in parallel, giving each this
+#long to answer the magic register read
+SENSEL_PROBE_TIMEOUT = 0.2
+SENSEL_PROBE_MAX_THREADS = 16
+
+#USB vendor ids of Sensel devices (lowercase hex, as in sysfs). On Linux the
+#ports with these ids are probed first, the rest only if none of them answers.
+SENSEL_USB_VENDOR_IDS = ('2c2f',)
+
+#In buffered mode the scan thread hands frames to the reader through a queue
+#of at most SENSEL_SCAN_QUEUE_SIZE frames. When the reader falls behind and it
+#fills, the scan queue policy decides which frame gives way:
+#  SENSEL_SCAN_DROP_OLDEST - the oldest queued frame is dropped (default)
+#  SENSEL_SCAN_DROP_NEWEST - the frame just read is dropped
+#  SENSEL_SCAN_BLOCK       - the scan thread waits for room, leaving the
+#                            device to drop frames once its buffers fill
+SENSEL_SCAN_QUEUE_SIZE = 256
+SENSEL_SCAN_DROP_OLDEST = 0
+SENSEL_SCAN_DROP_NEWEST = 1
+SENSEL_SCAN_BLOCK = 2
+
+#Unbuffered reads can keep requests for the next frames in flight, so the
+#device is already sending a frame while the last one is parsed and handled.
+#This is the default number of requests kept in flight between reads (0 sends
+#each request only when its frame is read), see setReadPipelineDepth.
+SENSEL_READ_PIPELINE_DEPTH = 0
+
+#The image block codec (see _ImageBuffer) is the one sensel_sim encodes with.
+#The sensor firmware's own pressure/labels compression isn't documented here,
+#so decoding images (and with them getLabelRegions) is off by default and a frame with an image block raises
+#SenselUnsupportedImageError. Enable it (setImageDecoding) for simulated
+#devices and recordings of them, or once the firmware format is confirmed.
+SENSEL_IMAGE_DECODING = False
+
+#Where auto-detection remembers which port each device (by serial number)
+#was last found on, so that port is tried first
+SENSEL_PORT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".sensel_port_cache.json")
 SENSEL_NULL_LABEL = 255
 
-if PY3:
-    SENSEL_MAGIC = b'S3NS31'
-else:
-    SENSEL_MAGIC = 'S3NS31'
+SENSEL_MAGIC = b'S3NS31'
 
 SENSEL_FRAME_PRESSURE_FLAG = 0x01
 SENSEL_FRAME_LABELS_FLAG   = 0x02
@@ -106,23 +148,119 @@ EC_REG_INVALID_ADDRESS = 1
 EC_REG_INVALID_VALUE = 2
 EC_REG_INVALID_PERMISSIONS = 3
 
-sensel_serial = None
-sensor_nrows = -1
-sensor_ncols = -1
-sensor_x_to_mm_factor = -1
-sensor_y_to_mm_factor = -1
-
-#TODO: Explicitly set this to False or read out actual value in sensor
-_sthread = None
-_scan_buffer = None
-_scan_buffering_enabled = False
-_scan_num_buffers = 0
-_scan_thread_exit_requested = False
-_scan_thread_pause_requested = False
-_serial_lock = None
+#Ports opened by a SenselDevice in this process, so auto-detection for a second
+#device doesn't probe (and steal traffic from) a port that's already in use
+_ports_in_use = set()
+_ports_in_use_lock = threading.Lock()
 
 SENSEL_DEVICE_INFO_SIZE = 9
 
+#Firmware, device and sensor registers never change while a device is
+#connected, so SenselDevice caches what it reads from them
+_IMMUTABLE_REGISTERS = frozenset(range(SENSEL_REG_FW_PROTOCOL_VERSION, SENSEL_REG_SCAN_FRAME_RATE))
+
+#SenselRegisterTransaction operations
+_REG_OP_READ = 0
+_REG_OP_READ_VSP = 1
+_REG_OP_WRITE = 2
+
+#How long SenselDevicePoller threads wait on a device before checking whether
+#they've been asked to stop (s)
+SENSEL_POLL_TIMEOUT = 0.1
+
+#Wire layout of a single contact (little endian):
+#total_force, uid, area, x_pos, y_pos, dx, dy, orientation, major_axis,
+#minor_axis, peak_x, peak_y, id, type
+_contact_struct = Struct('<IIIHHhhHHHBBBB')
+_contact_field_names = ('total_force', 'uid', 'area', 'x_pos', 'y_pos', 'dx', 'dy',
+                        'orientation', 'major_axis', 'minor_axis', 'peak_x', 'peak_y',
+                        'id', 'type')
+#array.array typecodes for each field ('L' since 'I' is only guaranteed 2 bytes)
+_contact_array_types = 'LLLHHhhHHHBBBB'
+if numpy is not None:
+    _contact_dtype = numpy.dtype([(name, '<' + code) for (name, code) in
+                                  zip(_contact_field_names, ('u4', 'u4', 'u4', 'u2', 'u2', 'i2', 'i2',
+                                                             'u2', 'u2', 'u2', 'u1', 'u1', 'u1', 'u1'))])
+
+SENSEL_STREAM_BUFFER_SIZE = 65536
+
+#Stages timed by SenselLatencyStats: reading a frame off the wire, waiting to
+#be parsed (the scan queue in buffered mode), parsing, gesture processing up
+#to the event, and arrival to event overall
+SENSEL_LATENCY_STAGES = ('read', 'queue', 'parse', 'dispatch', 'total')
+
+#Monotonic high resolution clock for latency stats
+_perf_counter = time.perf_counter
+
+#Buffers everything read from the serial port. Each port read asks for at
+#least what the caller needs plus whatever the port already has waiting, so in
+#buffered mode one read usually pulls in a whole batch of frames, and later
+#reads are served from memory. Unread bytes are moved back to the start of the
+#buffer when it runs out of room, so a response never wraps around and can be
+#sliced out in one piece. The buffer grows if a single response needs it.
+class _SerialStream():
+
+    def __init__(self, port, size=SENSEL_STREAM_BUFFER_SIZE):
+        self._port = port
+        self._buf = bytearray(size)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+        self.port_reads = 0
+
+    def available(self):
+        return self._end - self._start
+
+    def clear(self):
+        self._start = 0
+        self._end = 0
+
+    def read(self, num_bytes):
+        if self._end - self._start < num_bytes:
+            self._fill(num_bytes)
+        start = self._start
+        self._start += num_bytes
+        return self._view[start:self._start].tobytes()
+
+    def _fill(self, num_bytes):
+        while self._end - self._start < num_bytes:
+            needed = num_bytes - (self._end - self._start)
+            want = max(needed, self._bytesWaiting())
+            self._makeRoom(want)
+            want = min(want, len(self._buf) - self._end)
+            data = self._port.read(want)
+            self.port_reads += 1
+            self._view[self._end:self._end + len(data)] = data
+            self._end += len(data)
+            if len(data) < needed:
+                #Timed out. Drop what we have, the response can't be trusted.
+                available = self._end - self._start
+                self.clear()
+                raise SenselSerialReadError(available, num_bytes)
+
+    def _makeRoom(self, num_bytes):
+        if len(self._buf) - self._end >= num_bytes:
+            return
+        unread = self._end - self._start
+        if unread + num_bytes > len(self._buf):
+            size = len(self._buf)
+            while unread + num_bytes > size:
+                size *= 2
+            buf = bytearray(size)
+            buf[:unread] = self._view[self._start:self._end]
+            self._buf = buf
+            self._view = memoryview(buf)
+        else:
+            self._view[:unread] = self._view[self._start:self._end].tobytes()
+        self._start = 0
+        self._end = unread
+
+    def _bytesWaiting(self):
+        try:
+            return self._port.in_waiting
+        except AttributeError:
+            return self._port.inWaiting()
+
 class SenselDeviceInfo():
     def __init__(self, data):
         self.fw_protocol_version = _convertBufToVal(data[0:1])
@@ -134,30 +272,58 @@ class SenselDeviceInfo():
         self.device_revision =  _convertBufToVal(data[8:9])
 
 class SenselContact():
-    data_size = 30
-
-    def __init__(self, data):
-        if(len(data) != SenselContact.data_size):
-            logging.error("Unable to create SenselContact. Data length (%d) != contact length (%d)" %
-                          (len(data), SenselContact.data_size))
+    data_size = _contact_struct.size
+    _field_names = frozenset(_contact_field_names + ('x_pos_mm', 'y_pos_mm'))
+
+    #data may be any buffer (bytes, bytearray, memoryview). The contact keeps a
+    #reference to it and only decodes its fields the first time one is accessed.
+    #mm_factors are the (x, y) position to mm factors of the device it came from.
+    def __init__(self, data, offset=0, mm_factors=(-1, -1)):
+        if(len(data) < offset + SenselContact.data_size):
+            logging.error("Unable to create SenselContact. Data length (%d) < contact length (%d)" %
+                          (len(data) - offset, SenselContact.data_size))
             raise Exception
 
-        self.total_force = _convertBufToVal(data[0:4])
-        self.uid =         _convertBufToVal(data[4:8])
-        self.area =        _convertBufToVal(data[8:12])
-        x_pos =            _convertBufToVal(data[12:14])
-        y_pos =            _convertBufToVal(data[14:16])
-        self.dx =          _convertBufToVal(data[16:18])
-        self.dy =          _convertBufToVal(data[18:20])
-        self.orientation = _convertBufToVal(data[20:22])
-        self.major_axis =  _convertBufToVal(data[22:24])
-        self.minor_axis =  _convertBufToVal(data[24:26])
-        self.peak_x =      _convertBufToVal(data[26:27])
-        self.peak_y =      _convertBufToVal(data[27:28])
-        self.id =          _convertBufToVal(data[28:29])
-        self.type =        _convertBufToVal(data[29:30])
-        self.x_pos_mm = x_pos * sensor_x_to_mm_factor
-        self.y_pos_mm = y_pos * sensor_y_to_mm_factor
+        self._buf = data
+        self._offset = offset
+        self._mm_factors = mm_factors
+
+    def _setFields(self, fields, mm_factors):
+        (self.total_force, self.uid, self.area, self.x_pos, self.y_pos,
+         self.dx, self.dy, self.orientation, self.major_axis, self.minor_axis,
+         self.peak_x, self.peak_y, self.id, self.type) = fields
+        self._mm_factors = mm_factors
+        self.x_pos_mm = self.x_pos * mm_factors[0]
+        self.y_pos_mm = self.y_pos * mm_factors[1]
+
+    @classmethod
+    def _fromBuffer(cls, data, offset, mm_factors):
+        contact = cls.__new__(cls)
+        contact._buf = data
+        contact._offset = offset
+        contact._mm_factors = mm_factors
+        return contact
+
+    def _decode(self):
+        self._setFields(_contact_struct.unpack_from(self._buf, self._offset), self._mm_factors)
+        del self._buf
+
+    #Only called for attributes that haven't been set yet, i.e. undecoded fields
+    def __getattr__(self, name):
+        if name not in SenselContact._field_names or '_buf' not in self.__dict__:
+            raise AttributeError(name)
+        self._decode()
+        return self.__dict__[name]
+
+    #Copies and pickles hold the decoded fields rather than the frame buffer,
+    #which may be a memoryview
+    def __getstate__(self):
+        if '_buf' in self.__dict__:
+            self._decode()
+        return self.__dict__
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
 
     def __str__(self):
         retstring = "Sensel Contact:\n"
@@ -177,23 +343,440 @@ class SenselContact():
         retstring += "type:        %d\n" % self.type
         return retstring
 
+#Column-oriented view of all contacts in a frame. Each field is stored as a
+#contiguous array (a numpy structured array over the frame when numpy is
+#installed, array.array columns otherwise). Indexing or iterating yields
+#SenselContact objects for code written against the list interface.
+class ContactBatch():
+
+    def __init__(self, data, num_contacts, offset=0, mm_factors=(-1, -1)):
+        end = _checkContactDataSize(data, num_contacts, offset)
+        self._buf = data
+        self._offset = offset
+        self.num_contacts = num_contacts
+        self._mm_factors = mm_factors
+        (self.x_to_mm_factor, self.y_to_mm_factor) = mm_factors
+        self.sensor_time = None #Set to the frame's sensor time by SenselDevice
+
+        if numpy is not None:
+            self._contacts = numpy.frombuffer(data, dtype=_contact_dtype,
+                                              count=num_contacts, offset=offset)
+            self._columns = None
+        else:
+            self._contacts = None
+            #Columns are built the first time they're asked for
+            self._rows = list(_contact_struct.iter_unpack(memoryview(data)[offset:end]))
+            self._columns = {}
+
+    def column(self, name):
+        if name == 'x_pos_mm':
+            return self._scaled('x_pos', self.x_to_mm_factor)
+        if name == 'y_pos_mm':
+            return self._scaled('y_pos', self.y_to_mm_factor)
+        if self._columns is None:
+            return self._contacts[name]
+        return self._arrayColumn(name)
+
+    #Every contact's fields as a tuple in SenselContact field order, in one
+    #call rather than a column access per field
+    def rows(self):
+        if self._columns is None:
+            return self._contacts.tolist()
+        return self._rows
+
+    def _arrayColumn(self, name):
+        column = self._columns.get(name)
+        if column is None:
+            i = _contact_field_names.index(name)
+            column = array.array(_contact_array_types[i], [row[i] for row in self._rows])
+            self._columns[name] = column
+        return column
+
+    def _scaled(self, name, factor):
+        if self._columns is None:
+            return self._contacts[name] * factor
+        return array.array('d', [v * factor for v in self._arrayColumn(name)])
+
+    def centroid(self):
+        if self.num_contacts == 0:
+            return None
+        return (self._mean('x_pos') * self.x_to_mm_factor,
+                self._mean('y_pos') * self.y_to_mm_factor)
+
+    def totalForce(self):
+        if self._columns is None:
+            return int(self._contacts['total_force'].sum(dtype=numpy.uint64))
+        return sum(self._arrayColumn('total_force'))
+
+    def meanForce(self):
+        if self.num_contacts == 0:
+            return None
+        return self.totalForce() / float(self.num_contacts)
+
+    def _mean(self, name):
+        if self._columns is None:
+            return float(self._contacts[name].mean())
+        return sum(self._arrayColumn(name)) / float(self.num_contacts)
+
+    def __len__(self):
+        return self.num_contacts
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.num_contacts
+        if i < 0 or i >= self.num_contacts:
+            raise IndexError(i)
+        return SenselContact._fromBuffer(self._buf, self._offset + i * SenselContact.data_size,
+                                         self._mm_factors)
+
+    def __iter__(self):
+        for i in range(self.num_contacts):
+            yield self[i]
+
+    #Copies and pickles hold their own copy of the contact records rather than
+    #the frame buffer, which may be a memoryview
+    def __reduce__(self):
+        end = self._offset + self.num_contacts * SenselContact.data_size
+        data = bytes(memoryview(self._buf)[self._offset:end])
+        return (ContactBatch, (data, self.num_contacts, 0, self._mm_factors), {'sensor_time': self.sensor_time})
+
+#Reusable buffer that image blocks (pressure/labels) are decoded into. The
+#decoded image is exposed as a (nrows, ncols) numpy array, or as a 2-D
+#memoryview over an array.array when numpy isn't available. It is overwritten
+#by every frame, so callers that need to keep an image must copy it.
+#
+#Image block layout: a 2 byte little-endian payload size followed by the
+#payload. A payload of exactly nrows * ncols cells is raw. Anything else is
+#run-length encoded: cells equal to the fill value never appear literally,
+#instead a fill cell is followed by a cell-sized count of fill cells.
+#
+#This layout is sensel_sim's (see _compressImage), not a confirmed firmware
+#format, which is why decoding is opt-in (SENSEL_IMAGE_DECODING).
+class _ImageBuffer():
+
+    def __init__(self, nrows, ncols, typecode, fill_value):
+        self.shape = (nrows, ncols)
+        self.cell_size = array.array(typecode).itemsize
+        num_cells = nrows * ncols
+
+        if numpy is not None:
+            self.image = numpy.full(self.shape, fill_value, dtype='<u%d' % self.cell_size)
+            self._array = None
+            self.data = memoryview(self.image.reshape(-1).view(numpy.uint8))
+        else:
+            self._array = array.array(typecode, [fill_value]) * num_cells
+            self.data = memoryview(self._array).cast('B')
+            self.image = self.data.cast(typecode, self.shape)
+
+        self.fill = memoryview(bytearray(_packCell(fill_value, self.cell_size)) * num_cells)
+
+    #Decodes the image block at offset and returns the offset just past it
+    def decode(self, frame_data, offset):
+        if offset + 2 > len(frame_data):
+            raise SenselFrameDecompressionError(0, len(self.data))
+        payload_size = _convertBufToVal(frame_data[offset:offset + 2])
+        start = offset + 2
+        end = start + payload_size
+        if end > len(frame_data):
+            raise SenselFrameDecompressionError(len(frame_data) - start, payload_size)
+
+        if payload_size == len(self.data):
+            self.data[:] = memoryview(frame_data)[start:end]
+        else:
+            _expandRuns(frame_data, start, end, self.data, self.cell_size, self.fill)
+
+        if self._array is not None and self.cell_size > 1 and sys.byteorder == 'big':
+            self._array.byteswap()
+        return end
+
+#Pixel count and bounding box of every label in a labels image, built in one
+#pass over the image so contacts can be matched to their blobs without
+#rescanning it. Bounding boxes are (min_row, min_col, max_row, max_col).
+#Labels images are only decoded with SENSEL_IMAGE_DECODING enabled, so this
+#is only checked against sensel_sim's label maps.
+class SenselLabelRegions():
+
+    def __init__(self, label_image, nrows, ncols):
+        self._regions = {}
+        if numpy is not None:
+            self._indexArray(label_image.reshape(-1), ncols)
+        else:
+            self._indexBuffer(label_image.cast('B'), nrows, ncols)
+
+    def _indexArray(self, labels, ncols):
+        cells = numpy.flatnonzero(labels != SENSEL_NULL_LABEL)
+        if len(cells) == 0:
+            return
+        values = labels[cells]
+        rows = cells // ncols
+        cols = cells % ncols
+        counts = numpy.bincount(values, minlength=256)
+        bounds = numpy.empty((4, 256), dtype=numpy.int64)
+        bounds[:2] = len(labels)
+        bounds[2:] = -1
+        numpy.minimum.at(bounds[0], values, rows)
+        numpy.minimum.at(bounds[1], values, cols)
+        numpy.maximum.at(bounds[2], values, rows)
+        numpy.maximum.at(bounds[3], values, cols)
+        for label in numpy.flatnonzero(counts):
+            self._regions[int(label)] = (int(counts[label]), tuple(int(b) for b in bounds[:, label]))
+
+    def _indexBuffer(self, labels, nrows, ncols):
+        null_row = bytes(bytearray([SENSEL_NULL_LABEL]) * ncols)
+        for r in range(nrows):
+            row = labels[r * ncols:(r + 1) * ncols].tobytes()
+            if row == null_row:
+                continue
+            for label in set(bytearray(row)):
+                if label == SENSEL_NULL_LABEL:
+                    continue
+                marker = bytes(bytearray([label]))
+                first = row.find(marker)
+                last = row.rfind(marker)
+                region = self._regions.get(label)
+                if region is None:
+                    self._regions[label] = (row.count(marker), (r, first, r, last))
+                else:
+                    (count, (min_row, min_col, max_row, max_col)) = region
+                    self._regions[label] = (count + row.count(marker),
+                                            (min_row, min(min_col, first), r, max(max_col, last)))
+
+    def labels(self):
+        return sorted(self._regions)
+
+    def pixelCount(self, label):
+        region = self._regions.get(label)
+        return region[0] if region else 0
+
+    def boundingBox(self, label):
+        region = self._regions.get(label)
+        return region[1] if region else None
+
+    #Contacts are labelled with their id in the labels image
+    def contactRegion(self, contact):
+        return self.boundingBox(contact.id)
+
+    def __contains__(self, label):
+        return label in self._regions
+
+    def __len__(self):
+        return len(self._regions)
+
+#A parsed frame: the (lost_frame_count, force_image, label_image, contacts)
+#tuple, plus the frame's position on the sensor clock. frame_index counts
+#scans since startScanning, including lost frames, and sensor_time is
+#frame_index times the scan period (s). Both are None if the frame rate
+#isn't known.
+class SenselFrame(tuple):
+
+    def __new__(cls, lost_frame_count, force_image, label_image, contacts, frame_index=None, sensor_time=None):
+        frame = tuple.__new__(cls, (lost_frame_count, force_image, label_image, contacts))
+        frame.frame_index = frame_index
+        frame.sensor_time = sensor_time
+        return frame
+
+    #Copies and pickles keep frame_index, sensor_time and any other attributes
+    #(e.g. the seq of frames from sensel_shm)
+    def __reduce__(self):
+        (lost_frame_count, force_image, label_image, contacts) = self
+        return (_unpickleFrame, (lost_frame_count, _pickleImage(force_image), _pickleImage(label_image), contacts),
+                self.__dict__)
+
+#memoryview images (no numpy) can't be pickled, so frames carry their bytes
+_PickledImage = collections.namedtuple('_PickledImage', 'data format shape')
+
+def _pickleImage(image):
+    if isinstance(image, memoryview):
+        return _PickledImage(image.tobytes(), image.format, image.shape)
+    return image
+
+def _unpickleFrame(lost_frame_count, force_image, label_image, contacts):
+    images = [memoryview(bytearray(image.data)).cast(image.format, image.shape)
+              if isinstance(image, _PickledImage) else image
+              for image in (force_image, label_image)]
+    return SenselFrame(lost_frame_count, images[0], images[1], contacts)
+
+#Latency histogram with power of two microsecond buckets: bucket i counts
+#samples under 2**i us, so recording a sample is a couple of integer ops.
+class LatencyHistogram():
+
+    num_buckets = 32
+
+    def __init__(self):
+        self.buckets = [0] * self.num_buckets
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds):
+        us = int(seconds * 1e6)
+        self.buckets[min(max(us, 0).bit_length(), self.num_buckets - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    #Upper bound (s) of the bucket holding the p-th percentile sample
+    def percentile(self, p):
+        if self.count == 0:
+            return None
+        rank = p / 100.0 * self.count
+        seen = 0
+        for (i, n) in enumerate(self.buckets):
+            seen += n
+            if n and seen >= rank:
+                return min((1 << i) / 1e6, self.max)
+        return self.max
+
+    def summary(self):
+        if self.count == 0:
+            return {'count': 0}
+        return {'count': self.count, 'mean': self.total / self.count, 'min': self.min, 'max': self.max,
+                'p50': self.percentile(50), 'p90': self.percentile(90), 'p99': self.percentile(99),
+                'buckets': list(self.buckets)}
+
+#Per-stage latency histograms and counters for frames and gesture events.
+#SenselDevice fills in read/queue/parse (see enableLatencyStats) and the
+#gesture handlers add dispatch/total when they fire an event. With
+#dump_interval set, the stats are written out every dump_interval seconds
+#by dump (default: stdout).
+class SenselLatencyStats():
+
+    def __init__(self, dump_interval=None, dump=None):
+        self.dump_interval = dump_interval
+        self.dump = dump
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.histograms = dict((stage, LatencyHistogram()) for stage in SENSEL_LATENCY_STAGES)
+            self.counters = {'frames': 0, 'lost_frames': 0, 'events': 0}
+            self._frame_read_time = None
+            self._frame_parsed_time = None
+            self._next_dump = None if self.dump_interval is None else _perf_counter() + self.dump_interval
+
+    def frameRead(self, read_seconds):
+        with self._lock:
+            self.histograms['read'].add(read_seconds)
+
+    def frameParsed(self, read_time, parse_start, parse_end, lost_frame_count):
+        with self._lock:
+            if read_time is not None:
+                self.histograms['queue'].add(parse_start - read_time)
+            self.histograms['parse'].add(parse_end - parse_start)
+            self.counters['frames'] += 1
+            self.counters['lost_frames'] += lost_frame_count
+            self._frame_read_time = read_time
+            self._frame_parsed_time = parse_end
+        self._dumpIfDue(parse_end)
+
+    #Called when a gesture event fires for the frame that was parsed last
+    def eventFired(self):
+        now = _perf_counter()
+        with self._lock:
+            self.counters['events'] += 1
+            if self._frame_parsed_time is not None:
+                self.histograms['dispatch'].add(now - self._frame_parsed_time)
+            if self._frame_read_time is not None:
+                self.histograms['total'].add(now - self._frame_read_time)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            for (stage, histogram) in self.histograms.items():
+                stats[stage] = histogram.summary()
+        return stats
+
+    def format(self):
+        stats = self.stats()
+        lines = ["frames: %d, lost frames: %d, events: %d" % (stats['frames'], stats['lost_frames'], stats['events'])]
+        for stage in SENSEL_LATENCY_STAGES:
+            summary = stats[stage]
+            if summary['count']:
+                lines.append("%-8s n=%-8d mean %8.3f ms  p50 %8.3f ms  p99 %8.3f ms  max %8.3f ms" %
+                             (stage, summary['count'], summary['mean'] * 1e3, summary['p50'] * 1e3,
+                              summary['p99'] * 1e3, summary['max'] * 1e3))
+        return "\n".join(lines)
+
+    def _dumpIfDue(self, now):
+        if self._next_dump is None or now < self._next_dump:
+            return
+        self._next_dump = now + self.dump_interval
+        text = self.format()
+        if self.dump is not None:
+            self.dump(text)
+        else:
+            sys.stdout.write(text + "\n")
+
 class SenselDevice():
 
     def __init__(self):
-        pass
+        self._serial = None
+        self._stream = None
+        self._serial_lock = threading.RLock()
+        self.port_name = None
+
+        self.sensor_nrows = -1
+        self.sensor_ncols = -1
+        self.sensor_x_to_mm_factor = -1
+        self.sensor_y_to_mm_factor = -1
+        self._mm_factors = (-1, -1)
+
+        self._sthread = None
+        self._scan_buffer = None
+        self._scan_buffering_enabled = False
+        self._scan_num_buffers = 0
+        self._scan_poll_target = 1 #Frames the scan thread aims to collect per poll
+        self._scan_max_poll_delay = None
+        self._scan_thread_exit = threading.Event()
+        self._scan_thread_resume = threading.Event() #Cleared while the scan thread is paused
+        self._scan_thread_resume.set()
+        self._scan_queue_size = SENSEL_SCAN_QUEUE_SIZE
+        self._scan_queue_policy = SENSEL_SCAN_DROP_OLDEST
+        self._frame_scan_index = None #Sensor clock index of the frame being parsed, set by the scan thread
+        self._read_pipeline_depth = SENSEL_READ_PIPELINE_DEPTH
+        self._image_decoding = SENSEL_IMAGE_DECODING
+        self._frame_requests_in_flight = 0
+        self._pipelined_frames = collections.deque() #(frame_data, read_time) drained ahead of other commands
+        self.resetFrameCounters()
+
+        self._force_image = None
+        self._label_image = None
+        self._last_label_image = None
+        self._label_regions = None
+
+        #Sensor clock, see SenselFrame
+        self._frame_period = None
+        self._frame_index = -1
+
+        self._frame_recorder = None
+        self._frame_publisher = None
+        self._register_cache = {} #(reg, size) -> bytes, size 0 for VSP reads
+
+        self.latency_stats = None
+        self._last_read_time = None #When the last frame finished arriving (scan/serial side)
+        self._frame_read_time = None #Arrival time of the frame being parsed (reader side)
 
     def _openAndProbePort(self, port_name):
-        global sensel_serial
 
         logging.info("Opening port " + str(port_name))
+        with _ports_in_use_lock:
+            if port_name in _ports_in_use:
+                logging.info("Skipping %s, it's used by another SenselDevice" % port_name)
+                return False
         try:
-            sensel_serial.port=port_name
-            sensel_serial.open()
-            sensel_serial.flushInput()
+            self._serial.port=port_name
+            self._serial.open()
+            self._serial.flushInput()
+            self._stream.clear()
             resp = self.readReg(0x00, 6)
         except SenselRegisterReadError:
             logging.warning("Failed to read magic register")
-            sensel_serial.close()
+            self._serial.close()
             return False
         except Exception:
             e = sys.exc_info()[1]
@@ -203,66 +786,100 @@ class SenselDevice():
 
         if(resp == SENSEL_MAGIC):
             logging.info("Found sensel sensor at " + str(port_name))
+            with _ports_in_use_lock:
+                _ports_in_use.add(port_name)
+            self.port_name = port_name
             return True
         else:
             logging.info("Probe didn't read out magic (%s)" % resp)
-            sensel_serial.close()
+            self._serial.close()
             return False
         
-    def _openSensorWin(self):
+    def _openSensorWin(self, serial_number=None):
         logging.info("Opening device on WIN architecture")
-        for i in range(50):
-            if self._openAndProbePort(i):
-                logging.warning("Found sensor on port COM%s" % i)
-                return True
-        return False
+        return self._openFirstSensor((list(range(50)),), serial_number)
 
-    def _openSensorMac(self):
+    def _openSensorMac(self, serial_number=None):
         logging.info("Opening device on MAC architecture")
-        port_name_list = glob.glob('/dev/tty.usbmodem*') + glob.glob('/dev/tty*') + glob.glob('/dev/cu*')
-        for port_name in port_name_list:
-            if self._openAndProbePort(port_name):
-                logging.warning("Found sensor on port %s" % port_name)
-                return True
-        return False
-
+        usb_ports = glob.glob('/dev/tty.usbmodem*')
+        other_ports = glob.glob('/dev/tty*') + glob.glob('/dev/cu*')
+        return self._openFirstSensor((usb_ports, other_ports), serial_number)
 
-    def _openSensorLinux(self):
+    def _openSensorLinux(self, serial_number=None):
         logging.info("Opening device on LINUX architecture")
         port_name_list = glob.glob('/dev/ttyACM*') + glob.glob('/dev/ttyUSB*') + glob.glob('/dev/ttyS*')
-        for port_name in port_name_list:
-            if self._openAndProbePort(port_name):
-                logging.warning("Found sensor on port %s" % port_name)
+        #Ports whose USB vendor is Sensel go first, the rest are a fallback
+        sensel_ports = [port_name for port_name in port_name_list
+                        if (_sysfsUSBId(port_name) or (None,))[0] in SENSEL_USB_VENDOR_IDS]
+        other_ports = [port_name for port_name in port_name_list if port_name not in sensel_ports]
+        return self._openFirstSensor((sensel_ports, other_ports), serial_number)
+
+    #Probes the cached ports, then each group of candidate ports in turn (all
+    #ports of a group in parallel), and opens the first one that answers as a
+    #sensor (with the given serial number, if there is one)
+    def _openFirstSensor(self, port_groups, serial_number=None):
+        tried = set()
+        for port_names in (_cachedPortNames(serial_number),) + tuple(port_groups):
+            port_names = [port_name for port_name in port_names if port_name not in tried]
+            tried.update(port_names)
+            opened = False
+            for (port_name, port) in _probePorts(port_names):
+                if not opened and self._adoptPort(port_name, port, serial_number):
+                    opened = True
+                else:
+                    port.close()
+            if opened:
                 return True
         return False
 
+    #Takes over a serial port that answered a probe
+    def _adoptPort(self, port_name, port, serial_number):
+        with _ports_in_use_lock:
+            if port_name in _ports_in_use:
+                return False
+            _ports_in_use.add(port_name)
+        port.timeout = SENSEL_TIMEOUT
+        self._attachSerial(port)
+        self.port_name = port_name
+
+        try:
+            found_serial_number = _serialNumberKey(self.getSerialNumber())
+        except SenselError:
+            found_serial_number = None
+        if serial_number is not None and found_serial_number != serial_number:
+            logging.info("Skipping %s, it's sensor %s" % (port_name, found_serial_number))
+            with _ports_in_use_lock:
+                _ports_in_use.discard(port_name)
+            self.port_name = None
+            return False
+
+        if found_serial_number is not None:
+            _savePortCache(found_serial_number, port_name)
+        logging.warning("Found sensor on port %s" % port_name)
+        return True
+
     #TODO: make this static
     def _initLogging(self):
         FORMAT = "[%(filename)s:%(lineno)s - %(funcName)s() ] %(message)s (%(levelname)s)"
         logging.basicConfig(stream=sys.stderr, level=SENSEL_LOGGING_LEVEL, format=FORMAT)
 
     def _serialRead(self, num_bytes):
-        resp = sensel_serial.read(num_bytes)
-        if(len(resp) != num_bytes):
-            raise SenselSerialReadError(len(resp), num_bytes)
-        return resp
+        return self._stream.read(num_bytes)
 
     def _serialWrite(self, data):
-        resp = sensel_serial.write(data)
+        resp = self._serial.write(data)
         if(resp != len(data)):
             raise SenselSerialWriteError(resp, len(data))
         return True;
 
     def _readByteValFromBuf(self, buf, idx):
-        if PY3:
-            return buf[idx]
-        else:
-            return ord(buf[idx])
+        return buf[idx]
 
     # TODO: Pass in None to do auto-detection
-    def openConnection(self, com_port=None):
-        global sensel_serial
-        global _serial_lock
+    #Opens com_port, or auto-detects the sensor when it's None. serial_number
+    #(as a string, e.g. from getSerialNumberString()) picks a specific sensor
+    #during auto-detection.
+    def openConnection(self, com_port=None, serial_number=None):
 
         self._initLogging()
 
@@ -270,14 +887,12 @@ class SenselDevice():
 
         logging.info("Initializing Sensel on " + platform_name + " platform")
 
-        sensel_serial = serial.Serial(
+        self._attachSerial(serial.Serial(
             baudrate=SENSEL_BAUD,\
                 parity=serial.PARITY_NONE,\
                 stopbits=serial.STOPBITS_ONE,\
                 bytesize=serial.EIGHTBITS,\
-                timeout=SENSEL_TIMEOUT)
-
-        _serial_lock = threading.RLock()
+                timeout=SENSEL_TIMEOUT))
 
         if(com_port != None):
             if platform_name == "Windows": #Windows serial open takes an integer indicating COM port number, so we need to extract that.
@@ -286,28 +901,42 @@ class SenselDevice():
             resp = self._openAndProbePort(com_port)
         else: #Auto-detect sensor
             if platform_name == "Windows":
-                resp = self._openSensorWin()
+                resp = self._openSensorWin(serial_number)
             elif platform_name == "Darwin":
-                resp = self._openSensorMac()
+                resp = self._openSensorMac(serial_number)
             else:
-                resp = self._openSensorLinux()
+                resp = self._openSensorLinux(serial_number)
 
         if resp == False:
             logging.error("Failed to open Sensel sensor!")
 
         return resp
 
+    #Opens a device over an existing serial-like object (anything with the
+    #pyserial port/open/read/write/in_waiting interface) instead of a port
+    #name, e.g. a sensel_sim.SimulatedSerial
+    def openSerialConnection(self, serial_port):
+        self._initLogging()
+        self._attachSerial(serial_port)
+        resp = self._openAndProbePort(serial_port.port)
+        if resp == False:
+            logging.error("Failed to open Sensel sensor!")
+        return resp
+
+    def _attachSerial(self, serial_port):
+        self._serial = serial_port
+        self._stream = _SerialStream(serial_port)
+        self._register_cache = {}
+
     def getDeviceInfo(self):
         return SenselDeviceInfo(self.readReg(SENSEL_REG_FW_PROTOCOL_VERSION, SENSEL_DEVICE_INFO_SIZE))
 
     def getSensorNumRowsCols(self):
-        global sensor_nrows
-        global sensor_ncols
 
-        if sensor_nrows == -1 or sensor_ncols == -1:
-            sensor_nrows = _convertBufToVal(self.readReg(SENSEL_REG_SENSOR_ROW_ACTIVE_COUNT, 1))
-            sensor_ncols = _convertBufToVal(self.readReg(SENSEL_REG_SENSOR_COL_ACTIVE_COUNT, 1))
-        return (sensor_nrows, sensor_ncols)
+        if self.sensor_nrows == -1 or self.sensor_ncols == -1:
+            self.sensor_nrows = _convertBufToVal(self.readReg(SENSEL_REG_SENSOR_ROW_ACTIVE_COUNT, 1))
+            self.sensor_ncols = _convertBufToVal(self.readReg(SENSEL_REG_SENSOR_COL_ACTIVE_COUNT, 1))
+        return (self.sensor_nrows, self.sensor_ncols)
 
     def getSensorActiveAreaDimensionsUM(self):
         width =  _convertBufToVal(self.readReg(SENSEL_REG_SENSOR_ACTIVE_AREA_WIDTH_UM, 4))
@@ -325,13 +954,13 @@ class SenselDevice():
 
     def getSerialNumber(self):
         serial_num_str = self.readRegVSP(SENSEL_REG_DEVICE_SERIAL_NUMBER)
-        if PY3:
-            serial_num_list = [ x for x in serial_num_str ]
-        else:
-            serial_num_list = [ ord(x) for x in serial_num_str ]
+        serial_num_list = [ x for x in serial_num_str ]
         serial_num_list.reverse()
         return serial_num_list
 
+    def getSerialNumberString(self):
+        return _serialNumberKey(self.getSerialNumber())
+
     def getBatteryVoltagemV(self):
         return _convertBufToVal(self.readReg(SENSEL_REG_BATTERY_VOLTAGE_MV, 2)) 
 
@@ -348,131 +977,372 @@ class SenselDevice():
         return self.writeReg(SENSEL_REG_SOFT_RESET, 1, bytearray([1]))
 
     def _populateDimensions(self):
-        global sensor_nrows
-        global sensor_ncols
-        global sensor_x_to_mm_factor
-        global sensor_y_to_mm_factor
-        (sensor_nrows, sensor_ncols) = self.getSensorNumRowsCols()
-        sensor_max_x = 256 * (sensor_ncols - 1)
-        sensor_max_y = 256 * (sensor_nrows - 1)
-        (sensor_width_um, sensor_height_um) = self.getSensorActiveAreaDimensionsUM()
+        #One round trip for all four registers, none once they're cached
+        (nrows, ncols, width, height) = (self.transaction()
+            .readReg(SENSEL_REG_SENSOR_ROW_ACTIVE_COUNT, 1)
+            .readReg(SENSEL_REG_SENSOR_COL_ACTIVE_COUNT, 1)
+            .readReg(SENSEL_REG_SENSOR_ACTIVE_AREA_WIDTH_UM, 4)
+            .readReg(SENSEL_REG_SENSOR_ACTIVE_AREA_HEIGHT_UM, 4)
+            .execute())
+        self.sensor_nrows = _convertBufToVal(nrows)
+        self.sensor_ncols = _convertBufToVal(ncols)
+        sensor_max_x = 256 * (self.sensor_ncols - 1)
+        sensor_max_y = 256 * (self.sensor_nrows - 1)
+        sensor_width_um = _convertBufToVal(width)
+        sensor_height_um = _convertBufToVal(height)
         sensor_width_mm  = sensor_width_um  / 1000.0
         sensor_height_mm = sensor_height_um / 1000.0
-        sensor_x_to_mm_factor = sensor_width_mm  / sensor_max_x
-        sensor_y_to_mm_factor = sensor_height_mm / sensor_max_y
+        self.sensor_x_to_mm_factor = sensor_width_mm  / sensor_max_x
+        self.sensor_y_to_mm_factor = sensor_height_mm / sensor_max_y
+        self._mm_factors = (self.sensor_x_to_mm_factor, self.sensor_y_to_mm_factor)
 
-    def _setBufferControl(self, num_buffers):
-        global _scan_buffering_enabled
-        global _scan_num_buffers
+    #Adds the buffer control write to transaction
+    def _setBufferControl(self, num_buffers, transaction):
 
         if num_buffers > 255:
             logging.error("Invalid num buffers! (%d)" % num_buffers)
             return
 
-        _scan_buffering_enabled = (num_buffers > 0)
-        _scan_num_buffers = num_buffers
+        self._scan_buffering_enabled = (num_buffers > 0)
+        self._scan_num_buffers = num_buffers
 
-        #print ("BUFFERING ENABLED" if _scan_buffering_enabled else "BUFFERING DISABLED")
-        return self.writeReg(SENSEL_REG_SCAN_BUFFER_CONTROL, 1, bytearray([num_buffers]))
+        #print ("BUFFERING ENABLED" if self._scan_buffering_enabled else "BUFFERING DISABLED")
+        transaction.writeReg(SENSEL_REG_SCAN_BUFFER_CONTROL, 1, bytearray([num_buffers]))
 
-    def startScanning(self, num_buffers):
-        global _scan_buffering_enabled
-        global _scan_thread_exit_requested
-        global _sthread
-        global _scan_buffer
+    #In buffered mode (num_buffers > 0) the scan thread polls the device for
+    #frames, adjusting its poll delay so each poll returns about
+    #poll_target_frames frames. The default of 1 reads each frame as soon as
+    #it's ready. Larger targets batch frames into fewer polls, trading latency
+    #(about poll_target_frames / 2 frame periods more) for scan thread CPU.
+    #The delay stays under max_poll_delay (s), by default half of num_buffers
+    #frame periods. A longer delay can let the device buffers overflow.
+    def startScanning(self, num_buffers, poll_target_frames=1, max_poll_delay=None):
 
         #We need to assign the nrows/ncols if we haven't already
         self._populateDimensions()
-        self._setBufferControl(num_buffers)
-
-        resp = self.writeReg(SENSEL_REG_SCAN_ENABLED, 1, bytearray([0x01]))
 
-        if (not _scan_buffering_enabled) or (resp):
+        #Read the frame rate, configure buffering and enable scanning in a
+        #single round trip
+        transaction = self.transaction().readReg(SENSEL_REG_SCAN_FRAME_RATE, 1)
+        self._setBufferControl(num_buffers, transaction)
+        transaction.writeReg(SENSEL_REG_SCAN_ENABLED, 1, bytearray([0x01]))
+        results = transaction.execute()
+        resp = results[-1]
+        self._resetSensorClock(_convertBufToVal(results[0]))
+        self._pipelined_frames.clear()
+
+        if (not self._scan_buffering_enabled) or (resp):
             return resp
 
         #We get here if buffering is enabled and we've successfully started scanning
         #kick off scanning thread
 
-        _scan_thread_exit_requested = False
-        if PY3:
-            _scan_buffer = queue.Queue()
-        else:
-            _scan_buffer = Queue.Queue()
-        _sthread = threading.Thread(target=self._scanThread, name="SCAN_THREAD", args=())
-        _sthread.start()
+        self._scan_poll_target = max(1, poll_target_frames)
+        self._scan_max_poll_delay = max_poll_delay
+        self._scan_thread_exit.clear()
+        self._scan_buffer = queue.Queue(self._scan_queue_size)
+        self._sthread = threading.Thread(target=self._scanThread, name="SCAN_THREAD", args=())
+        self._sthread.start()
 
     def stopScanning(self):
-        global _scan_buffering_enabled
-        global _scan_thread_exit_requested
-        global _sthread
 
-        if _scan_buffering_enabled: #stop scanning thread
-            _scan_thread_exit_requested = True
-            _sthread.join()
+        if self._scan_buffering_enabled: #stop scanning thread
+            self._scan_thread_exit.set()
+            self._scan_thread_resume.set() #Wake it up if it's paused
+            self._sthread.join()
 
         return self.writeReg(SENSEL_REG_SCAN_ENABLED, 1, bytearray([0x00]))
 
     def _scanThread(self):
-        global _scan_thread_exit_requested
-        global _scan_thread_pause_requested
-        global _scan_buffer
-        global _serial_lock
 
         logging.info("Scan thread start")
 
-        frame_rate = self.getFrameRate()
-        nominal_period = 1.0 / frame_rate
-        read_delay = 0.25 * nominal_period
-        logging.info("using read_delay: %f" % read_delay)
+        nominal_period = self._frame_period or 1.0 / self.getFrameRate()
+        #By default poll fast enough that the device buffers never fill
+        min_delay = 0.25 * nominal_period
+        max_delay = self._scan_max_poll_delay
+        if max_delay is None:
+            max_delay = 0.5 * self._scan_num_buffers * nominal_period
+        max_delay = max(min_delay, max_delay)
+        target_frames = self._scan_poll_target
+        read_delay = min_delay
+        logging.info("using read_delay: %f - %f" % (min_delay, max_delay))
+        #Sensor clock index of each frame, counted here rather than by the
+        #reader so frames dropped from the queue still advance the clock
+        scan_index = -1
+        last_frame_time = _perf_counter()
+
+        while not self._scan_thread_exit.is_set():
+            self._scan_thread_resume.wait()
+            if self._scan_thread_exit.is_set():
+                break
+
+            frames = []
+            with self._serial_lock:
+                self._sendFrameReadReq()
+                #Read until we get a buffer end
+                while True:
+                    frame_data = self._readFrameData()
+                    if frame_data:
+                        scan_index += 1 + _frameLostCount(frame_data)
+                        frames.append((frame_data, self._last_read_time, scan_index))
+                    else:
+                        break
+            #Queued outside the serial lock so a blocked queue doesn't hold up
+            #register access
+            for item in frames:
+                if not self._queueScannedFrame(item):
+                    break
+            num_frames = len(frames)
 
-        while not _scan_thread_exit_requested:
-            while _scan_thread_pause_requested:
-                pass
+            #Polls faster than the frame rate often come back empty, so only
+            #back off once frames have stopped arriving
+            now = _perf_counter()
+            if num_frames:
+                last_frame_time = now
+            if num_frames or now - last_frame_time > 2 * nominal_period:
+                read_delay = _nextReadDelay(read_delay, num_frames, target_frames, min_delay, max_delay)
+            self._scan_thread_exit.wait(read_delay)
 
-            _serial_lock.acquire()
-            self._sendFrameReadReq()
-            #Read until we get a buffer end
-            while True:
-                frame_data = self._readFrameData()
-                if frame_data:
-                    _scan_buffer.put(frame_data)
-                else:
-                    break
+        logging.info("Scan thread exit")
 
-            _serial_lock.release()
+    #Returns False if the scan thread was stopped while waiting for room
+    def _queueScannedFrame(self, item):
+        scan_buffer = self._scan_buffer
+        counters = self._frame_counters
+        policy = self._scan_queue_policy
+        while True:
+            try:
+                scan_buffer.put_nowait(item)
+                break
+            except queue.Full:
+                pass
+            if policy == SENSEL_SCAN_DROP_NEWEST:
+                counters['host_dropped'] += 1
+                return True
+            if policy == SENSEL_SCAN_DROP_OLDEST:
+                try:
+                    scan_buffer.get_nowait()
+                    scan_buffer.task_done()
+                    counters['host_dropped'] += 1
+                except queue.Empty: #The reader got there first
+                    pass
+            else:
+                try:
+                    scan_buffer.put(item, True, 0.1)
+                    break
+                except queue.Full:
+                    if self._scan_thread_exit.is_set():
+                        return False
+        counters['queue_max_depth'] = max(counters['queue_max_depth'], scan_buffer.qsize())
+        return True
 
-            time.sleep(read_delay)
+    #In buffered mode, block waits (up to timeout seconds, or forever if timeout
+    #is None) for the scan thread to queue a frame. None is returned if no frame
+    #arrives in time, or right away when block is False and the queue is empty.
+    #Unbuffered reads always do a synchronous read and ignore block/timeout.
+    def readFrame(self, block=True, timeout=None):
+        frame_data = self._readRawFrame(block, timeout)
+        if frame_data is None:
+            return None
+        return self._parseRawFrame(frame_data)
+
+    #Reads the next frame like readFrame, then everything else that's already
+    #queued, up to max_n frames in total. Returns an empty list on timeout.
+    #Every frame but the last gets its own copy of its images, since parsing
+    #the next frame reuses the image buffer.
+    def readFrames(self, max_n=None, block=True, timeout=None):
+        frames = []
+        frame_data = self._readRawFrame(block, timeout)
+        while frame_data is not None:
+            if frames:
+                frames[-1] = copyFrameImages(frames[-1])
+            frames.append(self._parseRawFrame(frame_data))
+            if (max_n is not None and len(frames) >= max_n) or not self._scan_buffering_enabled:
+                break
+            frame_data = self._readRawFrame(False)
+        return frames
+
+    #Async iterator over frames for asyncio code (Python 3 only, see
+    #sensel_asyncio). Scanning must already be started.
+    def frames(self, maxsize=None):
+        import sensel_asyncio
+        return sensel_asyncio.FrameStream(self, maxsize)
+
+    #Appends every frame read from now on to a recording file that
+    #sensel_record.SenselReplayDevice can play back. Returns the recorder.
+    def startRecording(self, path):
+        import sensel_record
+        if self.sensor_nrows == -1:
+            self._populateDimensions()
+        self.stopRecording()
+        frame_rate = 1.0 / self._frame_period if self._frame_period else self.getFrameRate()
+        self._frame_recorder = sensel_record.SenselRecorder(path, self.sensor_nrows, self.sensor_ncols,
+                                                            self._mm_factors, frame_rate)
+        return self._frame_recorder
+
+    def stopRecording(self):
+        recorder = self._frame_recorder
+        self._frame_recorder = None
+        if recorder is not None:
+            recorder.close()
+
+    #Publishes every frame read from now on to a shared memory ring that other
+    #processes can read with sensel_shm.SenselFrameSubscriber(name) (Python
+    #3.8+). Returns the publisher.
+    def startPublishing(self, name=None, slots=None, images=True):
+        import sensel_shm
+        if self.sensor_nrows == -1:
+            self._populateDimensions()
+        self.stopPublishing()
+        frame_rate = 1.0 / self._frame_period if self._frame_period else self.getFrameRate()
+        self._frame_publisher = sensel_shm.SenselFramePublisher(
+            name, self.sensor_nrows, self.sensor_ncols, self._mm_factors, frame_rate,
+            sensel_shm.DEFAULT_SLOTS if slots is None else slots, images)
+        return self._frame_publisher
+
+    def stopPublishing(self):
+        publisher = self._frame_publisher
+        self._frame_publisher = None
+        if publisher is not None:
+            publisher.close()
+
+    #Like readContacts, but returns the contacts as a single ContactBatch
+    def readContactBatch(self, block=True, timeout=None):
+        frame_data = self._readRawFrame(block, timeout)
+        if frame_data is None:
+            return None
+        return self._parseRawFrame(frame_data, contact_batch=True)[3]
 
-        logging.info("Scan thread exit")
+    #Regions of the labels image in the last frame read, or None if that frame
+    #had no labels (see setImageDecoding). The index is built on first use and shared by later calls.
+    def getLabelRegions(self):
+        if self._label_regions is None and self._last_label_image is not None:
+            (nrows, ncols) = self._label_image.shape
+            self._label_regions = SenselLabelRegions(self._last_label_image, nrows, ncols)
+        return self._label_regions
 
     #The user doesn't need to know that we're sending a write request
-    def readFrame(self):
-        global _scan_buffering_enabled
-        global _scan_buffer
-        global _serial_lock
+    def _readRawFrame(self, block=True, timeout=None):
 
-        if _scan_buffering_enabled:
-            if _scan_buffer.empty():
+        if self._scan_buffering_enabled:
+            try:
+                (frame_data, self._frame_read_time, self._frame_scan_index) = self._scan_buffer.get(block, timeout)
+            except queue.Empty:
                 return None
-            else:
-                parsed_data = self._parseFrameData(_scan_buffer.get())
-                _scan_buffer.task_done()
-                return parsed_data
+            self._scan_buffer.task_done()
+            return frame_data
         else:
-            #For non-buffered frame reads, we simply issue a synchronous read
-            _serial_lock.acquire()
-            self._sendFrameReadReq()
+            #For non-buffered frame reads, we simply issue a synchronous read,
+            #then top up the requests kept in flight for the next reads
+            with self._serial_lock:
+                if self._pipelined_frames:
+                    (frame_data, self._frame_read_time) = self._pipelined_frames.popleft()
+                else:
+                    if not self._frame_requests_in_flight:
+                        self._sendFrameReadReq()
+                        self._frame_requests_in_flight += 1
+                    self._frame_requests_in_flight -= 1
+                    frame_data = self._readFrameData()
+                    self._frame_read_time = self._last_read_time
+                while self._frame_requests_in_flight < self._read_pipeline_depth:
+                    self._sendFrameReadReq()
+                    self._frame_requests_in_flight += 1
+                self._frame_scan_index = None
+                return frame_data
+
+    #Reads the responses to frame requests still in flight so the next command
+    #gets its own response. The frames are kept for the next reads.
+    def _drainFrameRequests(self):
+        while self._frame_requests_in_flight:
+            self._frame_requests_in_flight -= 1
             frame_data = self._readFrameData()
-            _serial_lock.release()
-            return self._parseFrameData(frame_data)
+            self._pipelined_frames.append((frame_data, self._last_read_time))
+
+    #Parses a frame from _readRawFrame, timing it when latency stats are on
+    def _parseRawFrame(self, frame_data, contact_batch=False):
+        #Frames from the scan thread come with their sensor clock index, which
+        #also counts any frames dropped from the scan queue
+        if self._frame_scan_index is not None:
+            self._frame_index = self._frame_scan_index - 1 - _frameLostCount(frame_data)
+            self._frame_scan_index = None
+        stats = self.latency_stats
+        if stats is None:
+            frame = self._parseFrameData(frame_data, contact_batch)
+        else:
+            parse_start = _perf_counter()
+            frame = self._parseFrameData(frame_data, contact_batch)
+            stats.frameParsed(self._frame_read_time, parse_start, _perf_counter(), frame[0])
+        if self._frame_publisher is not None:
+            self._frame_publisher.publish(frame, frame_data)
+        return frame
+
+    #Starts collecting per-stage latency histograms (see SenselLatencyStats),
+    #replacing any stats collected so far. Returns the stats object.
+    def enableLatencyStats(self, dump_interval=None):
+        self.setLatencyStats(SenselLatencyStats(dump_interval))
+        return self.latency_stats
+
+    def setLatencyStats(self, latency_stats):
+        self._last_read_time = None
+        self._frame_read_time = None
+        self.latency_stats = latency_stats
+
+    def disableLatencyStats(self):
+        self.setLatencyStats(None)
+
+    #Snapshot of the latency stats as a dict, or None if they aren't enabled
+    def stats(self):
+        if self.latency_stats is None:
+            return None
+        return self.latency_stats.stats()
+
+    #Number of frame requests unbuffered reads keep in flight after returning a
+    #frame. With depth 1 the next frame is requested before the current one
+    #is parsed, so the serial round trip overlaps parsing and handling.
+    #Frames are still returned in order, but each can be up to depth frames
+    #older than with a plain request/response read.
+    def setReadPipelineDepth(self, depth):
+        if depth < 0:
+            raise ValueError("Read pipeline depth must be >= 0")
+        self._read_pipeline_depth = depth
+
+    #Turns decoding of pressure and labels images on or off, see
+    #SENSEL_IMAGE_DECODING
+    def setImageDecoding(self, enabled):
+        self._image_decoding = enabled
+
+    #Sets the size and overflow policy (SENSEL_SCAN_*) of the buffered mode
+    #frame queue. Takes effect at the next startScanning.
+    def setScanQueue(self, maxsize=SENSEL_SCAN_QUEUE_SIZE, policy=SENSEL_SCAN_DROP_OLDEST):
+        if policy not in (SENSEL_SCAN_DROP_OLDEST, SENSEL_SCAN_DROP_NEWEST, SENSEL_SCAN_BLOCK):
+            raise ValueError("Unknown scan queue policy %r" % (policy,))
+        self._scan_queue_size = maxsize
+        self._scan_queue_policy = policy
+
+    #Frames read off the wire, frames the device reported lost (it had no
+    #buffer free), frames the host dropped from a full scan queue, and the
+    #scan queue's current and highest depth since the counters were reset
+    def getFrameCounters(self):
+        counters = dict(self._frame_counters)
+        scan_buffer = self._scan_buffer
+        counters['queue_depth'] = scan_buffer.qsize() if scan_buffer is not None else 0
+        counters['queue_size'] = self._scan_queue_size
+        return counters
+
+    def resetFrameCounters(self):
+        self._frame_counters = {'frames_read': 0, 'device_lost': 0, 'host_dropped': 0, 'queue_max_depth': 0}
+
+    #Restarts the sensor clock at the first frame read from now on
+    def _resetSensorClock(self, frame_rate):
+        self._frame_period = 1.0 / frame_rate if frame_rate > 0 else None
+        self._frame_index = -1
 
     def pauseScanThread(self):
-        global _scan_thread_pause_requested
-        _scan_thread_pause_requested = True
+        self._scan_thread_resume.clear()
 
     def resumeScanThread(self):
-        global _scan_thread_pause_requested
-        _scan_thread_pause_requested = False
+        self._scan_thread_resume.set()
 
     def _sendFrameReadReq(self):
         #Send first read request
@@ -481,11 +1351,13 @@ class SenselDevice():
 
     #Reads frame data, and verifies checksum
     def _readFrameData(self):
-        global _scan_buffering_enabled
 
         ack = _convertBufToVal(self._serialRead(1))
+        stats = self.latency_stats
+        if stats is not None:
+            read_start = _perf_counter()
 
-        if _scan_buffering_enabled and (ack == SENSEL_PT_BUFFERED_FRAME_END):
+        if self._scan_buffering_enabled and (ack == SENSEL_PT_BUFFERED_FRAME_END):
             return None
 
         if(ack != SENSEL_PT_FRAME and ack != SENSEL_PT_BUFFERED_FRAME):
@@ -499,57 +1371,88 @@ class SenselDevice():
         resp_checksum = _convertBufToVal(self._serialRead(1))
 
         if not self._verifyChecksum(frame_data, resp_checksum):
-            logging.error("Response checksum didn't match checksum (resp_checksum=%d, checksum=%d)" % 
-                          (resp_checksum, checksum))
             raise SenselSerialReadError(1, 1)
 
+        if stats is not None:
+            self._last_read_time = _perf_counter()
+            stats.frameRead(self._last_read_time - read_start)
+
+        counters = self._frame_counters
+        counters['frames_read'] += 1
+        counters['device_lost'] += _frameLostCount(frame_data)
+
+        if self._frame_recorder is not None:
+            self._frame_recorder.record(frame_data)
+
         return frame_data
 
 
-    def _parseFrameData(self, frame_data):
+    def _parseFrameData(self, frame_data, contact_batch=False):
         if len(frame_data) < 2:
             logging.error("Frame data size is less than 2!")
             raise SenselSerialReadError(2, 0)
 
+        #Work on a view of the frame so nothing is copied while parsing
+        frame_bytes = frame_data
+        frame_data = memoryview(frame_data)
+        force_image = None
+        label_image = None
+        self._label_regions = None
+
         #Pull off frame header info
         content_bit_mask = _convertBufToVal(frame_data[0])
         lost_frame_count = _convertBufToVal(frame_data[1])
-        frame_data = frame_data[2:]
+        offset = 2
 
         logging.info("content mask: %d, lost frames: %d" % (content_bit_mask, lost_frame_count))
 
         if content_bit_mask & SENSEL_FRAME_PRESSURE_FLAG:
             logging.info("Received pressure map")
-            raise NotImplementedError
+            if not self._image_decoding:
+                raise SenselUnsupportedImageError("pressure")
+            if self._force_image is None:
+                (nrows, ncols) = self.getSensorNumRowsCols()
+                self._force_image = _ImageBuffer(nrows, ncols, 'H', 0)
+            offset = self._force_image.decode(frame_bytes, offset)
+            force_image = self._force_image.image
 
         if content_bit_mask & SENSEL_FRAME_LABELS_FLAG:
             logging.info("Received labels map")
-            raise NotImplementedError
+            if not self._image_decoding:
+                raise SenselUnsupportedImageError("labels")
+            if self._label_image is None:
+                (nrows, ncols) = self.getSensorNumRowsCols()
+                self._label_image = _ImageBuffer(nrows, ncols, 'B', SENSEL_NULL_LABEL)
+            offset = self._label_image.decode(frame_bytes, offset)
+            label_image = self._label_image.image
 
         if content_bit_mask & SENSEL_FRAME_CONTACTS_FLAG:
             logging.info("Received contacts")
-            num_contacts = _convertBufToVal(frame_data[0])
-            frame_data = frame_data[1:]
-
-            contacts = []
+            num_contacts = _convertBufToVal(frame_data[offset])
+            offset += 1
 
-            for i in range(num_contacts):
-                contacts.append(SenselContact(frame_data[:SenselContact.data_size]))
-                frame_data = frame_data[SenselContact.data_size:]
+            if contact_batch:
+                contacts = ContactBatch(frame_data, num_contacts, offset, self._mm_factors)
+            else:
+                contacts = _lazyContacts(frame_data, num_contacts, offset, self._mm_factors)
         else:
             contacts = None
 
-        return (lost_frame_count, None, None, contacts)
+        #Frames the device dropped still took a scan period each
+        self._frame_index += 1 + lost_frame_count
+        if self._frame_period is None:
+            sensor_time = None
+        else:
+            sensor_time = self._frame_index * self._frame_period
+        if contact_batch and contacts is not None:
+            contacts.sensor_time = sensor_time
+
+        self._last_label_image = label_image
+        return SenselFrame(lost_frame_count, force_image, label_image, contacts, self._frame_index, sensor_time)
 
 
     def _verifyChecksum(self, data, checksum):
-        curr_sum = 0
-        for val in data:
-            if PY3:
-                curr_sum += val
-            else:
-                curr_sum += ord(val)
-        curr_sum = (curr_sum & 0xFF)
+        curr_sum = (sum(data) & 0xFF)
         if(checksum != curr_sum):
             logging.error("Checksum failed! (%d != %d)" % (checksum, curr_sum))
             return False
@@ -557,8 +1460,8 @@ class SenselDevice():
             logging.debug("Checksum passed! (%d == %d)" % (checksum, curr_sum))
         return True
 
-    def readContacts(self):
-        frame = self.readFrame()
+    def readContacts(self, block=True, timeout=None):
+        frame = self.readFrame(block, timeout)
         if frame:
             (rolling_frame_counter, force_image, label_image, contacts) = frame
             return contacts
@@ -566,12 +1469,62 @@ class SenselDevice():
             return None
 
     def readReg(self, reg, size):
-        global _serial_lock
+        return self.transaction().readReg(reg, size).execute()[0]
 
-        cmd = pack('BBB', SENSEL_READ_HEADER, reg, size)
-        _serial_lock.acquire()
+    def readRegVSP(self, reg):
+        return self.transaction().readRegVSP(reg).execute()[0]
+
+    #Starts a SenselRegisterTransaction on this device
+    def transaction(self):
+        return SenselRegisterTransaction(self)
+
+    def clearRegisterCache(self):
+        self._register_cache = {}
+
+    def _executeTransaction(self, ops):
+        results = [None] * len(ops)
+        cmds = []
+        pending = []
+        for (i, (op, reg, size, data)) in enumerate(ops):
+            if op != _REG_OP_WRITE and (reg, size) in self._register_cache:
+                results[i] = self._register_cache[(reg, size)]
+                continue
+            if op == _REG_OP_WRITE:
+                cmds.append(pack('BBB', SENSEL_WRITE_HEADER, reg, size))
+                cmds.append(bytes(data))
+                cmds.append(pack('B', sum(bytearray(data)) & 0xFF))
+                #Pipeline the error code read behind the write
+                cmds.append(pack('BBB', SENSEL_READ_HEADER, SENSEL_REG_ERROR_CODE, 1))
+            else:
+                cmds.append(pack('BBB', SENSEL_READ_HEADER, reg, size)) #size 0 for RVS
+            pending.append(i)
+
+        if not pending:
+            return results
+
+        with self._serial_lock:
+            self._drainFrameRequests()
+            try:
+                self._serialWrite(b''.join(cmds))
+            except SenselSerialWriteError:
+                raise _registerOpError(ops[pending[0]])
+            for i in pending:
+                (op, reg, size, data) = ops[i]
+                try:
+                    if op == _REG_OP_READ:
+                        results[i] = self._readRegResponse(reg, size)
+                    elif op == _REG_OP_READ_VSP:
+                        results[i] = self._readRegVSPResponse(reg)
+                    else:
+                        results[i] = self._writeRegResponse(reg, size, data)
+                except SenselError:
+                    #The responses still in flight can't be matched up anymore
+                    self._stream.clear()
+                    raise
+        return results
+
+    def _readRegResponse(self, reg, size):
         try:
-            self._serialWrite(cmd)
             ack = _convertBufToVal(self._serialRead(1))
             resp_size = _convertBufToVal(self._serialRead(2))
 
@@ -587,37 +1540,50 @@ class SenselDevice():
             resp_checksum = _convertBufToVal(self._serialRead(1))
         except (SenselSerialWriteError, SenselSerialReadError):
             raise SenselRegisterReadError(reg, size)
-        _serial_lock.release()
 
         if not self._verifyChecksum(resp, resp_checksum):
-            logging.error("Response checksum didn't match checksum (resp_checksum=%d, checksum=%d)" % (resp_checksum, checksum))
             raise SenselSerialReadError(1, 1)
 
+        self._cacheRegister(reg, size, resp)
         return resp
 
-    def readRegVSP(self, reg):
-        global _serial_lock
-
-        cmd = pack('BBB', SENSEL_READ_HEADER, reg, 0) # 0 for RVS
-        _serial_lock.acquire()
+    def _readRegVSPResponse(self, reg):
+        vsp_size = 0
         try:
-            self._serialWrite(cmd)
             ack = _convertBufToVal(self._serialRead(1))
             if(ack != SENSEL_PT_RVS_ACK):
                 logging.error("Failed to receive ACK from vsp read (received %d)" % ack)
-                raise SenselSerialReadError
+                raise SenselSerialReadError(1, 0)
             vsp_size = _convertBufToVal(self._serialRead(2))
             resp = self._serialRead(vsp_size)
             resp_checksum = _convertBufToVal(self._serialRead(1))
-        except SenselSerialReadError:
+        except (SenselSerialWriteError, SenselSerialReadError):
             raise SenselRegisterReadVSPError(reg, vsp_size)
-        _serial_lock.release()
 
         if not self._verifyChecksum(resp, resp_checksum):
             raise SenselRegisterReadVSPError(reg, vsp_size)
 
+        self._cacheRegister(reg, 0, resp)
         return resp
 
+    #Reads the write ack and the error code read that follows it
+    def _writeRegResponse(self, reg, size, data):
+        try:
+            resp = _convertBufToVal(self._serialRead(1)) #Read ACK
+        except (SenselSerialWriteError, SenselSerialReadError):
+            raise SenselRegisterWriteError(reg, size, data, False, 0)
+
+        error_code = _convertBufToVal(self._readRegResponse(SENSEL_REG_ERROR_CODE, 1))
+
+        if (resp != SENSEL_PT_WRITE_ACK):
+            raise SenselRegisterWriteError(reg, size, data, True, resp)
+
+        return error_code
+
+    def _cacheRegister(self, reg, size, value):
+        if reg in _IMMUTABLE_REGISTERS and reg + max(size, 1) - 1 in _IMMUTABLE_REGISTERS:
+            self._register_cache[(reg, size)] = value
+
     def readErrorCode(self):
         return _convertBufToVal(self.readReg(0xEC, 1))
 
@@ -633,45 +1599,339 @@ class SenselDevice():
 
 
     def writeReg(self, reg, size, data):
-        global _serial_lock
-        cmd = pack('BBB', SENSEL_WRITE_HEADER, reg, size)
-
-        checksum = 0
-        for d in data:
-            checksum += d
-        checksum &= 0xFF
+        return self.transaction().writeReg(reg, size, data).execute()[0]
 
-        _serial_lock.acquire()
-        try:
-            self._serialWrite(cmd)
-            self._serialWrite(data)
-            self._serialWrite(bytearray([checksum]))
-            resp = _convertBufToVal(self._serialRead(1)) #Read ACK
-        except (SenselSerialWriteError, SenselSerialReadError):
-            raise SenselRegisterWriteError(reg, size, data, False, 0)
+    def closeConnection(self):
+        self._serial.close()
+        self._register_cache = {}
+        self._frame_requests_in_flight = 0
+        self._pipelined_frames.clear()
+        with _ports_in_use_lock:
+            _ports_in_use.discard(self.port_name)
+
+
+#Batches register reads and writes so they cost a single serial round trip:
+#every command is sent before any response is read. Reads of cached
+#(immutable) registers don't go to the device at all.
+#
+#   (nrows, ncols) = device.transaction().readReg(SENSEL_REG_SENSOR_ROW_ACTIVE_COUNT, 1)\
+#                          .readReg(SENSEL_REG_SENSOR_COL_ACTIVE_COUNT, 1).execute()
+#
+#execute() returns one result per operation, in order: the bytes read, or
+#for writes the error code (read right behind each write, as writeReg does).
+class SenselRegisterTransaction():
+
+    def __init__(self, device):
+        self._device = device
+        self._ops = []
+
+    def __len__(self):
+        return len(self._ops)
 
-        if (resp != SENSEL_PT_WRITE_ACK):
-            raise SenselRegisterWriteError(reg, size, data, True, resp)
+    def readReg(self, reg, size):
+        self._ops.append((_REG_OP_READ, reg, size, None))
+        return self
 
-        ec = self.readErrorCode()
-        _serial_lock.release() #We should hold the lock through the EC read
-        return ec
+    def readRegVSP(self, reg):
+        self._ops.append((_REG_OP_READ_VSP, reg, 0, None))
+        return self
 
-    def closeConnection(self):
-        sensel_serial.close()
+    def writeReg(self, reg, size, data):
+        self._ops.append((_REG_OP_WRITE, reg, size, data))
+        return self
+
+    def execute(self):
+        ops = self._ops
+        self._ops = []
+        return self._device._executeTransaction(ops)
+
+#Reads frames from several scanning devices, one thread per device, and merges
+#them into a single queue of (device, frame) pairs.
+class SenselDevicePoller():
+
+    def __init__(self, devices, maxsize=0):
+        self.devices = list(devices)
+        self._frames = queue.Queue(maxsize)
+        self._exit = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self._exit.clear()
+        for device in self.devices:
+            thread = threading.Thread(target=self._pollDevice, name="SENSEL_POLL_THREAD", args=(device,))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._exit.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    #Returns the next (device, frame) pair, with the same block/timeout
+    #behaviour as SenselDevice.readFrame
+    def readFrame(self, block=True, timeout=None):
+        try:
+            return self._frames.get(block, timeout)
+        except queue.Empty:
+            return None
 
+    def readFrames(self, max_n=None, block=True, timeout=None):
+        frames = []
+        frame = self.readFrame(block, timeout)
+        while frame is not None:
+            frames.append(frame)
+            if max_n is not None and len(frames) >= max_n:
+                break
+            frame = self.readFrame(False)
+        return frames
+
+    def _pollDevice(self, device):
+        while not self._exit.is_set():
+            frame = device.readFrame(timeout=SENSEL_POLL_TIMEOUT)
+            if frame is None:
+                continue
+            frame = (device, copyFrameImages(frame))
+            while not self._exit.is_set():
+                try:
+                    self._frames.put(frame, True, SENSEL_POLL_TIMEOUT)
+                    break
+                except queue.Full:
+                    pass
+
+#Opens port_name and checks that it answers the magic register read within
+#timeout. Returns the open serial port, or None.
+def _probePort(port_name, timeout=SENSEL_PROBE_TIMEOUT):
+    with _ports_in_use_lock:
+        if port_name in _ports_in_use:
+            return None
+    try:
+        port = serial.Serial(port=port_name,
+                             baudrate=SENSEL_BAUD,
+                             parity=serial.PARITY_NONE,
+                             stopbits=serial.STOPBITS_ONE,
+                             bytesize=serial.EIGHTBITS,
+                             timeout=timeout)
+    except Exception:
+        return None
+    try:
+        port.flushInput()
+        port.write(pack('BBB', SENSEL_READ_HEADER, SENSEL_REG_MAGIC, len(SENSEL_MAGIC)))
+        resp = port.read(3 + len(SENSEL_MAGIC) + 1)
+    except Exception:
+        resp = b''
+    if len(resp) == 3 + len(SENSEL_MAGIC) + 1 and _convertBufToVal(resp[0:1]) == SENSEL_PT_READ_ACK \
+       and resp[3:3 + len(SENSEL_MAGIC)] == SENSEL_MAGIC:
+        logging.info("Probe found a sensor at %s" % port_name)
+        return port
+    port.close()
+    return None
+
+#Probes port_names in parallel and returns the (port_name, open port) pairs
+#that answered, in the order of port_names
+def _probePorts(port_names, timeout=SENSEL_PROBE_TIMEOUT):
+    port_names = list(port_names)
+    found = [None] * len(port_names)
+    todo = queue.Queue()
+    for i in range(len(port_names)):
+        todo.put(i)
+
+    def probe():
+        while True:
+            try:
+                i = todo.get_nowait()
+            except queue.Empty:
+                return
+            found[i] = _probePort(port_names[i], timeout)
+
+    threads = [threading.Thread(target=probe, name="SENSEL_PROBE_THREAD")
+               for i in range(min(SENSEL_PROBE_MAX_THREADS, len(port_names)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [(port_name, port) for (port_name, port) in zip(port_names, found) if port is not None]
+
+#(vendor id, product id) of the USB device behind a Linux tty, from sysfs, or
+#None if it isn't a USB device
+def _sysfsUSBId(port_name):
+    device = os.path.realpath(os.path.join('/sys/class/tty', os.path.basename(port_name), 'device'))
+    #The ids live on the USB device, one or two levels above the tty's interface
+    for i in range(4):
+        try:
+            with open(os.path.join(device, 'idVendor')) as f:
+                vendor = f.read().strip().lower()
+            with open(os.path.join(device, 'idProduct')) as f:
+                product = f.read().strip().lower()
+            return (vendor, product)
+        except (IOError, OSError):
+            device = os.path.dirname(device)
+    return None
+
+def _serialNumberKey(serial_num_list):
+    return bytearray(serial_num_list).decode('ascii', 'replace')
+
+def _loadPortCache():
+    try:
+        with open(SENSEL_PORT_CACHE_PATH) as f:
+            cache = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+#The cached port for serial_number, or every cached port (most recently used
+#first) when serial_number is None
+def _cachedPortNames(serial_number=None):
+    cache = _loadPortCache()
+    if serial_number is not None:
+        entry = cache.get(serial_number)
+        return [entry['port']] if isinstance(entry, dict) and 'port' in entry else []
+    entries = sorted((entry for entry in cache.values() if isinstance(entry, dict) and 'port' in entry),
+                     key=lambda entry: entry.get('time', 0), reverse=True)
+    port_names = []
+    for entry in entries:
+        if entry['port'] not in port_names:
+            port_names.append(entry['port'])
+    return port_names
+
+def _savePortCache(serial_number, port_name):
+    cache = _loadPortCache()
+    cache[serial_number] = {'port': port_name, 'time': time.time()}
+    try:
+        with open(SENSEL_PORT_CACHE_PATH, 'w') as f:
+            json.dump(cache, f)
+    except (IOError, OSError):
+        logging.info("Couldn't save the port cache to %s" % SENSEL_PORT_CACHE_PATH)
+
+#The error a failed register operation raises when its command can't be sent
+def _registerOpError(reg_op):
+    (op, reg, size, data) = reg_op
+    if op == _REG_OP_READ:
+        return SenselRegisterReadError(reg, size)
+    if op == _REG_OP_READ_VSP:
+        return SenselRegisterReadVSPError(reg, 0)
+    return SenselRegisterWriteError(reg, size, data, False, 0)
+
+#Lost frame count from a raw frame's header
+def _frameLostCount(frame_data):
+    if len(frame_data) < 2:
+        return 0
+    return _convertBufToVal(frame_data[1])
+
+#Scales the scan thread's poll delay so each poll returns about target_frames
+#frames. An empty poll means frames aren't arriving, so back off.
+def _nextReadDelay(read_delay, num_frames, target_frames, min_delay, max_delay):
+    if num_frames == 0:
+        read_delay *= 2
+    else:
+        read_delay *= float(target_frames) / num_frames
+    return min(max(read_delay, min_delay), max_delay)
 
 def _convertBufToVal(buf):
-    if PY3:
-        if type(buf) is int:
-            return buf
-    else:
-        buf = ["{:02d}".format(ord(c)) for c in buf]
+    if type(buf) is int:
+        return buf
     final_val = 0
     for i in range(len(buf)):
         final_val |= (int(buf[i]) << (i * 8))
     return final_val
 
+def _checkContactDataSize(data, num_contacts, offset):
+    end = offset + num_contacts * SenselContact.data_size
+    if end > len(data):
+        logging.error("Contact data size (%d) is less than %d contacts" % (len(data) - offset, num_contacts))
+        raise SenselSerialReadError(len(data) - offset, end - offset)
+    return end
+
+#Creates contacts that reference data and decode on first field access
+def _lazyContacts(data, num_contacts, offset=0, mm_factors=(-1, -1)):
+    end = _checkContactDataSize(data, num_contacts, offset)
+    from_buffer = SenselContact._fromBuffer
+    return [from_buffer(data, contact_offset, mm_factors)
+            for contact_offset in range(offset, end, SenselContact.data_size)]
+
+#Copies a force or labels image out of the device's reused image buffer
+def copyImage(image):
+    if image is None:
+        return None
+    if numpy is not None:
+        return image.copy()
+    return memoryview(bytearray(image.tobytes())).cast(image.format, image.shape)
+
+#Returns frame with its images copied, for frames that are held on to while
+#the device keeps reading
+def copyFrameImages(frame):
+    (lost_frame_count, force_image, label_image, contacts) = frame
+    if force_image is None and label_image is None:
+        return frame
+    return SenselFrame(lost_frame_count, copyImage(force_image), copyImage(label_image), contacts,
+                       getattr(frame, 'frame_index', None), getattr(frame, 'sensor_time', None))
+
+def _packCell(value, cell_size):
+    return pack('<B' if cell_size == 1 else '<H', value)
+
+#Expands the run-length encoded image payload data[start:end] into dst (a
+#writable byte memoryview). fill holds enough fill cells to cover dst.
+def _expandRuns(data, start, end, dst, cell_size, fill):
+    if not isinstance(data, (bytes, bytearray)):
+        data = bytes(data)
+    src = memoryview(data)
+    marker = fill[:cell_size].tobytes()
+    dst_size = len(dst)
+    out = 0
+    pos = start
+
+    while pos < end:
+        #Find the next fill cell, skipping matches that straddle two cells
+        run = data.find(marker, pos, end)
+        while run != -1 and (run - start) % cell_size:
+            run = data.find(marker, run + 1, end)
+        if run == -1:
+            run = end
+
+        literal_end = out + (run - pos)
+        if literal_end > dst_size:
+            raise SenselFrameDecompressionError(literal_end, dst_size)
+        dst[out:literal_end] = src[pos:run]
+        out = literal_end
+        if run == end:
+            break
+
+        count_end = run + 2 * cell_size
+        if count_end > end:
+            raise SenselFrameDecompressionError(out, dst_size)
+        run_end = out + _convertBufToVal(src[run + cell_size:count_end]) * cell_size
+        if run_end > dst_size:
+            raise SenselFrameDecompressionError(run_end, dst_size)
+        dst[out:run_end] = fill[:run_end - out]
+        out = run_end
+        pos = count_end
+
+    if out != dst_size:
+        raise SenselFrameDecompressionError(out, dst_size)
+
+#Inverse of _expandRuns: builds an image block (size header included) from the
+#raw little-endian image bytes. Used to build synthetic frames.
+def _compressImage(image_bytes, cell_size, fill_value):
+    marker = _packCell(fill_value, cell_size)
+    max_run = 0xFF if cell_size == 1 else 0xFFFF
+    payload = bytearray()
+    cells = [image_bytes[i:i + cell_size] for i in range(0, len(image_bytes), cell_size)]
+    i = 0
+    while i < len(cells):
+        if cells[i] != marker:
+            payload += cells[i]
+            i += 1
+            continue
+        run = 1
+        while i + run < len(cells) and run < max_run and cells[i + run] == marker:
+            run += 1
+        payload += marker + _packCell(run, cell_size)
+        i += run
+    if len(payload) >= len(image_bytes):
+        payload = bytearray(image_bytes)
+    return pack('<H', len(payload)) + bytes(payload)
+
 class SenselError(Exception):
     """Base class for exceptions in this module"""
     pass
@@ -684,11 +1944,21 @@ class SenselSerialReadError(SenselError):
         logging.error("Requested %d bytes, received %d bytes" % (num_bytes_requested, num_bytes_read))
 
 class SenselFrameDecompressionError(SenselError):
-    """Exception raised when a serial read fails"""
+    """Exception raised when a compressed frame block can't be expanded"""
     def __init__(self, num_bytes_decompressed, num_bytes_expected):
+        self.num_bytes_decompressed = num_bytes_decompressed
+        self.num_bytes_expected = num_bytes_expected
         logging.error("Only decompressed %d of %d bytes" % 
                       (num_bytes_decompressed, num_bytes_expected))
 
+class SenselUnsupportedImageError(SenselError):
+    """Exception raised when a frame has an image block and image decoding
+    isn't enabled, see SENSEL_IMAGE_DECODING"""
+    def __init__(self, image):
+        self.image = image
+        SenselError.__init__(self, "Unsupported %s image format: image decoding is only verified against "
+                             "sensel_sim, call setImageDecoding(True) to decode it anyway" % image)
+
 class SenselSerialWriteError(SenselError):
     """Exception raised when a serial read fails"""
     def __init__(self, num_bytes_written, num_bytes_requested):
@@ -0,0 +1,151 @@
+#
+# asyncio interface to Sensel frames and gesture events.
+#
+#   async for frame in device.frames(): ...
+#   async for gesture in handler.gestures(): ...
+#
+# The device is read on a background thread so the event loop never waits on
+# the serial port. Items are handed over through a bounded asyncio.Queue; when
+# the consumer falls behind the reader thread blocks on the full queue rather
+# than buffering without limit.
+#
+
+import asyncio
+import concurrent.futures
+import copy
+import threading
+
+import sensel
+
+DEFAULT_QUEUE_SIZE = 64
+
+# How often the reader thread checks whether the stream was closed while it's
+# waiting on the device or on a full queue (s)
+POLL_INTERVAL = 0.1
+
+_END = object()
+
+class _ThreadedStream(object):
+
+    def __init__(self, maxsize):
+        self._maxsize = DEFAULT_QUEUE_SIZE if maxsize is None else maxsize
+        self._loop = None
+        self._queue = None
+        self._thread = None
+        self._closed = threading.Event()
+        self._error = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._thread is None:
+            self._start()
+        item = await self._queue.get()
+        if item is _END:
+            # Leave the marker for anyone else waiting on the stream
+            self._queue.put_nowait(_END)
+            if self._error is not None:
+                raise self._error
+            raise StopAsyncIteration
+        return item
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.aclose()
+
+    async def aclose(self):
+        self._closed.set()
+        if self._thread is not None:
+            await self._loop.run_in_executor(None, self._thread.join)
+
+    def _start(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(self._maxsize)
+        self._thread = threading.Thread(target=self._run, name="SENSEL_ASYNC_READER")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        try:
+            self._produce()
+        except BaseException as e:
+            self._error = e
+        self._put(_END)
+
+    # Called from the reader thread. Blocks while the queue is full and returns
+    # False if the stream is closed before the item could be queued.
+    def _put(self, item):
+        try:
+            future = asyncio.run_coroutine_threadsafe(self._queue.put(item), self._loop)
+        except RuntimeError: # The loop has been closed
+            self._closed.set()
+            return False
+        while True:
+            try:
+                future.result(POLL_INTERVAL)
+                return True
+            except concurrent.futures.TimeoutError:
+                if self._closed.is_set():
+                    future.cancel()
+                    return False
+
+    def _produce(self):
+        raise NotImplementedError
+
+class FrameStream(_ThreadedStream):
+    """Async iterator over the frames read from a scanning SenselDevice"""
+
+    def __init__(self, sensel_device, maxsize=None):
+        super(FrameStream, self).__init__(maxsize)
+        self._device = sensel_device
+
+    def _produce(self):
+        while not self._closed.is_set():
+            frame = self._device.readFrame(timeout=POLL_INTERVAL)
+            if frame is None:
+                continue
+            # The device reuses its image buffers, so queued frames get copies
+            if not self._put(sensel.copyFrameImages(frame)):
+                return
+
+class GestureStream(_ThreadedStream):
+    """Async iterator over the events of a SenselGestureHandler
+
+    Each event is a snapshot of the gesture taken when the event fired
+    (gesture.snapshot(), or a shallow copy for gestures without one).
+    If no device is given the handler opens one and closes it when the stream
+    is closed.
+    """
+
+    def __init__(self, handler, sensel_device=None, maxsize=None):
+        super(GestureStream, self).__init__(maxsize)
+        self._handler = handler
+        self._device = sensel_device
+
+    def _produce(self):
+        sensel_device = self._device
+        if sensel_device is None:
+            sensel_device = self._handler.openDevice()
+        elif self._handler.latency_stats is None:
+            self._handler.latency_stats = sensel_device.latency_stats
+        saved_sink = self._handler._event_sink
+        self._handler._event_sink = self._onGesture
+        try:
+            while not self._closed.is_set():
+                contacts = sensel_device.readContactBatch(timeout=POLL_INTERVAL)
+                if contacts is None:
+                    continue
+                self._handler.processContacts(contacts)
+        finally:
+            self._handler._event_sink = saved_sink
+            if self._device is None:
+                sensel_device.stopScanning()
+                sensel_device.closeConnection()
+
+    def _onGesture(self, gesture):
+        # Gestures from engines without snapshot() are shallow copied
+        snapshot = getattr(gesture, "snapshot", None)
+        self._put(copy.copy(gesture) if snapshot is None else snapshot())
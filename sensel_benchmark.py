@@ -0,0 +1,520 @@
+#!/usr/bin/env python
+#
+# Benchmarks for the Sensel frame parser and gesture engines. These run on
+# synthetic frames and do not need a sensor attached.
+#
+#   python sensel_benchmark.py                  # print the tables
+#   python sensel_benchmark.py --json out.json  # also save machine-readable results
+#
+
+import argparse
+import array
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+
+import sensel
+import sensel_dispatch
+import sensel_framework
+import sensel_framework_simple
+import sensel_recognizers
+import sensel_sim
+
+CONTACT_COUNTS = (1, 5, 16)
+DEVICE_COUNTS = (1, 2, 4)
+
+# Gesture workloads: name -> (touch script, number of frames), at the
+# simulator's default 125 Hz
+WORKLOADS = (
+    ("idle", lambda: sensel_sim.idleTouches(), 1250),
+    ("tap", lambda: sensel_sim.tapTouches(1), 1250),
+    ("pan-2", lambda: sensel_sim.panTouches(2), 1250),
+    ("pinch-2", lambda: sensel_sim.pinchTouches(rotation=0.5), 1250),
+    ("storm-10", lambda: sensel_sim.syntheticTouches(10), 1250),
+    ("pan-60s", lambda: sensel_sim.panTouches(1, pan_frames=7500, up_frames=25, velocity_mm=(0.02, 0.0)), 7525),
+)
+
+GESTURE_ENGINES = (
+    ("framework", lambda: sensel_framework.SenselGestureHandler()),
+    ("framework_simple", lambda: sensel_framework_simple.SenselGestureHandler(None)),
+    ("recognizers", lambda: sensel_recognizers.RecognizerEngine()),
+)
+
+# Unbuffered read pipeline benchmark: a simulated sensor behind a link with
+# PIPELINE_LINK_LATENCY (s) of latency, read by a loop that spends
+# PIPELINE_HANDLER_COST (s) handling each frame
+PIPELINE_DEPTHS = (0, 1, 2)
+PIPELINE_FRAME_RATE = 250
+PIPELINE_LINK_LATENCY = 0.002
+PIPELINE_HANDLER_COST = 0.002
+
+# Buffered (scan thread) read benchmark: startScanning(num_buffers) on a
+# simulated sensor, idle, with touches, and with the scan thread paused.
+# The adaptive poll delay, aiming for one frame a poll (the default) or half
+# the buffers a poll, is compared against the fixed quarter frame period the
+# scan thread used to poll at.
+SCAN_NUM_BUFFERS = (4, 16)
+SCAN_SCENARIOS = (
+    ("idle", lambda: sensel_sim.idleTouches(), False),
+    ("touch-5", lambda: sensel_sim.syntheticTouches(5), False),
+    ("paused", lambda: sensel_sim.idleTouches(), True),
+)
+
+# Event dispatch benchmark: each engine's events handed to worker threads
+# (see sensel_dispatch) by a read loop fed DISPATCH_WORKLOAD, with a handler
+# that takes DISPATCH_HANDLER_COST (s) per event
+DISPATCH_WORKLOAD = ("pinch-2", lambda: sensel_sim.pinchTouches(rotation=0.5), 1250)
+DISPATCH_HANDLER_COST = 0.001
+
+# Sensor geometry and scan rate used for the image benchmarks
+IMAGE_ROWS = 105
+IMAGE_COLS = 185
+FULL_FRAME_RATE = 125
+
+def buildContactFrame(num_contacts):
+    frame = bytearray([sensel.SENSEL_FRAME_CONTACTS_FLAG, 0, num_contacts])
+    for i in range(num_contacts):
+        frame += sensel._contact_struct.pack(
+            1000 + i, i, 40, 256 * (10 + i), 256 * (20 + i), -3, 4,
+            90, 12, 8, 10 + i, 20 + i, i, sensel.SENSEL_EVENT_CONTACT_MOVE)
+    return bytes(frame)
+
+# Pressure frame with num_blobs square touches on an otherwise empty sensor
+def buildPressureFrame(nrows, ncols, num_blobs, compressed=True):
+    cells = bytearray(nrows * ncols * 2)
+    for blob in range(num_blobs):
+        top = (blob * 17) % (nrows - 8)
+        left = (blob * 29) % (ncols - 8)
+        for r in range(top, top + 8):
+            for c in range(left, left + 8):
+                i = 2 * (r * ncols + c)
+                cells[i:i + 2] = sensel._packCell(100 + 10 * (r - top) + (c - left), 2)
+    if compressed:
+        block = sensel._compressImage(bytes(cells), 2, 0)
+    else:
+        block = sensel._packCell(len(cells), 2) + bytes(cells)
+    return bytes(bytearray([sensel.SENSEL_FRAME_PRESSURE_FLAG, 0])) + block
+
+class _FramePort(object):
+    """Stands in for a serial port and answers every frame read request with
+    the same frame, which is enough to drive SenselDevice.readFrame"""
+
+    def __init__(self, frame_data):
+        checksum = sum(bytearray(frame_data)) & 0xFF
+        self._response = (bytes(bytearray([sensel.SENSEL_PT_FRAME])) + sensel._packCell(len(frame_data), 2) +
+                          frame_data + bytes(bytearray([checksum])))
+        self._out = bytearray()
+
+    @property
+    def in_waiting(self):
+        return len(self._out)
+
+    def write(self, data):
+        self._out += self._response
+        return len(data)
+
+    def read(self, num_bytes):
+        data = bytes(self._out[:num_bytes])
+        del self._out[:num_bytes]
+        return data
+
+    def close(self):
+        pass
+
+# The per-field decoder that SenselContact used before the precompiled struct
+def _legacyParseContacts(frame_data):
+    num_contacts = sensel._convertBufToVal(frame_data[2])
+    frame_data = frame_data[3:]
+    contacts = []
+    for i in range(num_contacts):
+        data = frame_data[:sensel.SenselContact.data_size]
+        fields = [sensel._convertBufToVal(data[start:end]) for (start, end) in
+            ((0, 4), (4, 8), (8, 12), (12, 14), (14, 16), (16, 18), (18, 20),
+             (20, 22), (22, 24), (24, 26), (26, 27), (27, 28), (28, 29), (29, 30))]
+        contacts.append(fields)
+        frame_data = frame_data[sensel.SenselContact.data_size:]
+    return contacts
+
+# What the gesture frameworks do with a frame: parse it and read every position
+def _parseAndReadContacts(device, frame_data):
+    contacts = device._parseFrameData(frame_data)[3]
+    for c in contacts:
+        c.x_pos_mm
+    return contacts
+
+# The same work done through a ContactBatch
+def _parseBatchAndCentroid(device, frame_data):
+    contacts = device._parseFrameData(frame_data, contact_batch=True)[3]
+    return contacts.centroid()
+
+def _timePerCall(func, arg, number):
+    best = min(timeit.repeat(lambda: func(arg), number=number, repeat=5))
+    return best / number
+
+def benchContactParsing(counts=CONTACT_COUNTS, number=2000):
+    device = sensel.SenselDevice()
+    results = []
+    for num_contacts in counts:
+        frame = buildContactFrame(num_contacts)
+        legacy = _timePerCall(_legacyParseContacts, frame, number)
+        parse_only = _timePerCall(device._parseFrameData, frame, number)
+        parse_and_read = _timePerCall(lambda f: _parseAndReadContacts(device, f), frame, number)
+        batch = _timePerCall(lambda f: _parseBatchAndCentroid(device, f), frame, number)
+        results.append((num_contacts, legacy, parse_only, parse_and_read, batch))
+    return results
+
+def benchPressureDecoding(nrows=IMAGE_ROWS, ncols=IMAGE_COLS, number=200):
+    device = sensel.SenselDevice()
+    device.sensor_nrows = nrows
+    device.sensor_ncols = ncols
+    # The frames are built with the simulator's image codec
+    device.setImageDecoding(True)
+    results = []
+    for (name, frame) in (("raw", buildPressureFrame(nrows, ncols, 0, compressed=False)),
+                          ("empty", buildPressureFrame(nrows, ncols, 0)),
+                          ("5 touches", buildPressureFrame(nrows, ncols, 5)),
+                          ("16 touches", buildPressureFrame(nrows, ncols, 16))):
+        results.append((name, 1.0 / _timePerCall(device._parseFrameData, frame, number)))
+    return results
+
+def benchMultiDevice(counts=DEVICE_COUNTS, num_contacts=5, duration=1.0):
+    results = []
+    for num_devices in counts:
+        devices = []
+        for i in range(num_devices):
+            device = sensel.SenselDevice()
+            device._attachSerial(_FramePort(buildContactFrame(num_contacts)))
+            devices.append(device)
+        poller = sensel.SenselDevicePoller(devices, maxsize=1024)
+        poller.start()
+        num_frames = 0
+        per_device = dict((device, 0) for device in devices)
+        end = time.time() + duration
+        while time.time() < end:
+            for (device, frame) in poller.readFrames(timeout=0.1):
+                num_frames += 1
+                per_device[device] += 1
+        poller.stop()
+        results.append((num_devices, num_frames / duration, min(per_device.values()) / duration))
+    return results
+
+# Frames/s, frames lost by the device and frame age (from the end of its scan
+# to being parsed) for each read pipeline depth
+def benchPipelinedReads(depths=PIPELINE_DEPTHS, duration=1.0, num_contacts=5, frame_rate=PIPELINE_FRAME_RATE,
+                        latency=PIPELINE_LINK_LATENCY, handler_cost=PIPELINE_HANDLER_COST):
+    results = []
+    for depth in depths:
+        sim = sensel_sim.SenselSimulator(sensel_sim.syntheticTouches(num_contacts), frame_rate=frame_rate)
+        device = sensel.SenselDevice()
+        device.openSerialConnection(sensel_sim.SimulatedSerial(sim, latency=latency))
+        device.setFrameContentControl(sensel.SENSEL_FRAME_CONTACTS_FLAG)
+        device.setReadPipelineDepth(depth)
+        device.startScanning(0)
+        ages = []
+        start = time.time()
+        while time.time() - start < duration:
+            frame = device.readFrame()
+            ages.append(time.time() - (sim._scan_start + (frame.frame_index + 1) / sim.frame_rate))
+            time.sleep(handler_cost)
+        elapsed = time.time() - start
+        device.stopScanning()
+        lost = device.getFrameCounters()['device_lost']
+        device.closeConnection()
+        results.append({
+            "depth": depth,
+            "frames_per_sec": len(ages) / elapsed,
+            "lost_per_sec": lost / elapsed,
+            "age_ms_mean": 1000 * sum(ages) / len(ages),
+            "age_ms_max": 1000 * max(ages),
+        })
+    return results
+
+# The poll delay the scan thread used before it adapted to the frames each
+# poll returned
+def _fixedReadDelay(read_delay, num_frames, target_frames, min_delay, max_delay):
+    return min_delay
+
+# Frames/s, frames lost, the scan thread's CPU time (percent of one core) and
+# each frame's latency, from the end of its scan to readFrame returning it.
+# The simulator answers the scan thread's requests on that thread, so its
+# work to build the frames is counted too, the same for every poll delay.
+def benchScanThread(scenarios=SCAN_SCENARIOS, buffer_counts=SCAN_NUM_BUFFERS, duration=1.0):
+    results = []
+    # name, poll target frames (given num_buffers), poll delay function
+    polls = (("adaptive", lambda num_buffers: 1, sensel._nextReadDelay),
+             ("batched", lambda num_buffers: num_buffers // 2, sensel._nextReadDelay),
+             ("fixed", lambda num_buffers: 1, _fixedReadDelay))
+    for (scenario, touches, paused) in scenarios:
+        for (num_buffers, (poll, target_frames, next_read_delay)) in itertools.product(buffer_counts, polls):
+            sim = sensel_sim.SenselSimulator(touches())
+            device = sensel.SenselDevice()
+            device.openSerialConnection(sensel_sim.SimulatedSerial(sim))
+            device.setFrameContentControl(sensel.SENSEL_FRAME_CONTACTS_FLAG)
+            saved_delay = sensel._nextReadDelay
+            sensel._nextReadDelay = next_read_delay
+            try:
+                device.startScanning(num_buffers, target_frames(num_buffers))
+                if paused:
+                    device.pauseScanThread()
+                latencies = []
+                # Everything the process does outside this (reader) thread is
+                # the scan thread's
+                cpu_start = time.process_time() - time.thread_time()
+                start = time.time()
+                while time.time() - start < duration:
+                    frame = device.readFrame(timeout=0.1)
+                    if frame is not None:
+                        latencies.append(time.time() - (sim._scan_start + (frame.frame_index + 1) / sim.frame_rate))
+                cpu = time.process_time() - time.thread_time() - cpu_start
+                elapsed = time.time() - start
+                device.stopScanning()
+            finally:
+                sensel._nextReadDelay = saved_delay
+            counters = device.getFrameCounters()
+            device.closeConnection()
+            result = {
+                "scenario": scenario,
+                "buffers": num_buffers,
+                "poll": poll,
+                "frames_per_sec": len(latencies) / elapsed,
+                "lost_per_sec": (counters['device_lost'] + counters['host_dropped']) / elapsed,
+                "scan_cpu_percent": 100 * cpu / elapsed,
+                "latency_ms_mean": None,
+                "latency_ms_max": None,
+            }
+            if latencies:
+                result["latency_ms_mean"] = 1000 * sum(latencies) / len(latencies)
+                result["latency_ms_max"] = 1000 * max(latencies)
+            results.append(result)
+    return results
+
+class _EventLog(object):
+    """Event sink that measures how long after the contact count changed each
+    start/end event fired, in sensor time"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.num_events = 0
+        self.latencies = []
+        self.last_change = 0.0
+
+    def __call__(self, gesture):
+        self.num_events += 1
+        if gesture.state.name in ("STARTED", "ENDED"):
+            self.latencies.append(self.now - self.last_change)
+
+def workloadFrames(touches, num_frames):
+    return sensel_sim.SenselSimulator(touches, paced=False).generateFrames(num_frames)
+
+def _newDevice():
+    device = sensel.SenselDevice()
+    device.sensor_nrows = sensel_sim.SIM_NROWS
+    device.sensor_ncols = sensel_sim.SIM_NCOLS
+    sim = sensel_sim.SenselSimulator()
+    device.sensor_x_to_mm_factor = sim.x_to_mm_factor
+    device.sensor_y_to_mm_factor = sim.y_to_mm_factor
+    device._mm_factors = (sim.x_to_mm_factor, sim.y_to_mm_factor)
+    device._resetSensorClock(sensel_sim.SIM_FRAME_RATE)
+    return device
+
+# Parses and hands every frame to the engine created by make_handler. The
+# engines time gestures on the frames' sensor time, so the results don't
+# depend on how fast the frames are fed. Returns the event log, or None when
+# only parsing (make_handler is None).
+def _runEngine(frames, make_handler, per_frame=None):
+    device = _newDevice()
+    handler = make_handler() if make_handler is not None else None
+    log = _EventLog()
+    saved_stdout = sys.stdout
+    try:
+        if handler is not None:
+            handler._event_sink = log
+            # The engines print their debugging output, keep it out of the timings
+            sys.stdout = open(os.devnull, 'w')
+        num_contacts = 0
+        for frame_data in frames:
+            contacts = device._parseFrameData(frame_data, contact_batch=True)[3]
+            if handler is not None:
+                log.now = contacts.sensor_time
+                if len(contacts) != num_contacts:
+                    num_contacts = len(contacts)
+                    log.last_change = log.now
+                handler.processContacts(contacts)
+            if per_frame is not None:
+                per_frame()
+    finally:
+        if handler is not None:
+            sys.stdout.close()
+            sys.stdout = saved_stdout
+    return log if handler is not None else None
+
+# Peak traced memory while handling a frame, averaged over the frames, and the
+# blocks still allocated per frame once the run is over
+def _measureAllocations(frames, make_handler):
+    # Preallocated so recording the peaks doesn't show up as retained blocks
+    peaks = array.array('d', [0.0]) * len(frames)
+    frame_index = [0]
+    def per_frame():
+        (current, peak) = tracemalloc.get_traced_memory()
+        peaks[frame_index[0]] = peak - current
+        frame_index[0] += 1
+        tracemalloc.reset_peak()
+    tracemalloc.start()
+    try:
+        before = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+        tracemalloc.reset_peak()
+        _runEngine(frames, make_handler, per_frame=per_frame)
+        after = sum(stat.count for stat in tracemalloc.take_snapshot().statistics('filename'))
+    finally:
+        tracemalloc.stop()
+    return (sum(peaks) / float(len(peaks)), (after - before) / float(len(frames)))
+
+def benchGestureWorkloads(workloads=WORKLOADS, engines=GESTURE_ENGINES):
+    results = []
+    for (workload, touches, num_frames) in workloads:
+        frames = workloadFrames(touches(), num_frames)
+        for (engine, make_handler) in (("parse", None),) + tuple(engines):
+            start = time.perf_counter()
+            log = _runEngine(frames, make_handler)
+            elapsed = time.perf_counter() - start
+            (peak_bytes, retained_blocks) = _measureAllocations(frames, make_handler)
+            result = {
+                "workload": workload,
+                "engine": engine,
+                "frames": num_frames,
+                "frames_per_sec": num_frames / elapsed,
+                "peak_bytes_per_frame": peak_bytes,
+                "retained_blocks_per_frame": retained_blocks,
+                "events": None,
+                "event_latency_ms_mean": None,
+                "event_latency_ms_max": None,
+            }
+            if log is not None:
+                result["events"] = log.num_events
+                if log.latencies:
+                    result["event_latency_ms_mean"] = 1000 * sum(log.latencies) / len(log.latencies)
+                    result["event_latency_ms_max"] = 1000 * max(log.latencies)
+            results.append(result)
+    return results
+
+# Read loop frames/s with dispatched events, and what each overflow policy
+# did with the events. Every engine's gestures go through the dispatcher, so
+# this also checks that each one can be snapshotted for the workers.
+def benchDispatch(workload=DISPATCH_WORKLOAD, engines=GESTURE_ENGINES, handler_cost=DISPATCH_HANDLER_COST):
+    (workload_name, touches, num_frames) = workload
+    frames = workloadFrames(touches(), num_frames)
+    results = []
+    for ((engine, make_handler), overflow) in itertools.product(engines, sensel_dispatch.OverflowPolicy):
+        device = _newDevice()
+        handler = make_handler()
+        dispatcher = handler.dispatchEvents(num_workers=2, overflow=overflow)
+        handled = [0]
+        def callback(gesture):
+            time.sleep(handler_cost)
+            handled[0] += 1
+        dispatcher.callback = callback
+        saved_stdout = sys.stdout
+        # The engines print their debugging output, keep it out of the timings
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            start = time.perf_counter()
+            for frame_data in frames:
+                handler.processContacts(device._parseFrameData(frame_data, contact_batch=True)[3])
+            elapsed = time.perf_counter() - start
+            dispatcher.close()
+        finally:
+            sys.stdout.close()
+            sys.stdout = saved_stdout
+        result = {"workload": workload_name, "engine": engine, "overflow": overflow.name,
+                  "frames_per_sec": num_frames / elapsed, "handled": handled[0]}
+        result.update(dispatcher.stats())
+        results.append(result)
+    return results
+
+def _formatMs(value):
+    return "-" if value is None else "%.1f" % value
+
+def runAll():
+    return {
+        "python": platform.python_version(),
+        "numpy": sensel.numpy is not None,
+        "contact_parsing": [dict(zip(("contacts", "legacy_s", "parse_s", "parse_read_s", "batch_s"), row))
+                            for row in benchContactParsing()],
+        "pressure_decoding": [dict(zip(("frame", "frames_per_sec"), row)) for row in benchPressureDecoding()],
+        "multi_device": [dict(zip(("devices", "total_frames_per_sec", "slowest_frames_per_sec"), row))
+                         for row in benchMultiDevice()],
+        "pipelined_reads": benchPipelinedReads(),
+        "scan_thread": benchScanThread(),
+        "gestures": benchGestureWorkloads(),
+        "dispatch": benchDispatch(),
+    }
+
+def printResults(results):
+    print("%-10s %14s %14s %16s %14s" % ("contacts", "legacy (us)", "parse (us)", "parse+read (us)", "batch (us)"))
+    for row in results["contact_parsing"]:
+        print("%-10d %14.2f %14.2f %16.2f %14.2f" % (row["contacts"], row["legacy_s"] * 1e6, row["parse_s"] * 1e6,
+                                                   row["parse_read_s"] * 1e6, row["batch_s"] * 1e6))
+    print("")
+    print("%dx%d pressure frames:" % (IMAGE_ROWS, IMAGE_COLS))
+    for row in results["pressure_decoding"]:
+        frames_per_sec = row["frames_per_sec"]
+        print("%-12s %10.0f frames/s (%.1fx %d Hz)" % (row["frame"], frames_per_sec,
+                                                      frames_per_sec / FULL_FRAME_RATE, FULL_FRAME_RATE))
+    print("")
+    print("%-10s %18s %18s" % ("devices", "frames/s (total)", "frames/s (slowest)"))
+    for row in results["multi_device"]:
+        print("%-10d %18.0f %18.0f" % (row["devices"], row["total_frames_per_sec"], row["slowest_frames_per_sec"]))
+    print("")
+    print("Unbuffered reads at %d Hz, %.0f ms link latency, %.0f ms handling per frame:" % (
+        PIPELINE_FRAME_RATE, 1000 * PIPELINE_LINK_LATENCY, 1000 * PIPELINE_HANDLER_COST))
+    print("%-10s %10s %10s %14s %14s" % ("depth", "frames/s", "lost/s", "age (ms)", "max age (ms)"))
+    for row in results["pipelined_reads"]:
+        print("%-10d %10.0f %10.0f %14.1f %14.1f" % (row["depth"], row["frames_per_sec"], row["lost_per_sec"],
+                                                    row["age_ms_mean"], row["age_ms_max"]))
+    print("")
+    print("Buffered reads (startScanning(buffers)) at %d Hz:" % sensel_sim.SIM_FRAME_RATE)
+    print("%-10s %8s %-10s %10s %10s %12s %14s %14s" % ("scenario", "buffers", "poll", "frames/s", "lost/s",
+                                                        "scan CPU (%)", "latency (ms)", "max lat (ms)"))
+    for row in results["scan_thread"]:
+        print("%-10s %8d %-10s %10.0f %10.0f %12.1f %14s %14s" % (
+            row["scenario"], row["buffers"], row["poll"], row["frames_per_sec"], row["lost_per_sec"],
+            row["scan_cpu_percent"],
+            _formatMs(row["latency_ms_mean"]), _formatMs(row["latency_ms_max"])))
+    print("")
+    print("%-10s %-18s %10s %12s %12s %8s %14s %14s" % ("workload", "engine", "frames/s", "peak B/frame",
+                                                       "kept/frame", "events", "latency (ms)", "max lat (ms)"))
+    for row in results["gestures"]:
+        print("%-10s %-18s %10.0f %12.0f %12.2f %8s %14s %14s" % (
+            row["workload"], row["engine"], row["frames_per_sec"], row["peak_bytes_per_frame"],
+            row["retained_blocks_per_frame"], "-" if row["events"] is None else row["events"],
+            _formatMs(row["event_latency_ms_mean"]), _formatMs(row["event_latency_ms_max"])))
+    print("")
+    print("Dispatched events (%s, 2 workers, %.0f ms handling per event):" % (
+        DISPATCH_WORKLOAD[0], 1000 * DISPATCH_HANDLER_COST))
+    print("%-18s %-12s %10s %10s %10s %10s %10s" % ("engine", "overflow", "frames/s", "dispatched", "handled",
+                                                   "coalesced", "dropped"))
+    for row in results["dispatch"]:
+        print("%-18s %-12s %10.0f %10d %10d %10d %10d" % (row["engine"], row["overflow"], row["frames_per_sec"],
+                                                          row["dispatched"], row["handled"], row["coalesced"],
+                                                          row["dropped"]))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sensel parser and gesture engine benchmarks")
+    parser.add_argument("--json", metavar="PATH", help="also write the results to PATH as JSON ('-' for stdout)")
+    args = parser.parse_args()
+
+    results = runAll()
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print("")
+    else:
+        printResults(results)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+    sys.exit(0)
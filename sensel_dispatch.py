@@ -0,0 +1,191 @@
+#
+# Asynchronous delivery of gesture events.
+#
+#   handler = MyGestureHandler(None)
+#   handler.dispatchEvents(num_workers=2, overflow=OverflowPolicy.COALESCE)
+#   handler.start()
+#
+# gestureEvent then runs on worker threads instead of inside the read loop,
+# so a slow handler (UI update, network send) no longer holds up frame
+# reading. Each gesture's events always go to the same worker, in the order
+# they fired; events of different gestures may be handled concurrently.
+#
+# Each worker has a bounded queue (unless maxsize is 0). What happens when a
+# worker falls so far behind that its queue fills is set by the overflow
+# policy:
+#
+#   BLOCK      - the read loop waits for room, as if the handler ran inline
+#   DROP_MOVED - the oldest queued MOVED event is dropped to make room
+#   COALESCE   - a MOVED event replaces its gesture's MOVED event that is
+#                still waiting (even before the queue is full), so a
+#                slow handler always sees the latest position; if the
+#                queue is full anyway, the oldest MOVED event is dropped
+#
+# STARTED and ENDED events are never dropped: with DROP_MOVED or COALESCE
+# the read loop only waits when the queue is full of them.
+#
+
+import collections
+import copy
+import logging
+import threading
+from enum import Enum
+
+DEFAULT_QUEUE_SIZE = 64
+
+class OverflowPolicy(Enum):
+    BLOCK = 0
+    DROP_MOVED = 1
+    COALESCE = 2
+
+# Gestures from engines without snapshot() are shallow copied
+def _snapshot(gesture):
+    snapshot = getattr(gesture, "snapshot", None)
+    if snapshot is None:
+        return copy.copy(gesture)
+    return snapshot()
+
+def _isMoved(gesture):
+    return gesture.state.name == "MOVED"
+
+class _Worker(object):
+
+    def __init__(self, dispatcher, name):
+        self._dispatcher = dispatcher
+        self._queue = collections.deque()
+        # gesture key -> queued [key, event] entry of its pending MOVED event
+        self._pending_moved = {}
+        self._cond = threading.Condition()
+        self._busy = False
+        self._thread = threading.Thread(target=self._run, name=name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, key, event):
+        dispatcher = self._dispatcher
+        policy = dispatcher.overflow
+        moved = _isMoved(event)
+        with self._cond:
+            if moved and policy == OverflowPolicy.COALESCE:
+                entry = self._pending_moved.get(key)
+                if entry is not None:
+                    entry[1] = event
+                    dispatcher.coalesced += 1
+                    return
+            while 0 < dispatcher.maxsize <= len(self._queue) and not dispatcher.closed:
+                if policy != OverflowPolicy.BLOCK and self._dropOldestMoved():
+                    break
+                dispatcher.blocked += 1
+                self._cond.wait()
+            if dispatcher.closed:
+                return
+            entry = [key, event]
+            self._queue.append(entry)
+            if moved:
+                self._pending_moved[key] = entry
+            else:
+                # A later MOVED event mustn't be merged into one ahead of this
+                self._pending_moved.pop(key, None)
+            dispatcher.max_depth = max(dispatcher.max_depth, len(self._queue))
+            self._cond.notify_all()
+
+    def _dropOldestMoved(self):
+        for entry in self._queue:
+            if _isMoved(entry[1]):
+                self._queue.remove(entry)
+                self._forget(entry)
+                self._dispatcher.dropped += 1
+                return True
+        return False
+
+    def _forget(self, entry):
+        if self._pending_moved.get(entry[0]) is entry:
+            del self._pending_moved[entry[0]]
+
+    def _run(self):
+        dispatcher = self._dispatcher
+        while True:
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+                while not self._queue and not dispatcher.closed:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                entry = self._queue.popleft()
+                self._forget(entry)
+                self._busy = True
+                self._cond.notify_all()
+            try:
+                dispatcher.callback(entry[1])
+            except Exception:
+                logging.exception("Gesture event handler failed")
+
+    # Blocks until everything queued so far has been handled
+    def join(self, timeout=None):
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queue and not self._busy, timeout)
+
+    def close(self):
+        with self._cond:
+            self._cond.notify_all()
+
+class GestureDispatcher(object):
+    """Hands gesture events to callback on a pool of worker threads
+
+    dispatch() queues gesture.snapshot() (a shallow copy for gestures
+    without one), since the gesture engines keep updating their gesture
+    objects after firing an event. Counters:
+    dispatched, coalesced, dropped (MOVED events discarded on overflow),
+    blocked (times the caller waited for room) and max_depth (the longest any
+    worker queue got). As with queue.Queue, a maxsize of 0 or less leaves the
+    worker queues unbounded.
+    """
+
+    def __init__(self, callback, num_workers=1, maxsize=None, overflow=None):
+        self.callback = callback
+        self.maxsize = DEFAULT_QUEUE_SIZE if maxsize is None else maxsize
+        self.overflow = OverflowPolicy.BLOCK if overflow is None else overflow
+        self.closed = False
+        self.dispatched = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.max_depth = 0
+        self._workers = [_Worker(self, "GestureDispatcher-%d" % i) for i in range(num_workers)]
+
+    # Called from the read loop in place of gestureEvent
+    def dispatch(self, gesture):
+        if self.closed:
+            return
+        self.dispatched += 1
+        # The gesture object lives as long as the gesture, so its id keys the
+        # gesture's events to one worker. Objects are 16-byte aligned, so the
+        # low bits of the id are dropped before picking the worker.
+        key = id(gesture)
+        self._workers[(key >> 4) % len(self._workers)].put(key, _snapshot(gesture))
+
+    def stats(self):
+        return {
+            "dispatched": self.dispatched,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "blocked": self.blocked,
+            "max_depth": self.max_depth,
+        }
+
+    def join(self, timeout=None):
+        for worker in self._workers:
+            if not worker.join(timeout):
+                return False
+        return True
+
+    # Stops the workers once they've handled what's queued. Events dispatched
+    # after closing are discarded.
+    def close(self, wait=True):
+        self.closed = True
+        for worker in self._workers:
+            worker.close()
+        if wait:
+            for worker in self._workers:
+                worker._thread.join()
@@ -4,6 +4,7 @@
 
 from math import sqrt
 from enum import Enum
+import copy
 import sensel
 import time
 
@@ -38,16 +39,21 @@ def isActiveGesture(gesture):
 
 class SenselGesture(object):
 	"""docstring for SenselGesture"""
-	def __init__(self, contact_points, weight_class, down_x, down_y):
+	def __init__(self, contact_points, weight_class, down_x, down_y, down_start_time):
 		super(SenselGesture, self).__init__()
 		self.contact_points = contact_points
 		self.weight_class = weight_class
 		self.down_x = down_x
 		self.down_y = down_y
-		self.down_start_time = time.clock()
+		self.down_start_time = down_start_time
 
 		self.state = GestureState.INITED
 
+	# Copy of the gesture as it is now, for handling an event after the
+	# handler has gone on updating the gesture
+	def snapshot(self):
+		return copy.copy(self)
+
 	def __str__(self):
 		return str(self.contact_points) + " fingers, " + str(self.weight_class) + ", state: " + str(self.state) + ", started @ (" + str(self.down_x) + ", " + str(self.down_y) + ")"
 
@@ -55,7 +61,8 @@ class SenselGesture(object):
 		if(other == None): return False
 		gesture_changed = False
 		delta_dist = None # Calculate
-		if(isActiveGesture(other)):
+		# A gesture with no contacts down has no location to compare
+		if(isActiveGesture(other) and not other.down_x == None):
 			delta_dist = sqrt((self.down_x-other.down_x)**2 + (self.down_y-other.down_y)**2)
 		# If number of contacts changed
 		if(not self.contact_points == other.contact_points):
@@ -69,7 +76,7 @@ class SenselGesture(object):
 		elif(not self.weight_class == other.weight_class):
 			print("Weight class has changed: " + str(self.weight_class) + " => " + str(other.weight_class))
 			gesture_changed = True
-		return gesture_changed
+		return not gesture_changed
 #########
 
 # Create a new SenselGestureHandler and call the start method to start listening for events
@@ -77,6 +84,16 @@ class SenselGestureHandler(object):
 	"""docstring for SenselGestureHandler"""
 	def __init__(self):
 		super(SenselGestureHandler, self).__init__()
+		self.intraGestureTimer = None
+		self.changeGestureTimer = None
+		self.curr_gesture = None
+		# Time of the frame being processed, see frameTime
+		self.frame_time = None
+		self._event_sink = None
+		# Set by dispatchEvents
+		self.dispatcher = None
+		# Set to a sensel.SenselLatencyStats to time frames through to gesture events
+		self.latency_stats = None
 		
 	def getWeightClass(self, weight):
 		if(weight >= HEAVY_CLASS_MIN):
@@ -86,91 +103,133 @@ class SenselGestureHandler(object):
 		else:
 			return WeightClass.LIGHT
 
-	def gestureEvent(gesture):
-		print("You must implement this to recieve events")
-		return
-
-	def start(self):
+	def gestureEvent(self, gesture):
+		if(gesture.state == GestureState.STARTED):
+			print("Started gesture: " + str(gesture) + " @ " + str(self.frame_time))
+		elif(gesture.state == GestureState.ENDED):
+			print("Current Gesture has ended")
+
+	# Events go to a gestures() stream or dispatcher when one is attached, otherwise to gestureEvent
+	def _fireEvent(self, gesture):
+		if(self.latency_stats):
+			self.latency_stats.eventFired()
+		if(self._event_sink):
+			self._event_sink(gesture)
+		else:
+			self.gestureEvent(gesture)
+
+	# Runs gestureEvent on worker threads from now on, so a slow handler doesn't
+	# hold up reading frames. See sensel_dispatch.GestureDispatcher.
+	def dispatchEvents(self, num_workers=1, maxsize=None, overflow=None):
+		import sensel_dispatch
+		self.dispatcher = sensel_dispatch.GestureDispatcher(self.gestureEvent, num_workers, maxsize, overflow)
+		self._event_sink = self.dispatcher.dispatch
+		return self.dispatcher
+
+	# Async iterator over gesture events, see sensel_asyncio.GestureStream
+	def gestures(self, sensel_device=None, maxsize=None):
+		import sensel_asyncio
+		return sensel_asyncio.GestureStream(self, sensel_device, maxsize)
+
+	# Snapshot of the latency stats as a dict, or None if they aren't enabled
+	def stats(self):
+		if(self.latency_stats == None):
+			return None
+		return self.latency_stats.stats()
+
+	def openDevice(self):
 		sensel_device = sensel.SenselDevice()
 
 		if not sensel_device.openConnection():
 			print("Unable to open Sensel sensor!")
 			exit()
 
+		if(self.latency_stats):
+			sensel_device.setLatencyStats(self.latency_stats)
+
 		#Enable contact sending
 		sensel_device.setFrameContentControl(sensel.SENSEL_FRAME_CONTACTS_FLAG)
 	  
 		#Enable scanning
 		sensel_device.startScanning(0)
+		return sensel_device
 
-		intraGestureTimer = None
-		changeGestureTimer = None
-		curr_gesture = None
+	def start(self):
+		sensel_device = self.openDevice()
 
 		while True: 
-			contacts = sensel_device.readContacts()
-	  		#if(intraGestureTimer): print(str(time.clock()))
+			contacts = sensel_device.readContactBatch()
+	  		#if(self.intraGestureTimer): print(str(self.frame_time))
 			if contacts == None:
-				print("NO CONTACTS")
 				continue
-	   
-			# Calculate the average of the locations and weights
-			avg_x = None
-			avg_y = None
-			avg_weight = None
-			delta_dist = None
-			if(len(contacts) > 0):
-				sum_x = 0
-				sum_y = 0
-				sum_weight = 0
-				for c in contacts:
-					sum_x += c.x_pos_mm
-					sum_y += c.y_pos_mm
-					sum_weight += c.total_force
-				avg_x = sum_x / len(contacts)
-				avg_y = sum_y / len(contacts)
-				avg_weight = sum_weight / len(contacts)
-				weight_class = self.getWeightClass(avg_weight)
-				#print(str(weight_class) + " " + str(avg_x) + " " + str(avg_y) + " " + str(avg_weight))
-
-			# Determine which events to call
-			if(isActiveGesture(curr_gesture)):
-				next_gesture = SenselGesture(len(contacts), weight_class, avg_x, avg_y)
-				if(not curr_gesture.state == GestureState.ENDED):
-					if(not curr_gesture == next_gesture): 
-						if(changeGestureTimer == None):
-							changeGestureTimer = time.clock()
-						elif(changeGestureTimer - time.clock() > CHANGE_DELAY):
-							changeGestureTimer = None
-							# End the current gesture
-							curr_gesture.state = GestureState.ENDED
-							print("Current Gesture has ended")
-							# EVENT: On End
-							# If at least one contact is still down, init a new gesture
-							if(len(contacts) > 0):
-								curr_gesture = SenselGesture(len(contacts), weight_class, avg_x, avg_y)
-								intraGestureTimer = time.clock()
-								print("inited gesture")
-					else:
-						# If the gestures are equal, then clear the change gesture timer
-						if(not changeGestureTimer == None):
-							changeGestureTimer = None
-				if(curr_gesture.state == GestureState.INITED):
-					# If the elapsed time is greater than the delay time than start the gesture
-					if(time.clock() - intraGestureTimer >= START_DELAY):
-						curr_gesture.state = GestureState.STARTED
-						# EVENT: On start
-						print("Started gesture: " + str(curr_gesture) + " @ " + str(time.clock()))
-			else:
-				# If at least one contact is down, create a new gesture recognizer
-				if(len(contacts) > 0):
-					curr_gesture = SenselGesture(len(contacts), weight_class, avg_x, avg_y)
-					intraGestureTimer = time.clock()
-					print("inited gesture @ " + str(intraGestureTimer))
+			self.processContacts(contacts)
 
 		sensel_device.stopScanning();
 		sensel_device.closeConnection();
 
+	# Gestures are timed on the sensor clock (see sensel.SenselFrame) so START_DELAY
+	# and CHANGE_DELAY don't depend on how late a frame gets processed. Contacts
+	# without a sensor time fall back to the wall clock.
+	def frameTime(self, contacts):
+		sensor_time = getattr(contacts, 'sensor_time', None)
+		if(sensor_time == None):
+			return time.time()
+		return sensor_time
+
+	# Runs the gesture state machine on one frame of contacts
+	def processContacts(self, contacts):
+		curr_gesture = self.curr_gesture
+		now = self.frameTime(contacts)
+		self.frame_time = now
+
+		# Calculate the average of the locations and weights
+		avg_x = None
+		avg_y = None
+		avg_weight = None
+		weight_class = None
+		if(len(contacts) > 0):
+			(avg_x, avg_y) = contacts.centroid()
+			avg_weight = contacts.meanForce()
+			weight_class = self.getWeightClass(avg_weight)
+			#print(str(weight_class) + " " + str(avg_x) + " " + str(avg_y) + " " + str(avg_weight))
+
+		# Determine which events to call
+		if(isActiveGesture(curr_gesture)):
+			next_gesture = SenselGesture(len(contacts), weight_class, avg_x, avg_y, now)
+			if(not curr_gesture.state == GestureState.ENDED):
+				if(not curr_gesture == next_gesture): 
+					if(self.changeGestureTimer == None):
+						self.changeGestureTimer = now
+					elif(now - self.changeGestureTimer > CHANGE_DELAY):
+						self.changeGestureTimer = None
+						# End the current gesture
+						curr_gesture.state = GestureState.ENDED
+						# EVENT: On End
+						self._fireEvent(curr_gesture)
+						# If at least one contact is still down, init a new gesture
+						if(len(contacts) > 0):
+							curr_gesture = SenselGesture(len(contacts), weight_class, avg_x, avg_y, now)
+							self.intraGestureTimer = now
+							print("inited gesture")
+				else:
+					# If the gestures are equal, then clear the change gesture timer
+					if(not self.changeGestureTimer == None):
+						self.changeGestureTimer = None
+			if(curr_gesture.state == GestureState.INITED):
+				# If the elapsed time is greater than the delay time than start the gesture
+				if(now - self.intraGestureTimer >= START_DELAY):
+					curr_gesture.state = GestureState.STARTED
+					# EVENT: On start
+					self._fireEvent(curr_gesture)
+		else:
+			# If at least one contact is down, create a new gesture recognizer
+			if(len(contacts) > 0):
+				curr_gesture = SenselGesture(len(contacts), weight_class, avg_x, avg_y, now)
+				self.intraGestureTimer = now
+				print("inited gesture @ " + str(self.intraGestureTimer))
+
+		self.curr_gesture = curr_gesture
+
 if __name__ == '__main__':
 	sgh = SenselGestureHandler()
 	sgh.start()
@@ -4,6 +4,8 @@
 
 from math import *
 from enum import Enum
+from array import array
+import copy
 import sensel
 import time
 
@@ -16,6 +18,22 @@ MOE_STATIONARY = 1.5
 # Required movement distance to be classified as a pan rather than a tap
 PAN_DIST = 3
 
+# MOVED event coalescing, off by default (see coalesceMoves). Moves are merged
+# until MOVE_EVENT_RATE (Hz) allows another event, and until the gesture has
+# moved MOVE_EVENT_MIN_DIST (pixels) or its force changed by
+# MOVE_EVENT_MIN_FORCE since the last one. None/0 disables each check.
+MOVE_EVENT_RATE = None
+MOVE_EVENT_MIN_DIST = 0
+MOVE_EVENT_MIN_FORCE = 0
+
+# Points kept of a gesture's trajectory; older ones are overwritten
+TRAJECTORY_CAPACITY = 128
+
+# Optional decimation: a point is only kept if it's at least this far (pixels)
+# or this long (s) from the last kept point. The summaries still see every point.
+TRAJECTORY_MIN_DIST = 0
+TRAJECTORY_MIN_INTERVAL = 0
+
 # Weight class maxiumums
 LIGHT_CLASS_MIN = 0
 MEDIUM_CLASS_MIN = 2500
@@ -56,34 +74,142 @@ def euclideanDist(a, b):
 	# print(sqrt((a[0]-b[0])**2 + (a[1]-b[1])**2))
 	return sqrt((a[0]-b[0])**2 + (a[1]-b[1])**2)
 
+class Trajectory(object):
+	"""Ring buffer of (x, y, time) points with running summaries
+
+	Memory and the cost of adding a point are constant however long the
+	gesture runs. path_length, the bounding box and first/last point cover
+	every point added, including ones decimated or overwritten.
+	"""
+	def __init__(self, capacity=TRAJECTORY_CAPACITY, min_dist=TRAJECTORY_MIN_DIST, min_interval=TRAJECTORY_MIN_INTERVAL):
+		super(Trajectory, self).__init__()
+		self.capacity = capacity
+		self.min_dist = min_dist
+		self.min_interval = min_interval
+		self._x = array('d', [0.0]) * capacity
+		self._y = array('d', [0.0]) * capacity
+		self._t = array('d', [0.0]) * capacity
+		self._start = 0
+		self._len = 0
+		self.num_points = 0
+		self.first = None
+		self.last = None
+		self.path_length = 0.0
+		self.min_x = self.min_y = self.max_x = self.max_y = None
+
+	def add(self, x, y, t):
+		if(self.num_points == 0):
+			self.first = (x, y, t)
+			self.min_x = self.max_x = x
+			self.min_y = self.max_y = y
+		else:
+			self.path_length += euclideanDist((x, y), self.last)
+			self.min_x = min(self.min_x, x)
+			self.max_x = max(self.max_x, x)
+			self.min_y = min(self.min_y, y)
+			self.max_y = max(self.max_y, y)
+		self.last = (x, y, t)
+		self.num_points += 1
+
+		if(self._len > 0 and (self.min_dist or self.min_interval)):
+			i = (self._start + self._len - 1) % self.capacity
+			near = not self.min_dist or euclideanDist((x, y), (self._x[i], self._y[i])) < self.min_dist
+			recent = not self.min_interval or t - self._t[i] < self.min_interval
+			if(near and recent):
+				return
+		if(self._len < self.capacity):
+			i = (self._start + self._len) % self.capacity
+			self._len += 1
+		else:
+			i = self._start
+			self._start = (self._start + 1) % self.capacity
+		self._x[i] = x
+		self._y[i] = y
+		self._t[i] = t
+
+	# Angle (radians) from the first point to the last, counterclockwise from the +x axis
+	def netAngle(self):
+		if(self.num_points < 2):
+			return None
+		return atan2(self.first[1] - self.last[1], self.last[0] - self.first[0])
+
+	def boundingBox(self):
+		return (self.min_x, self.min_y, self.max_x, self.max_y)
+
+	def __len__(self):
+		return self._len
+
+	def __getitem__(self, i):
+		if(i < 0):
+			i += self._len
+		if(i < 0 or i >= self._len):
+			raise IndexError(i)
+		j = (self._start + i) % self.capacity
+		return (self._x[j], self._y[j], self._t[j])
+
+	def __iter__(self):
+		for i in range(self._len):
+			yield self[i]
+
+	def copy(self):
+		trajectory = copy.copy(self)
+		trajectory._x = self._x[:]
+		trajectory._y = self._y[:]
+		trajectory._t = self._t[:]
+		return trajectory
+
 class SenselGesture(object):
 	"""docstring for SenselGesture"""
-	def __init__(self, contact_points, weight_class, down_x, down_y):
+	def __init__(self, contact_points, weight_class, down_x, down_y, down_start_time):
 		super(SenselGesture, self).__init__()
 		self.contact_points = contact_points
 		self.weight_class = weight_class
 		self.down_x = down_x
 		self.down_y = down_y
-		self.down_start_time = time.time()
+		self.down_start_time = down_start_time
 		self.gesture_type = None
 		#self.movement_dist = None
 		self.has_started = False
 		self.state = GestureState.INITED
-		self.tracked_locations = []
-		self.addLocation((down_x, down_y))
+		self.trajectory = Trajectory()
+		self.addLocation((down_x, down_y), down_start_time)
 		self.ydirection = None
 		self.xdirection = None
 		self.bestdirection = None
 		self.angle = None # Radians
 		self.xy_contacts = None
 		self.avg_location = None
+		self.force = None
+		# Movement since the previous MOVED event (pixels), and its velocity (pixels/s)
+		self.delta = (0.0, 0.0)
+		self.velocity = (0.0, 0.0)
+		self.last_move_time = down_start_time
+		self.last_move_location = (down_x, down_y)
+		self.last_move_force = None
+		self.move_pending = False
 
-	def addLocation(self, location):
-		self.tracked_locations.append(location)
-		if(len(self.tracked_locations) > 1):
-			delta_y = self.tracked_locations[0][1] - location[1]
-			delta_x = self.tracked_locations[0][0] - location[0]
-			self.angle = atan2(delta_y, -delta_x)
+	# The locations still held by the trajectory, oldest first
+	@property
+	def tracked_locations(self):
+		return [(x, y) for (x, y, t) in self.trajectory]
+
+	# Copy of the gesture as it is now, trajectory included, for handling an
+	# event after the handler has gone on updating the gesture
+	def snapshot(self):
+		gesture = copy.copy(self)
+		gesture.trajectory = self.trajectory.copy()
+		if(self.xy_contacts != None):
+			gesture.xy_contacts = list(self.xy_contacts)
+		return gesture
+
+	def addLocation(self, location, location_time=None):
+		if(location_time == None):
+			location_time = time.time()
+		self.trajectory.add(location[0], location[1], location_time)
+		if(self.trajectory.num_points > 1):
+			delta_y = self.trajectory.first[1] - location[1]
+			delta_x = self.trajectory.first[0] - location[0]
+			self.angle = self.trajectory.netAngle()
 			if(self.angle > pi/4 and self.angle <= 3*pi/4):
 				self.bestdirection = Direction.UP
 			elif(self.angle > -pi/4 and self.angle <= pi/4):
@@ -104,7 +230,7 @@ class SenselGesture(object):
 				self.xdirection = Direction.RIGHT
 
 	def __str__(self):
-		return str(self.gesture_type) + ": " + str(self.contact_points) + " fingers, " + str(self.weight_class) + ", state: " + str(self.state) + ", started @ (" + str(self.down_x) + ", " + str(self.down_y) + ", " + str(len(self.tracked_locations)) + " locations, " + str(self.xdirection) + " and " + str(self.ydirection) + ", best direction: " + str(self.bestdirection) + ", at " + str(self.angle) + " radians, " + str(self.xy_contacts)
+		return str(self.gesture_type) + ": " + str(self.contact_points) + " fingers, " + str(self.weight_class) + ", state: " + str(self.state) + ", started @ (" + str(self.down_x) + ", " + str(self.down_y) + ", " + str(self.trajectory.num_points) + " locations, " + str(self.xdirection) + " and " + str(self.ydirection) + ", best direction: " + str(self.bestdirection) + ", at " + str(self.angle) + " radians, " + str(self.xy_contacts)
 
 #########
 
@@ -114,6 +240,18 @@ class SenselGestureHandler(object):
 	def __init__(self, arg):
 		super(SenselGestureHandler, self).__init__()
 		self.arg = arg
+		self.startGestureTimer = None
+		self.curr_gesture = None
+		# Time of the frame being processed, see frameTime
+		self.frame_time = None
+		self._event_sink = None
+		# Set by dispatchEvents
+		self.dispatcher = None
+		# Set to a sensel.SenselLatencyStats to time frames through to gesture events
+		self.latency_stats = None
+		self.move_event_rate = MOVE_EVENT_RATE
+		self.move_event_min_dist = MOVE_EVENT_MIN_DIST
+		self.move_event_min_force = MOVE_EVENT_MIN_FORCE
 		
 	def getWeightClass(self, weight):
 		if(weight >= HEAVY_CLASS_MIN):
@@ -126,115 +264,197 @@ class SenselGestureHandler(object):
 	def gestureEvent(self, gesture, arg):
 		#print("You must implement this to recieve events")
 		if(gesture.state == GestureState.STARTED):
-			print("Started gesture: " + str(gesture) + " @ " + str(time.time()))
+			print("Started gesture: " + str(gesture) + " @ " + str(self.frame_time))
 		#elif(gesture.state == GestureState.MOVED):
 			#print("Gesture moved")
 		elif(gesture.state == GestureState.ENDED):
-			print("Gesture ended: " + str(gesture) + " @ " + str(time.time()))
+			print("Gesture ended: " + str(gesture) + " @ " + str(self.frame_time))
 		#else:
 		#	print("Gesture Inited")
 
-	def start(self):
+	# Events go to a gestures() stream or dispatcher when one is attached, otherwise to gestureEvent
+	def _fireEvent(self, gesture):
+		if(self.latency_stats):
+			self.latency_stats.eventFired()
+		if(self._event_sink):
+			self._event_sink(gesture)
+		else:
+			self.gestureEvent(gesture, self.arg)
+
+	# Runs gestureEvent on worker threads from now on, so a slow handler doesn't
+	# hold up reading frames. See sensel_dispatch.GestureDispatcher.
+	def dispatchEvents(self, num_workers=1, maxsize=None, overflow=None):
+		import sensel_dispatch
+		self.dispatcher = sensel_dispatch.GestureDispatcher(lambda gesture: self.gestureEvent(gesture, self.arg), num_workers, maxsize, overflow)
+		self._event_sink = self.dispatcher.dispatch
+		return self.dispatcher
+
+	# Async iterator over gesture events, see sensel_asyncio.GestureStream
+	def gestures(self, sensel_device=None, maxsize=None):
+		import sensel_asyncio
+		return sensel_asyncio.GestureStream(self, sensel_device, maxsize)
+
+	# Snapshot of the latency stats as a dict, or None if they aren't enabled
+	def stats(self):
+		if(self.latency_stats == None):
+			return None
+		return self.latency_stats.stats()
+
+	# Merges MOVED events so at most rate of them are fired a second, and only
+	# once the gesture has moved min_dist (pixels) or its force changed by
+	# min_force. Each MOVED event carries the delta and velocity since the
+	# previous one. Moves still pending when the gesture ends are fired just
+	# before the ENDED event.
+	def coalesceMoves(self, rate=None, min_dist=0, min_force=0):
+		self.move_event_rate = rate
+		self.move_event_min_dist = min_dist
+		self.move_event_min_force = min_force
+
+	def _moveDue(self, gesture, now):
+		if(self.move_event_rate and now - gesture.last_move_time < 1.0 / self.move_event_rate):
+			return False
+		if(not self.move_event_min_dist and not self.move_event_min_force):
+			return True
+		if(self.move_event_min_dist and euclideanDist(gesture.avg_location, gesture.last_move_location) >= self.move_event_min_dist):
+			return True
+		return bool(self.move_event_min_force) and (gesture.last_move_force == None or
+			abs(gesture.force - gesture.last_move_force) >= self.move_event_min_force)
+
+	def _fireMove(self, gesture, now):
+		(x, y) = gesture.avg_location
+		gesture.delta = (x - gesture.last_move_location[0], y - gesture.last_move_location[1])
+		dt = now - gesture.last_move_time
+		if(dt > 0):
+			gesture.velocity = (gesture.delta[0] / dt, gesture.delta[1] / dt)
+		gesture.last_move_time = now
+		gesture.last_move_location = gesture.avg_location
+		gesture.last_move_force = gesture.force
+		gesture.move_pending = False
+		gesture.state = GestureState.MOVED
+		self._fireEvent(gesture)
+
+	def openDevice(self):
 		sensel_device = sensel.SenselDevice()
 
 		if not sensel_device.openConnection():
 			print("Unable to open Sensel sensor!")
 			exit()
 
+		if(self.latency_stats):
+			sensel_device.setLatencyStats(self.latency_stats)
+
 		#Enable contact sending
 		sensel_device.setFrameContentControl(sensel.SENSEL_FRAME_CONTACTS_FLAG)
 	  
 		#Enable scanning
 		sensel_device.startScanning(0)
+		return sensel_device
 
-		startGestureTimer = None
-		curr_gesture = None
+	def start(self):
+		sensel_device = self.openDevice()
 
 		while True: 
-			contacts = sensel_device.readContacts()
-	  		#if(startGestureTimer): print(str(time.time()))
+			contacts = sensel_device.readContactBatch()
+	  		#if(self.startGestureTimer): print(str(self.frame_time))
 			if contacts == None:
-				print("NO CONTACTS")
 				continue
-	   
-			# Calculate the average of the locations and weights
-			avg_x = None
-			avg_y = None
-			avg_weight = None
-			delta_dist = None
-			xy_contacts = []
-			if(len(contacts) > 0):
-				sum_x = 0
-				sum_y = 0
-				sum_weight = 0
-				for c in contacts:
-					x_px = convertToPixels(c.x_pos_mm)
-					sum_x += x_px
-					y_px = convertToPixels(c.y_pos_mm)
-					sum_y += y_px
-					xy_contacts.append((x_px, y_px))
-					sum_weight += c.total_force
-				avg_x = sum_x / len(contacts)
-				avg_y = sum_y / len(contacts)
-				avg_weight = sum_weight / len(contacts)
-				weight_class = self.getWeightClass(avg_weight)
-				#print(str(weight_class) + " " + str(avg_x) + " " + str(avg_y) + " " + str(avg_weight))
-				if(isActiveGesture(curr_gesture)):
-					#print(str(curr_gesture.gesture_type) + " " + str(curr_gesture.state) + " " + str(isActiveGesture(curr_gesture)))
-					curr_gesture.xy_contacts = xy_contacts
-					delta_dist = euclideanDist((avg_x, avg_y), (curr_gesture.down_x, curr_gesture.down_y))
-					curr_gesture.avg_location = (avg_x, avg_y)
-					#print(delta_dist)
-					if(not curr_gesture.has_started):
-						#print("checking start delay: " + str(time.time()) + " - " + str(startGestureTimer) + " >=? " + str(START_DELAY) + " ... " + str(time.time() - startGestureTimer))
-						# If the elapsed time is greater than the delay time than start the gesture
-						if(time.time() - startGestureTimer >= START_DELAY):
-							# Set the type
-							#print("inside!!! " + str(delta_dist))
-							if(delta_dist >= PAN_DIST):
-								curr_gesture.gesture_type = GestureType.PAN
-								#print(curr_gesture.gesture_type)
-							else:
-								curr_gesture.gesture_type = GestureType.TAP
-							#curr_gesture.movement_dist = delta_dist
-							curr_gesture.contact_points = len(contacts)
-							curr_gesture.weight_class = weight_class
-							# EVENT: On start
-							curr_gesture.state = GestureState.STARTED
-							self.gestureEvent(curr_gesture, self.arg)
-							curr_gesture.has_started = True
-					# Modify to determine swipes vs taps by start call
-					if(curr_gesture.state == GestureState.MOVED or (delta_dist and delta_dist > MOE_STATIONARY)):
-						# EVENT: On Move
-						curr_gesture.state = GestureState.MOVED
-						curr_gesture.addLocation((avg_x, avg_y))
-						self.gestureEvent(curr_gesture, self.arg)
-						#print("Gesture has moved: " + str(delta_dist))
-
-
-				else:
-					# Init the new gesture
-					curr_gesture = SenselGesture(len(contacts), weight_class, avg_x, avg_y)
-					startGestureTimer = time.time()
-					#print("Inited gesture")
-			# No contacts remain, so end the gesture
-			else:
-				if(isActiveGesture(curr_gesture)):
-					if(not curr_gesture.has_started):
-						# Default to taps here since the touch was so quick it triggered before the start
-						curr_gesture.gesture_type = GestureType.TAP
-						# Trigger a quick start call before the end call
-						# This can happen with quick taps
-						# EVENT: On Start
-						curr_gesture.state = GestureState.STARTED
-						self.gestureEvent(curr_gesture, self.arg)
-					curr_gesture.state = GestureState.ENDED
-					# EVENT: On End
-					self.gestureEvent(curr_gesture, self.arg)
+			self.processContacts(contacts)
 
 		sensel_device.stopScanning();
 		sensel_device.closeConnection();
 
+	# Gestures are timed on the sensor clock (see sensel.SenselFrame) so START_DELAY
+	# doesn't depend on how late a frame gets processed. Contacts without a
+	# sensor time fall back to the wall clock.
+	def frameTime(self, contacts):
+		sensor_time = getattr(contacts, 'sensor_time', None)
+		if(sensor_time == None):
+			return time.time()
+		return sensor_time
+
+	# Runs the gesture state machine on one frame of contacts
+	def processContacts(self, contacts):
+		curr_gesture = self.curr_gesture
+		now = self.frameTime(contacts)
+		self.frame_time = now
+
+		# Calculate the average of the locations and weights
+		avg_x = None
+		avg_y = None
+		avg_weight = None
+		delta_dist = None
+		xy_contacts = []
+		if(len(contacts) > 0):
+			(avg_x, avg_y) = contacts.centroid()
+			avg_x = convertToPixels(avg_x)
+			avg_y = convertToPixels(avg_y)
+			xy_contacts = [(convertToPixels(x), convertToPixels(y)) for (x, y) in
+				zip(contacts.column('x_pos_mm'), contacts.column('y_pos_mm'))]
+			avg_weight = contacts.meanForce()
+			weight_class = self.getWeightClass(avg_weight)
+			#print(str(weight_class) + " " + str(avg_x) + " " + str(avg_y) + " " + str(avg_weight))
+			if(isActiveGesture(curr_gesture)):
+				#print(str(curr_gesture.gesture_type) + " " + str(curr_gesture.state) + " " + str(isActiveGesture(curr_gesture)))
+				curr_gesture.xy_contacts = xy_contacts
+				delta_dist = euclideanDist((avg_x, avg_y), (curr_gesture.down_x, curr_gesture.down_y))
+				curr_gesture.avg_location = (avg_x, avg_y)
+				curr_gesture.force = avg_weight
+				#print(delta_dist)
+				if(not curr_gesture.has_started):
+					#print("checking start delay: " + str(time.time()) + " - " + str(self.startGestureTimer) + " >=? " + str(START_DELAY) + " ... " + str(time.time() - self.startGestureTimer))
+					# If the elapsed time is greater than the delay time than start the gesture
+					if(now - self.startGestureTimer >= START_DELAY):
+						# Set the type
+						#print("inside!!! " + str(delta_dist))
+						if(delta_dist >= PAN_DIST):
+							curr_gesture.gesture_type = GestureType.PAN
+							#print(curr_gesture.gesture_type)
+						else:
+							curr_gesture.gesture_type = GestureType.TAP
+						#curr_gesture.movement_dist = delta_dist
+						curr_gesture.contact_points = len(contacts)
+						curr_gesture.weight_class = weight_class
+						# EVENT: On start
+						curr_gesture.state = GestureState.STARTED
+						self._fireEvent(curr_gesture)
+						curr_gesture.has_started = True
+				# Modify to determine swipes vs taps by start call
+				if(curr_gesture.state == GestureState.MOVED or (delta_dist and delta_dist > MOE_STATIONARY)):
+					# EVENT: On Move
+					curr_gesture.state = GestureState.MOVED
+					curr_gesture.addLocation((avg_x, avg_y), now)
+					if(self._moveDue(curr_gesture, now)):
+						self._fireMove(curr_gesture, now)
+					else:
+						curr_gesture.move_pending = True
+					#print("Gesture has moved: " + str(delta_dist))
+
+
+			else:
+				# Init the new gesture
+				curr_gesture = SenselGesture(len(contacts), weight_class, avg_x, avg_y, now)
+				self.startGestureTimer = now
+				#print("Inited gesture")
+		# No contacts remain, so end the gesture
+		else:
+			if(isActiveGesture(curr_gesture)):
+				if(curr_gesture.move_pending):
+					# EVENT: On Move, the last of the coalesced moves
+					self._fireMove(curr_gesture, now)
+				if(not curr_gesture.has_started):
+					# Default to taps here since the touch was so quick it triggered before the start
+					curr_gesture.gesture_type = GestureType.TAP
+					# Trigger a quick start call before the end call
+					# This can happen with quick taps
+					# EVENT: On Start
+					curr_gesture.state = GestureState.STARTED
+					self._fireEvent(curr_gesture)
+				curr_gesture.state = GestureState.ENDED
+				# EVENT: On End
+				self._fireEvent(curr_gesture)
+
+		self.curr_gesture = curr_gesture
+
 if __name__ == '__main__':
 	sgh = SenselGestureHandler(None)
 	sgh.start()
@@ -0,0 +1,377 @@
+#
+# Multi-touch gesture recognizers: pinch, rotate, swipe and long press.
+#
+#   engine = RecognizerEngine()
+#   engine.start()
+#
+# or subclass RecognizerEngine and override gestureEvent, as with
+# sensel_framework_simple.SenselGestureHandler. Each frame's features
+# (centroid, spread, principal angle, total force, centroid velocity) are
+# computed once, over whole contact columns, and every recognizer reads them
+# from the same FrameFeatures, so adding recognizers doesn't add passes over
+# the contacts.
+#
+# Positions are in mm and times in seconds of sensor time. As in the
+# simple framework, y grows towards the bottom of the sensor.
+#
+
+import collections
+import copy
+from enum import Enum
+from math import atan2, hypot, pi, sqrt
+
+import sensel
+from sensel_framework_simple import Direction, GestureState, SenselGestureHandler
+
+# Change in spread (mm) before two or more fingers are a pinch
+PINCH_MIN_DIST = 4.0
+
+# Rotation (radians) before two or more fingers are a rotate
+ROTATE_MIN_ANGLE = pi / 12
+
+# Fingers closer together than this (mm) have no meaningful angle
+ROTATE_MIN_SPREAD = 2.0
+
+# A swipe must travel this far (mm), this fast (mm/s) when the fingers lift,
+# and be over within SWIPE_MAX_DURATION (s)
+SWIPE_MIN_DIST = 10.0
+SWIPE_MIN_VELOCITY = 100.0
+SWIPE_MAX_DURATION = 1.0
+
+# Frames of centroid velocity averaged for a swipe's lift-off velocity
+SWIPE_VELOCITY_FRAMES = 5
+
+# Fingers held within LONG_PRESS_MOE (mm) of where they landed for
+# LONG_PRESS_DELAY (s) are a long press
+LONG_PRESS_DELAY = 0.5
+LONG_PRESS_MOE = 2.0
+
+class RecognizedType(Enum):
+    PINCH = 0
+    ROTATE = 1
+    SWIPE = 2
+    LONG_PRESS = 3
+
+#########
+
+# Contact columns (x mm, y mm, force) of a ContactBatch or a list of SenselContacts
+def _contactColumns(contacts):
+    if isinstance(contacts, sensel.ContactBatch):
+        return (contacts.column('x_pos_mm'), contacts.column('y_pos_mm'), contacts.column('total_force'))
+    return ([c.x_pos_mm for c in contacts], [c.y_pos_mm for c in contacts], [c.total_force for c in contacts])
+
+# Change from angle a to angle b of a principal axis, which has no direction,
+# so angles wrap every pi
+def _angleDelta(a, b):
+    delta = b - a
+    if delta > pi / 2:
+        delta -= pi
+    elif delta <= -pi / 2:
+        delta += pi
+    return delta
+
+class FrameFeatures(object):
+    """Features of one frame's contacts, shared by all the recognizers
+
+    spread is the mean distance of the contacts from their centroid, angle the
+    angle of their principal axis in (-pi/2, pi/2] (the line through them
+    for two contacts), and velocity the centroid's velocity since the
+    previous frame in mm/s. angle is None for fewer than two contacts and
+    velocity is None when the number of contacts changed, since the centroid
+    jumps then.
+    """
+
+    def __init__(self, contacts, now, previous=None):
+        self.time = now
+        self.num_contacts = len(contacts)
+        self.centroid = None
+        self.spread = 0.0
+        self.angle = None
+        self.total_force = 0
+        self.velocity = None
+        if self.num_contacts == 0:
+            return
+
+        (x, y, force) = _contactColumns(contacts)
+        if sensel.numpy is not None and isinstance(x, sensel.numpy.ndarray):
+            numpy = sensel.numpy
+            (cx, cy) = (float(x.mean()), float(y.mean()))
+            (dx, dy) = (x - cx, y - cy)
+            self.spread = float(numpy.hypot(dx, dy).mean())
+            (sxx, syy, sxy) = (float(numpy.dot(dx, dx)), float(numpy.dot(dy, dy)), float(numpy.dot(dx, dy)))
+            self.total_force = int(force.sum(dtype=numpy.uint64))
+        else:
+            n = float(self.num_contacts)
+            (cx, cy) = (sum(x) / n, sum(y) / n)
+            (sxx, syy, sxy, spread) = (0.0, 0.0, 0.0, 0.0)
+            for (xi, yi) in zip(x, y):
+                (dx, dy) = (xi - cx, yi - cy)
+                sxx += dx * dx
+                syy += dy * dy
+                sxy += dx * dy
+                spread += sqrt(dx * dx + dy * dy)
+            self.spread = spread / n
+            self.total_force = sum(force)
+        self.centroid = (cx, cy)
+
+        if self.num_contacts > 1:
+            self.angle = 0.5 * atan2(2 * sxy, sxx - syy)
+        if previous is not None and previous.num_contacts == self.num_contacts and now > previous.time:
+            dt = now - previous.time
+            self.velocity = ((cx - previous.centroid[0]) / dt, (cy - previous.centroid[1]) / dt)
+
+class RecognizedGesture(object):
+    """A recognized gesture: its type, state, and the parameters its recognizer measured"""
+    def __init__(self, gesture_type, features):
+        super(RecognizedGesture, self).__init__()
+        self.gesture_type = gesture_type
+        self.state = GestureState.INITED
+        self.contact_points = features.num_contacts
+        self.start_time = features.time
+        self.start_location = features.centroid
+        self.features = features
+        self.scale = 1.0      # PINCH: spread relative to the spread at touch down
+        self.rotation = 0.0   # ROTATE: radians turned since touch down, clockwise positive
+        self.velocity = None  # SWIPE: lift-off velocity (mm/s)
+        self.direction = None # SWIPE
+        self.duration = 0.0
+
+    # Copy of the gesture as it is now. features is replaced, never modified,
+    # on each event, so it's shared with the copy.
+    def snapshot(self):
+        return copy.copy(self)
+
+    def __str__(self):
+        return "%s: %d fingers, state: %s, scale %.2f, rotation %.2f, velocity %s, %s, %.2f s" % (
+            self.gesture_type, self.contact_points, self.state, self.scale, self.rotation,
+            self.velocity, self.direction, self.duration)
+
+class GestureRecognizer(object):
+    """Base class for recognizers
+
+    update() is called with every frame's FrameFeatures and calls
+    fire(gesture) for each event, with gesture.state set as in the simple
+    framework (STARTED, MOVED, ENDED). A recognizer tracks one gesture at a
+    time.
+    """
+
+    gesture_type = None
+
+    def __init__(self):
+        self.gesture = None
+
+    def update(self, features, fire):
+        raise NotImplementedError
+
+    def reset(self):
+        self.gesture = None
+
+    def _begin(self, features):
+        self.gesture = RecognizedGesture(self.gesture_type, features)
+        return self.gesture
+
+    def _fire(self, state, features, fire):
+        gesture = self.gesture
+        gesture.state = state
+        gesture.features = features
+        gesture.duration = features.time - gesture.start_time
+        fire(gesture)
+
+    # Ends the gesture if it started, and forgets it either way
+    def _end(self, features, fire):
+        if self.gesture is not None and self.gesture.state != GestureState.INITED:
+            self._fire(GestureState.ENDED, features, fire)
+        self.gesture = None
+
+class PinchRecognizer(GestureRecognizer):
+    """Two or more fingers moving apart or together; gesture.scale is the
+    spread relative to the spread when they landed"""
+
+    gesture_type = RecognizedType.PINCH
+
+    def update(self, features, fire):
+        gesture = self.gesture
+        if gesture is not None and features.num_contacts != gesture.contact_points:
+            self._end(features, fire)
+            gesture = None
+        if features.num_contacts < 2:
+            return
+        if gesture is None:
+            gesture = self._begin(features)
+            self._base_spread = features.spread
+            return
+        if self._base_spread <= 0:
+            return
+
+        scale = features.spread / self._base_spread
+        if gesture.state == GestureState.INITED:
+            if abs(features.spread - self._base_spread) >= PINCH_MIN_DIST:
+                gesture.scale = scale
+                self._fire(GestureState.STARTED, features, fire)
+        elif scale != gesture.scale:
+            gesture.scale = scale
+            self._fire(GestureState.MOVED, features, fire)
+
+class RotateRecognizer(GestureRecognizer):
+    """Two or more fingers turning about their centroid; gesture.rotation is
+    the angle turned since they landed"""
+
+    gesture_type = RecognizedType.ROTATE
+
+    def update(self, features, fire):
+        gesture = self.gesture
+        if gesture is not None and features.num_contacts != gesture.contact_points:
+            self._end(features, fire)
+            gesture = None
+        if features.num_contacts < 2 or features.spread < ROTATE_MIN_SPREAD:
+            return
+        if gesture is None:
+            gesture = self._begin(features)
+            self._last_angle = features.angle
+            return
+
+        delta = _angleDelta(self._last_angle, features.angle)
+        self._last_angle = features.angle
+        if delta == 0:
+            return
+        gesture.rotation += delta
+        if gesture.state == GestureState.INITED:
+            if abs(gesture.rotation) >= ROTATE_MIN_ANGLE:
+                self._fire(GestureState.STARTED, features, fire)
+        else:
+            self._fire(GestureState.MOVED, features, fire)
+
+class SwipeRecognizer(GestureRecognizer):
+    """A quick flick: fired (STARTED then ENDED) when the fingers lift, with
+    gesture.velocity and gesture.direction taken from the last few frames"""
+
+    gesture_type = RecognizedType.SWIPE
+
+    def __init__(self):
+        super(SwipeRecognizer, self).__init__()
+        self._velocities = collections.deque(maxlen=SWIPE_VELOCITY_FRAMES)
+        self._last = None
+
+    def reset(self):
+        super(SwipeRecognizer, self).reset()
+        self._velocities.clear()
+        self._last = None
+
+    def update(self, features, fire):
+        if features.num_contacts > 0:
+            if self.gesture is None:
+                self._begin(features)
+            self.gesture.contact_points = max(self.gesture.contact_points, features.num_contacts)
+            if features.velocity is not None:
+                self._velocities.append(features.velocity)
+            self._last = features
+            return
+        if self.gesture is None:
+            return
+
+        gesture = self.gesture
+        last = self._last
+        velocities = self._velocities
+        if velocities and last.time - gesture.start_time <= SWIPE_MAX_DURATION:
+            vx = sum(v[0] for v in velocities) / len(velocities)
+            vy = sum(v[1] for v in velocities) / len(velocities)
+            dist = hypot(last.centroid[0] - gesture.start_location[0],
+                         last.centroid[1] - gesture.start_location[1])
+            if dist >= SWIPE_MIN_DIST and hypot(vx, vy) >= SWIPE_MIN_VELOCITY:
+                gesture.velocity = (vx, vy)
+                if abs(vx) >= abs(vy):
+                    gesture.direction = Direction.RIGHT if vx > 0 else Direction.LEFT
+                else:
+                    gesture.direction = Direction.DOWN if vy > 0 else Direction.UP
+                self._fire(GestureState.STARTED, last, fire)
+                self._fire(GestureState.ENDED, last, fire)
+        self.reset()
+
+class LongPressRecognizer(GestureRecognizer):
+    """Fingers held still for LONG_PRESS_DELAY; ends when they lift, move or
+    another finger lands"""
+
+    gesture_type = RecognizedType.LONG_PRESS
+
+    def __init__(self):
+        super(LongPressRecognizer, self).__init__()
+        self._moved = False
+
+    def reset(self):
+        super(LongPressRecognizer, self).reset()
+        self._moved = False
+
+    def update(self, features, fire):
+        gesture = self.gesture
+        if gesture is not None:
+            if features.num_contacts != gesture.contact_points:
+                self._end(features, fire)
+                gesture = None
+            elif self._moving(gesture, features):
+                self._end(features, fire)
+                # No long press again until the fingers lift
+                self._moved = True
+                return
+        if features.num_contacts == 0:
+            self._moved = False
+            return
+        if self._moved:
+            return
+        if gesture is None:
+            gesture = self._begin(features)
+            self._start_features = features
+        elif gesture.state == GestureState.INITED and features.time - gesture.start_time >= LONG_PRESS_DELAY:
+            self._fire(GestureState.STARTED, features, fire)
+
+    # Whether the fingers slid, spread or turned more than LONG_PRESS_MOE since
+    # landing, each as distance moved at the fingers
+    def _moving(self, gesture, features):
+        start = self._start_features
+        if hypot(features.centroid[0] - start.centroid[0], features.centroid[1] - start.centroid[1]) > LONG_PRESS_MOE:
+            return True
+        if abs(features.spread - start.spread) > LONG_PRESS_MOE:
+            return True
+        if features.angle is not None and start.angle is not None:
+            return features.spread * abs(_angleDelta(start.angle, features.angle)) > LONG_PRESS_MOE
+        return False
+
+def defaultRecognizers():
+    return [PinchRecognizer(), RotateRecognizer(), SwipeRecognizer(), LongPressRecognizer()]
+
+#########
+
+# Create a new RecognizerEngine and call the start method to start listening for events
+class RecognizerEngine(SenselGestureHandler):
+    """Runs a set of GestureRecognizers on every frame
+
+    Opening the device, gestures(), stats() and latency_stats work as in
+    SenselGestureHandler; events are RecognizedGestures.
+    """
+
+    def __init__(self, arg=None, recognizers=None):
+        super(RecognizerEngine, self).__init__(arg)
+        if recognizers is None:
+            recognizers = defaultRecognizers()
+        self.recognizers = list(recognizers)
+        self.features = None
+
+    def addRecognizer(self, recognizer):
+        self.recognizers.append(recognizer)
+
+    def gestureEvent(self, gesture, arg):
+        if(gesture.state == GestureState.STARTED):
+            print("Started gesture: " + str(gesture) + " @ " + str(self.frame_time))
+        elif(gesture.state == GestureState.ENDED):
+            print("Gesture ended: " + str(gesture) + " @ " + str(self.frame_time))
+
+    def processContacts(self, contacts):
+        now = self.frameTime(contacts)
+        self.frame_time = now
+        features = FrameFeatures(contacts, now, self.features)
+        self.features = features
+        for recognizer in self.recognizers:
+            recognizer.update(features, self._fireEvent)
+
+if __name__ == '__main__':
+    engine = RecognizerEngine()
+    engine.start()
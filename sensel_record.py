@@ -0,0 +1,257 @@
+#
+# Recording and replay of raw Sensel frames.
+#
+#   recorder = sensel_device.startRecording("session.snsl")
+#   ...
+#   sensel_device.stopRecording()
+#
+#   replay = SenselReplayDevice("session.snsl", paced=True)
+#   replay.startScanning(0)
+#   contacts = replay.readContacts()
+#
+# A recording is a header with the sensor geometry and frame rate, then one record per frame
+# (arrival time, frame size and the frame bytes exactly as they came off the
+# wire), then an index of record offsets written when the recorder is closed.
+# Recordings are memory-mapped for replay, so long sessions are never loaded
+# into memory. A recording whose recorder never closed (e.g. a crash) has no
+# index; it's rebuilt by walking the records when the file is opened.
+#
+
+import array
+import logging
+import mmap
+import threading
+import time
+from struct import Struct
+
+import sensel
+
+RECORDING_MAGIC = b'SNSLREC1'
+INDEX_MAGIC = b'SNSLIDX1'
+
+_header_struct = Struct('<8sHHddd') # magic, nrows, ncols, x_to_mm_factor, y_to_mm_factor, frame rate
+_record_struct = Struct('<dH')      # arrival time, frame size
+_offset_struct = Struct('<Q')
+_footer_struct = Struct('<QQ8s')    # index offset, frame count, magic
+
+class SenselRecordingError(sensel.SenselError):
+    pass
+
+# Record offsets are kept in an array while recording or rebuilding an index,
+# 8 bytes a frame
+def _offsetArray():
+    return array.array('Q')
+
+class SenselRecorder(object):
+    """Appends raw frames to a recording file"""
+
+    def __init__(self, path, nrows, ncols, mm_factors, frame_rate):
+        self.path = path
+        self._file = open(path, 'wb')
+        self._file.write(_header_struct.pack(RECORDING_MAGIC, nrows, ncols, mm_factors[0], mm_factors[1], frame_rate))
+        self._offsets = _offsetArray()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def record(self, frame_data, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            if self._file is None:
+                return
+            self._offsets.append(self._file.tell())
+            self._file.write(_record_struct.pack(timestamp, len(frame_data)))
+            self._file.write(frame_data)
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            index_offset = self._file.tell()
+            for offset in self._offsets:
+                self._file.write(_offset_struct.pack(offset))
+            self._file.write(_footer_struct.pack(index_offset, len(self._offsets), INDEX_MAGIC))
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class SenselRecording(object):
+    """Read-only, memory-mapped view of a recording
+
+    recording[i] is (arrival_time, frame_data) for frame i.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError: # Empty file
+            self._file.close()
+            raise SenselRecordingError("%s is not a Sensel recording" % path)
+
+        if len(self._map) < _header_struct.size:
+            self.close()
+            raise SenselRecordingError("%s is not a Sensel recording" % path)
+        (magic, self.nrows, self.ncols, x_to_mm_factor, y_to_mm_factor, self.frame_rate) = \
+            _header_struct.unpack_from(self._map, 0)
+        if magic != RECORDING_MAGIC:
+            self.close()
+            raise SenselRecordingError("%s is not a Sensel recording" % path)
+        self.mm_factors = (x_to_mm_factor, y_to_mm_factor)
+
+        self._index_offset = None
+        self._offsets = None
+        self._num_frames = 0
+        self._records_end = len(self._map)
+        if len(self._map) >= _header_struct.size + _footer_struct.size:
+            (index_offset, num_frames, magic) = _footer_struct.unpack_from(self._map, len(self._map) - _footer_struct.size)
+            if magic == INDEX_MAGIC and index_offset + num_frames * _offset_struct.size + _footer_struct.size == len(self._map):
+                self._index_offset = index_offset
+                self._num_frames = num_frames
+                self._records_end = index_offset
+        if self._index_offset is None:
+            logging.warning("%s has no index, rebuilding it" % path)
+            self._offsets = self._scanRecords()
+            self._num_frames = len(self._offsets)
+
+    # Walks the records of an unindexed recording, stopping at a truncated one
+    def _scanRecords(self):
+        offsets = _offsetArray()
+        offset = _header_struct.size
+        while offset + _record_struct.size <= self._records_end:
+            (timestamp, frame_size) = _record_struct.unpack_from(self._map, offset)
+            end = offset + _record_struct.size + frame_size
+            if end > self._records_end:
+                break
+            offsets.append(offset)
+            offset = end
+        return offsets
+
+    def _recordOffset(self, i):
+        if self._offsets is not None:
+            return self._offsets[i]
+        return _offset_struct.unpack_from(self._map, self._index_offset + i * _offset_struct.size)[0]
+
+    def __len__(self):
+        return self._num_frames
+
+    def timestamp(self, i):
+        return _record_struct.unpack_from(self._map, self._recordOffset(i))[0]
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._num_frames
+        if not 0 <= i < self._num_frames:
+            raise IndexError("frame index out of range")
+        offset = self._recordOffset(i)
+        (timestamp, frame_size) = _record_struct.unpack_from(self._map, offset)
+        start = offset + _record_struct.size
+        return (timestamp, self._map[start:start + frame_size])
+
+    def __iter__(self):
+        for i in range(self._num_frames):
+            yield self[i]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+class SenselReplayDevice(sensel.SenselDevice):
+    """SenselDevice that reads its frames from a recording instead of a sensor
+
+    With paced=True frames are returned at their recorded arrival times (scaled
+    by speed), otherwise as fast as they're read. Reads return None once the
+    recording is exhausted unless loop is set. Frames get the same sensor
+    times as they did live (counted from the start of the recording), so
+    gesture timing replays exactly at any speed.
+    """
+
+    def __init__(self, path, paced=False, speed=1.0, loop=False):
+        sensel.SenselDevice.__init__(self)
+        self.recording = SenselRecording(path)
+        self.paced = paced
+        self.speed = speed
+        self.loop = loop
+        self.port_name = path
+
+        (self.sensor_nrows, self.sensor_ncols) = (self.recording.nrows, self.recording.ncols)
+        (self.sensor_x_to_mm_factor, self.sensor_y_to_mm_factor) = self.recording.mm_factors
+        self._mm_factors = self.recording.mm_factors
+
+        self.seek(0)
+
+    @property
+    def finished(self):
+        return self._next_frame >= len(self.recording) and not self.loop
+
+    def seek(self, frame_index):
+        self._next_frame = frame_index
+        self._replay_start = None
+        self._resetSensorClock(self.recording.frame_rate)
+        # Lost frames before frame_index aren't counted, so after seeking
+        # elsewhere than the start sensor times are only relative
+        self._frame_index = frame_index - 1
+
+    def startScanning(self, num_buffers=0, poll_target_frames=1, max_poll_delay=None):
+        self.seek(0)
+
+    def stopScanning(self):
+        pass
+
+    def closeConnection(self):
+        self.recording.close()
+
+    # Reads the next frame like readFrame, then the ones after it that are
+    # already due, up to max_n frames in total. Unpaced, a frame is only due
+    # once it's asked for, so that's max_n frames (one if max_n is None). A
+    # call stops at the end of the recording, so when looping each pass ends
+    # a batch.
+    def readFrames(self, max_n=None, block=True, timeout=None):
+        if max_n is None and not self.paced:
+            max_n = 1
+        frames = []
+        frame_data = self._readRawFrame(block, timeout)
+        while frame_data is not None:
+            if frames:
+                frames[-1] = sensel.copyFrameImages(frames[-1])
+            frames.append(self._parseRawFrame(frame_data))
+            if (max_n is not None and len(frames) >= max_n) or self._next_frame >= len(self.recording):
+                break
+            frame_data = self._readRawFrame(False)
+        return frames
+
+    def _readRawFrame(self, block=True, timeout=None):
+        if self._next_frame >= len(self.recording):
+            if not self.loop or len(self.recording) == 0:
+                return None
+            # Start over without resetting the sensor clock, so time keeps
+            # moving forward across loops
+            self._next_frame = 0
+            self._replay_start = None
+
+        (timestamp, frame_data) = self.recording[self._next_frame]
+        if self.paced:
+            now = time.time()
+            if self._replay_start is None:
+                self._replay_start = (now, timestamp)
+            due = self._replay_start[0] + (timestamp - self._replay_start[1]) / self.speed
+            if due > now:
+                if not block:
+                    return None
+                if timeout is not None and due - now > timeout:
+                    time.sleep(timeout)
+                    return None
+                time.sleep(due - now)
+
+        self._next_frame += 1
+        return frame_data
@@ -0,0 +1,279 @@
+#
+# Shared-memory broadcast of parsed frames to other local processes
+# (Python 3.8+).
+#
+# The process that owns the sensor publishes every frame it reads:
+#
+#   sensel_device.startPublishing("sensel0")
+#   while True:
+#       frame = sensel_device.readFrame()   # also published
+#
+# and any number of other processes subscribe:
+#
+#   subscriber = SenselFrameSubscriber("sensel0")
+#   while True:
+#       frame = subscriber.readFrame()
+#       ...use frame...
+#       if not subscriber.frameValid(frame):
+#           ...the publisher overwrote it while it was in use...
+#
+# Frames go into a ring of fixed-size slots, each holding one frame's header,
+# contact records and decoded images. Every frame gets the next sequence
+# number. Subscribers read the slots in place: contacts are a ContactBatch
+# and images numpy arrays (memoryviews without numpy) over the shared memory,
+# so nothing is copied or serialized. A subscriber that falls more than a
+# ring behind skips ahead to the oldest frame still there and counts the
+# frames it missed in overruns.
+#
+
+import math
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from struct import Struct
+
+import sensel
+
+SHM_MAGIC = b'SNSLSHM1'
+DEFAULT_SLOTS = 64
+
+# How often a blocked readFrame checks for a new frame (s)
+POLL_INTERVAL = 0.0005
+
+# magic, slot count, slot size, nrows, ncols, x_to_mm_factor, y_to_mm_factor,
+# frame rate, whether slots have room for images
+_header_struct = Struct('<8sIIHHddd?')
+_HEADER_SIZE = 64
+_WRITE_SEQ_OFFSET = 56 # Sequence number of the last frame published, 0 before the first
+
+# seq (0 while being written), frame index, sensor time (NaN if unknown),
+# lost frame count, content mask, contact count
+_slot_struct = Struct('<QqdHBB4x')
+_seq_struct = Struct('<Q')
+
+_MAX_CONTACTS = 255
+
+_attach_lock = threading.Lock()
+
+class SenselShmError(sensel.SenselError):
+    pass
+
+def _align(n, alignment=8):
+    return (n + alignment - 1) // alignment * alignment
+
+class _SlotLayout(object):
+
+    def __init__(self, nrows, ncols, images):
+        self.contacts_offset = _slot_struct.size
+        end = self.contacts_offset + _MAX_CONTACTS * sensel.SenselContact.data_size
+        if images:
+            self.force_offset = _align(end)
+            self.labels_offset = self.force_offset + 2 * nrows * ncols
+            end = self.labels_offset + nrows * ncols
+        else:
+            self.force_offset = self.labels_offset = None
+        self.size = _align(end)
+
+# Bytes of a decoded image, for numpy arrays and 2-D memoryviews alike
+def _imageBytes(image):
+    if sensel.numpy is not None and isinstance(image, sensel.numpy.ndarray):
+        return image.reshape(-1).view(sensel.numpy.uint8)
+    return memoryview(image).cast('B')
+
+class SenselFramePublisher(object):
+    """Writes frames into a new shared memory ring named name
+
+    With images=False only contacts are published, which keeps the slots
+    small. See SenselDevice.startPublishing.
+    """
+
+    def __init__(self, name, nrows, ncols, mm_factors, frame_rate, slots=DEFAULT_SLOTS, images=True):
+        self.nrows = nrows
+        self.ncols = ncols
+        self.slots = slots
+        self.images = images
+        self._layout = _SlotLayout(nrows, ncols, images)
+        self._shm = shared_memory.SharedMemory(name=name, create=True,
+                                               size=_HEADER_SIZE + slots * self._layout.size)
+        self.name = self._shm.name
+        self._buf = self._shm.buf
+        _header_struct.pack_into(self._buf, 0, SHM_MAGIC, slots, self._layout.size, nrows, ncols,
+                                 mm_factors[0], mm_factors[1], frame_rate, images)
+        _seq_struct.pack_into(self._buf, _WRITE_SEQ_OFFSET, 0)
+        self.seq = 0
+
+    def publish(self, frame, frame_data):
+        if self._buf is None:
+            return
+        (lost_frame_count, force_image, label_image, contacts) = frame
+        layout = self._layout
+        buf = self._buf
+        seq = self.seq + 1
+        slot = _HEADER_SIZE + ((seq - 1) % self.slots) * layout.size
+
+        # Readers see a zero sequence number, and skip the slot, until the
+        # frame is complete
+        _seq_struct.pack_into(buf, slot, 0)
+
+        content = 0
+        num_contacts = 0
+        if contacts is not None:
+            content |= sensel.SENSEL_FRAME_CONTACTS_FLAG
+            num_contacts = len(contacts)
+            # Contacts are the last block of a frame, already in record format
+            size = num_contacts * sensel.SenselContact.data_size
+            start = slot + layout.contacts_offset
+            buf[start:start + size] = memoryview(frame_data)[len(frame_data) - size:]
+        if self.images:
+            if force_image is not None:
+                content |= sensel.SENSEL_FRAME_PRESSURE_FLAG
+                start = slot + layout.force_offset
+                buf[start:start + 2 * self.nrows * self.ncols] = _imageBytes(force_image)
+            if label_image is not None:
+                content |= sensel.SENSEL_FRAME_LABELS_FLAG
+                start = slot + layout.labels_offset
+                buf[start:start + self.nrows * self.ncols] = _imageBytes(label_image)
+
+        frame_index = -1 if frame.frame_index is None else frame.frame_index
+        sensor_time = float('nan') if frame.sensor_time is None else frame.sensor_time
+        _slot_struct.pack_into(buf, slot, 0, frame_index, sensor_time, min(lost_frame_count, 0xFFFF),
+                               content, num_contacts)
+        _seq_struct.pack_into(buf, slot, seq)
+        _seq_struct.pack_into(buf, _WRITE_SEQ_OFFSET, seq)
+        self.seq = seq
+
+    # Closes and removes the ring. Subscribers that still have it open keep
+    # their mapping, but no new frames arrive.
+    def close(self):
+        if self._buf is None:
+            return
+        self._buf = None
+        self._shm.close()
+        self._shm.unlink()
+
+class SenselFrameSubscriber(object):
+    """Reads the frames published to the shared memory ring named name
+
+    Frames are SenselFrames whose contacts and images are views of the ring,
+    valid until the publisher comes round to their slot again (slots frames
+    later). frameValid(frame) tells whether that has happened yet; copy
+    anything that needs to outlive it. Each frame also has a seq attribute,
+    its sequence number.
+    """
+
+    def __init__(self, name):
+        self._shm = _attach(name)
+        self._buf = self._shm.buf
+        if len(self._buf) < _HEADER_SIZE:
+            self._shm.close()
+            raise SenselShmError("%s is not a Sensel frame ring" % name)
+        (magic, self.slots, slot_size, self.nrows, self.ncols, x_to_mm_factor, y_to_mm_factor,
+         self.frame_rate, images) = _header_struct.unpack_from(self._buf, 0)
+        if magic != SHM_MAGIC:
+            self._shm.close()
+            raise SenselShmError("%s is not a Sensel frame ring" % name)
+        self.mm_factors = (x_to_mm_factor, y_to_mm_factor)
+        self._layout = _SlotLayout(self.nrows, self.ncols, images)
+        self._slot_size = slot_size
+        # Start with the next frame published
+        self.next_seq = self.latestSeq() + 1
+        self.overruns = 0
+
+    def latestSeq(self):
+        return _seq_struct.unpack_from(self._buf, _WRITE_SEQ_OFFSET)[0]
+
+    def _slotOffset(self, seq):
+        return _HEADER_SIZE + ((seq - 1) % self.slots) * self._slot_size
+
+    # Returns the next frame, waiting up to timeout seconds for it (forever if
+    # timeout is None, not at all if block is False). None if none arrives.
+    def readFrame(self, block=True, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            latest = self.latestSeq()
+            if latest >= self.next_seq:
+                # One slot of margin for the frame the publisher is writing now
+                oldest = max(latest - self.slots + 2, 1)
+                if self.next_seq < oldest:
+                    self.overruns += oldest - self.next_seq
+                    self.next_seq = oldest
+                frame = self._readSlot(self.next_seq)
+                if frame is not None:
+                    self.next_seq += 1
+                    return frame
+                # Overwritten as we got to it, skip ahead
+                continue
+            if not block or (deadline is not None and time.time() >= deadline):
+                return None
+            time.sleep(POLL_INTERVAL)
+
+    def _readSlot(self, seq):
+        buf = self._buf
+        layout = self._layout
+        slot = self._slotOffset(seq)
+        (slot_seq, frame_index, sensor_time, lost_frame_count, content, num_contacts) = \
+            _slot_struct.unpack_from(buf, slot)
+        if slot_seq != seq:
+            return None
+
+        nrows = self.nrows
+        ncols = self.ncols
+        force_image = label_image = contacts = None
+        numpy = sensel.numpy
+        if content & sensel.SENSEL_FRAME_PRESSURE_FLAG:
+            if numpy is not None:
+                force_image = numpy.frombuffer(buf, dtype='<u2', count=nrows * ncols,
+                                               offset=slot + layout.force_offset).reshape(nrows, ncols)
+            else:
+                start = slot + layout.force_offset
+                force_image = buf[start:start + 2 * nrows * ncols].cast('H', (nrows, ncols))
+        if content & sensel.SENSEL_FRAME_LABELS_FLAG:
+            if numpy is not None:
+                label_image = numpy.frombuffer(buf, dtype=numpy.uint8, count=nrows * ncols,
+                                               offset=slot + layout.labels_offset).reshape(nrows, ncols)
+            else:
+                start = slot + layout.labels_offset
+                label_image = buf[start:start + nrows * ncols].cast('B', (nrows, ncols))
+        if math.isnan(sensor_time):
+            sensor_time = None
+        if content & sensel.SENSEL_FRAME_CONTACTS_FLAG:
+            contacts = sensel.ContactBatch(buf, num_contacts, slot + layout.contacts_offset, self.mm_factors)
+            contacts.sensor_time = sensor_time
+
+        # Make sure the slot wasn't rewritten while the header was read
+        if _seq_struct.unpack_from(buf, slot)[0] != seq:
+            return None
+        frame = sensel.SenselFrame(lost_frame_count, force_image, label_image, contacts,
+                                   None if frame_index < 0 else frame_index, sensor_time)
+        frame.seq = seq
+        return frame
+
+    # Whether frame's slot still holds it, i.e. its views haven't been overwritten
+    def frameValid(self, frame):
+        return _seq_struct.unpack_from(self._buf, self._slotOffset(frame.seq))[0] == frame.seq
+
+    # Frames published but not read yet
+    def pending(self):
+        return max(self.latestSeq() - self.next_seq + 1, 0)
+
+    # Frames read from the ring must be dropped first, their views keep it mapped
+    def close(self):
+        self._buf = None
+        self._shm.close()
+
+# Opens an existing ring without registering it with the resource tracker,
+# which would otherwise remove the ring when the subscriber exits (or, when
+# the subscriber was forked from the publisher and shares its tracker, lose
+# track of the publisher's registration)
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError: # Before Python 3.13, which has no track argument
+        pass
+    with _attach_lock:
+        register = resource_tracker.register
+        resource_tracker.register = lambda name, rtype: None
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
@@ -0,0 +1,469 @@
+#
+# Simulated Sensel device for running SenselDevice and the gesture frameworks
+# without hardware.
+#
+# SenselSimulator speaks the device side of the serial protocol: register
+# reads/writes, variable-sized (VSP) reads and buffered/unbuffered frame reads,
+# all with checksums. Frames are generated from a touch script at the
+# configured frame rate (or as fast as they're requested when paced=False).
+#
+# Two transports connect it to a SenselDevice:
+#
+#   SimulatedSerial - in-process stand-in for serial.Serial
+#       device.openSerialConnection(SimulatedSerial(SenselSimulator(...)))
+#
+#   PtySimulator - serves the simulator on a pseudo-terminal (POSIX only)
+#       pty_sim = PtySimulator(SenselSimulator(...)); pty_sim.start()
+#       device.openConnection(pty_sim.port_name)
+#
+# Pressure and labels images are encoded with sensel._compressImage, which
+# only SenselDevices with setImageDecoding(True) decode.
+#
+
+import collections
+import itertools
+import math
+import os
+import select
+import threading
+import time
+from struct import pack
+
+import sensel
+
+SIM_NROWS = 105
+SIM_NCOLS = 185
+SIM_WIDTH_UM = 240000
+SIM_HEIGHT_UM = 138000
+SIM_FRAME_RATE = 125
+SIM_MAX_FORCE = 8192
+SIM_MAX_CONTACTS = 16
+SIM_SERIAL_NUMBER = b'SIM000001'
+SIM_FW_VERSION = (1, 0, 0, 1, 0) # protocol, major, minor, build, release
+
+# Half-width (cells) of the square blob each contact draws into the pressure
+# and labels images
+SIM_BLOB_RADIUS = 3
+
+# Registers the host isn't allowed to write
+_READ_ONLY_REGISTERS = frozenset(range(sensel.SENSEL_REG_MAGIC, sensel.SENSEL_REG_SCAN_FRAME_RATE))
+
+SimContact = collections.namedtuple('SimContact', 'id x_mm y_mm force')
+
+#########
+# Touch scripts: callables that take a frame index and return the SimContacts
+# that are down in that frame.
+
+def idleTouches():
+    return lambda frame_index: []
+
+def scriptedTouches(frames, loop=True):
+    frames = list(frames)
+    def touches(frame_index):
+        if loop:
+            return frames[frame_index % len(frames)]
+        return frames[frame_index] if frame_index < len(frames) else []
+    return touches
+
+# num_contacts fingers go down for down_frames, then lift for up_frames
+def tapTouches(num_contacts=1, down_frames=10, up_frames=40, center_mm=(120.0, 69.0), force=3000):
+    def touches(frame_index):
+        if frame_index % (down_frames + up_frames) >= down_frames:
+            return []
+        return [SimContact(i, center_mm[0] + 15.0 * i, center_mm[1], force) for i in range(num_contacts)]
+    return touches
+
+# num_contacts fingers side by side move at velocity_mm (per frame) for
+# pan_frames, then lift for up_frames
+def panTouches(num_contacts=1, pan_frames=125, up_frames=25, start_mm=(40.0, 69.0),
+               velocity_mm=(0.5, 0.0), force=3000):
+    def touches(frame_index):
+        step = frame_index % (pan_frames + up_frames)
+        if step >= pan_frames:
+            return []
+        x = start_mm[0] + velocity_mm[0] * step
+        y = start_mm[1] + velocity_mm[1] * step
+        return [SimContact(i, x, y + 15.0 * i, force) for i in range(num_contacts)]
+    return touches
+
+# Two fingers about center_mm, their distance going from start_spread_mm to
+# end_spread_mm and the line through them turning by rotation (radians) over
+# gesture_frames, then lifting for up_frames
+def pinchTouches(start_spread_mm=20.0, end_spread_mm=60.0, rotation=0.0, gesture_frames=125,
+                 up_frames=25, center_mm=(120.0, 69.0), force=3000):
+    def touches(frame_index):
+        step = frame_index % (gesture_frames + up_frames)
+        if step >= gesture_frames:
+            return []
+        t = step / float(max(gesture_frames - 1, 1))
+        half = 0.5 * (start_spread_mm + (end_spread_mm - start_spread_mm) * t)
+        angle = rotation * t
+        (dx, dy) = (half * math.cos(angle), half * math.sin(angle))
+        return [SimContact(0, center_mm[0] - dx, center_mm[1] - dy, force),
+                SimContact(1, center_mm[0] + dx, center_mm[1] + dy, force)]
+    return touches
+
+# num_contacts fingers circling the sensor center with a little force jitter,
+# useful as a heavy steady-state load
+def syntheticTouches(num_contacts=1, center_mm=(120.0, 69.0), radius_mm=40.0,
+                     period_frames=250, force=3000):
+    def touches(frame_index):
+        phase = 2 * math.pi * frame_index / period_frames
+        contacts = []
+        for i in range(num_contacts):
+            angle = phase + 2 * math.pi * i / max(num_contacts, 1)
+            contacts.append(SimContact(i, center_mm[0] + radius_mm * math.cos(angle),
+                                       center_mm[1] + radius_mm * math.sin(angle),
+                                       force + 50 * ((frame_index + i) % 7)))
+        return contacts
+    return touches
+
+#########
+
+def _packet(ack, data):
+    data = bytes(data)
+    return (pack('<BH', ack, len(data)) + data +
+            pack('<B', sum(bytearray(data)) & 0xFF))
+
+class SenselSimulator(object):
+    """Device side of the Sensel serial protocol
+
+    write() consumes bytes sent by the host and returns the responses as a
+    list of (ready_time, data) pairs; paced frame reads aren't ready until
+    the frame has been scanned.
+    """
+
+    def __init__(self, touches=None, nrows=SIM_NROWS, ncols=SIM_NCOLS, width_um=SIM_WIDTH_UM,
+                 height_um=SIM_HEIGHT_UM, frame_rate=SIM_FRAME_RATE, paced=True,
+                 serial_number=SIM_SERIAL_NUMBER, clock=time.time):
+        self.touches = touches or idleTouches()
+        self.nrows = nrows
+        self.ncols = ncols
+        self.frame_rate = float(frame_rate)
+        self.paced = paced
+        self.clock = clock
+        self.x_to_mm_factor = (width_um / 1000.0) / (256 * (ncols - 1))
+        self.y_to_mm_factor = (height_um / 1000.0) / (256 * (nrows - 1))
+
+        self.registers = bytearray(256)
+        # The device sends its serial number last byte first
+        self._vsp_registers = {sensel.SENSEL_REG_DEVICE_SERIAL_NUMBER: bytes(serial_number)[::-1]}
+        self._setReg(sensel.SENSEL_REG_MAGIC, sensel.SENSEL_MAGIC)
+        self._setReg(sensel.SENSEL_REG_FW_PROTOCOL_VERSION, pack('<BBBHB', *SIM_FW_VERSION))
+        self._setReg(sensel.SENSEL_REG_DEVICE_ID, pack('<HB', 1, 1))
+        self._setReg(sensel.SENSEL_REG_SENSOR_COL_ACTIVE_COUNT, pack('<B', ncols))
+        self._setReg(sensel.SENSEL_REG_SENSOR_ROW_ACTIVE_COUNT, pack('<B', nrows))
+        self._setReg(sensel.SENSEL_REG_SENSOR_ACTIVE_AREA_WIDTH_UM, pack('<I', width_um))
+        self._setReg(sensel.SENSEL_REG_SENSOR_ACTIVE_AREA_HEIGHT_UM, pack('<I', height_um))
+        self._setReg(sensel.SENSEL_REG_SCAN_FRAME_RATE, pack('<H', min(int(frame_rate), 255)))
+        self._setReg(sensel.SENSEL_REG_SCAN_CONTENT_CONTROL, pack('<B', sensel.SENSEL_FRAME_CONTACTS_FLAG))
+        self._setReg(sensel.SENSEL_REG_PRESSURE_MAP_MAX_VALUE, pack('<H', SIM_MAX_FORCE))
+        self._setReg(sensel.SENSEL_REG_CONTACTS_MAX_COUNT, pack('<B', SIM_MAX_CONTACTS))
+        self._setReg(sensel.SENSEL_REG_BATTERY_VOLTAGE_MV, pack('<H', 4000))
+
+        self._input = bytearray()
+        self._lock = threading.Lock()
+        self._scan_start = None
+        self._frame_index = 0
+        self._last_contacts = {}
+        self._uids = itertools.count(1)
+
+        self.frames_sent = 0
+        self.frames_lost = 0
+
+    # Generates num_frames frames of the touch script directly, without the
+    # serial protocol, for benchmarks and test recordings
+    def generateFrames(self, num_frames, content=sensel.SENSEL_FRAME_CONTACTS_FLAG):
+        with self._lock:
+            self.registers[sensel.SENSEL_REG_SCAN_CONTENT_CONTROL] = content
+            return [self._buildFrame(0) for i in range(num_frames)]
+
+    def _setReg(self, reg, data):
+        self.registers[reg:reg + len(data)] = data
+
+    def _regVal(self, reg, size):
+        return sensel._convertBufToVal(bytes(self.registers[reg:reg + size]))
+
+    def write(self, data):
+        with self._lock:
+            self._input += data
+            responses = []
+            while True:
+                handled = self._handleCommand()
+                if handled is None:
+                    return responses
+                responses.extend(handled)
+
+    def _handleCommand(self):
+        if len(self._input) < 3:
+            return None
+        (header, reg, size) = self._input[:3]
+
+        if header == sensel.SENSEL_READ_HEADER:
+            del self._input[:3]
+            now = self.clock()
+            if reg == sensel.SENSEL_REG_SCAN_READ_FRAME:
+                return self._readFrames(now)
+            if size == 0:
+                if reg not in self._vsp_registers:
+                    return [(now, pack('<B', sensel.SENSEL_PT_RVS_NACK))]
+                return [(now, _packet(sensel.SENSEL_PT_RVS_ACK, self._vsp_registers[reg]))]
+            if reg + size > len(self.registers):
+                return [(now, pack('<B', sensel.SENSEL_PT_READ_NACK))]
+            return [(now, _packet(sensel.SENSEL_PT_READ_ACK, self.registers[reg:reg + size]))]
+
+        if header == sensel.SENSEL_WRITE_HEADER:
+            if len(self._input) < 3 + size + 1:
+                return None
+            data = bytes(self._input[3:3 + size])
+            checksum = self._input[3 + size]
+            del self._input[:3 + size + 1]
+            now = self.clock()
+            if (sum(bytearray(data)) & 0xFF) != checksum:
+                return [(now, pack('<B', sensel.SENSEL_PT_WRITE_NACK))]
+            self._writeReg(reg, data, now)
+            return [(now, pack('<B', sensel.SENSEL_PT_WRITE_ACK))]
+
+        # Not a command header, drop it and resync on the next byte
+        del self._input[:1]
+        return []
+
+    def _writeReg(self, reg, data, now):
+        if reg in _READ_ONLY_REGISTERS or reg + len(data) > len(self.registers):
+            self.registers[sensel.SENSEL_REG_ERROR_CODE] = sensel.EC_REG_INVALID_PERMISSIONS
+            return
+        self._setReg(reg, data)
+        self.registers[sensel.SENSEL_REG_ERROR_CODE] = sensel.EC_OK
+        if reg == sensel.SENSEL_REG_SCAN_ENABLED:
+            self._scan_start = now if data[:1] != b'\x00' else None
+            self._frame_index = 0
+            self._last_contacts = {}
+
+    def _readFrames(self, now):
+        if self._scan_start is None:
+            return [(now, pack('<B', sensel.SENSEL_PT_FRAME_NACK))]
+        num_buffers = self._regVal(sensel.SENSEL_REG_SCAN_BUFFER_CONTROL, 1)
+
+        if not self.paced:
+            frames = [self._buildFrame(0) for i in range(max(num_buffers, 1))]
+            ready = now
+        else:
+            scanned = int((now - self._scan_start) * self.frame_rate) - self._frame_index
+            if num_buffers == 0:
+                # A synchronous read gets the newest frame, waiting for it if
+                # it hasn't been scanned yet
+                lost = max(scanned - 1, 0)
+                self._frame_index += lost
+                ready = max(now, self._scan_start + (self._frame_index + 1) / self.frame_rate)
+                frames = [self._buildFrame(lost)]
+            else:
+                # The device only holds num_buffers frames, older ones are lost
+                lost = max(scanned - num_buffers, 0)
+                self._frame_index += lost
+                frames = [self._buildFrame(lost if i == 0 else 0) for i in range(scanned - lost)]
+                ready = now
+
+        if num_buffers == 0:
+            return [(ready, _packet(sensel.SENSEL_PT_FRAME, frames[0]))]
+        packets = [_packet(sensel.SENSEL_PT_BUFFERED_FRAME, frame) for frame in frames]
+        packets.append(pack('<B', sensel.SENSEL_PT_BUFFERED_FRAME_END))
+        return [(ready, b''.join(packets))]
+
+    def _buildFrame(self, lost):
+        content = self.registers[sensel.SENSEL_REG_SCAN_CONTENT_CONTROL]
+        contacts = self._contactRecords(self.touches(self._frame_index))
+        self._frame_index += 1
+        self.frames_sent += 1
+        self.frames_lost += lost
+
+        frame = bytearray(pack('<BB', content, min(lost, 255)))
+        if content & (sensel.SENSEL_FRAME_PRESSURE_FLAG | sensel.SENSEL_FRAME_LABELS_FLAG):
+            (pressure, labels) = self._renderImages(contacts)
+            if content & sensel.SENSEL_FRAME_PRESSURE_FLAG:
+                frame += sensel._compressImage(bytes(pressure), 2, 0)
+            if content & sensel.SENSEL_FRAME_LABELS_FLAG:
+                frame += sensel._compressImage(bytes(labels), 1, sensel.SENSEL_NULL_LABEL)
+        if content & sensel.SENSEL_FRAME_CONTACTS_FLAG:
+            frame += pack('<B', len(contacts))
+            for record in contacts:
+                frame += sensel._contact_struct.pack(*record)
+        return bytes(frame)
+
+    # Turns the touches that are down into contact records, adding START/END
+    # events and an END record for every touch that lifted since last frame
+    def _contactRecords(self, touches):
+        current = {}
+        records = []
+        for touch in touches:
+            x_pos = max(0, min(0xFFFF, int(round(touch.x_mm / self.x_to_mm_factor))))
+            y_pos = max(0, min(0xFFFF, int(round(touch.y_mm / self.y_to_mm_factor))))
+            previous = self._last_contacts.get(touch.id)
+            if previous is None:
+                (uid, dx, dy, event) = (next(self._uids), 0, 0, sensel.SENSEL_EVENT_CONTACT_START)
+            else:
+                (uid, dx, dy, event) = (previous[1], x_pos - previous[3], y_pos - previous[4],
+                                        sensel.SENSEL_EVENT_CONTACT_MOVE)
+            record = self._contactRecord(touch.force, uid, x_pos, y_pos, dx, dy, touch.id, event)
+            current[touch.id] = record
+            records.append(record)
+        for (contact_id, previous) in self._last_contacts.items():
+            if contact_id not in current:
+                records.append(self._contactRecord(previous[0], previous[1], previous[3], previous[4],
+                                                   0, 0, contact_id, sensel.SENSEL_EVENT_CONTACT_END))
+        self._last_contacts = current
+        return records
+
+    def _contactRecord(self, force, uid, x_pos, y_pos, dx, dy, contact_id, event):
+        return (min(int(force), 0xFFFFFFFF), uid & 0xFFFFFFFF, 40, x_pos, y_pos,
+                max(-0x8000, min(0x7FFF, dx)), max(-0x8000, min(0x7FFF, dy)),
+                0, 12, 8, min(x_pos // 256, self.ncols - 1), min(y_pos // 256, self.nrows - 1),
+                contact_id, event)
+
+    def _renderImages(self, contacts):
+        pressure = bytearray(self.nrows * self.ncols * 2)
+        labels = bytearray([sensel.SENSEL_NULL_LABEL]) * (self.nrows * self.ncols)
+        for record in contacts:
+            if record[13] == sensel.SENSEL_EVENT_CONTACT_END:
+                continue
+            value = pack('<H', max(1, min(SIM_MAX_FORCE, record[0] // 16)))
+            (peak_x, peak_y, contact_id) = (record[10], record[11], record[12])
+            for r in range(max(peak_y - SIM_BLOB_RADIUS, 0), min(peak_y + SIM_BLOB_RADIUS + 1, self.nrows)):
+                start = r * self.ncols + max(peak_x - SIM_BLOB_RADIUS, 0)
+                end = r * self.ncols + min(peak_x + SIM_BLOB_RADIUS + 1, self.ncols)
+                pressure[2 * start:2 * end] = value * (end - start)
+                labels[start:end] = bytearray([contact_id]) * (end - start)
+        return (pressure, labels)
+
+#########
+
+class SimulatedSerial(object):
+    """In-process stand-in for serial.Serial wired to a SenselSimulator
+
+    latency (s) delays every response, and bytes_per_second limits how fast
+    responses come over the link, one after another. Both default to an
+    instant link.
+    """
+
+    _port_ids = itertools.count()
+
+    def __init__(self, simulator, timeout=sensel.SENSEL_TIMEOUT, latency=0.0, bytes_per_second=None):
+        self.simulator = simulator
+        self.port = "sim://%d" % next(SimulatedSerial._port_ids)
+        self.timeout = timeout
+        self.latency = latency
+        self.bytes_per_second = bytes_per_second
+        self._link_free = 0.0
+        self.is_open = False
+        self._out = bytearray()
+        self._pending = collections.deque()
+        self._cond = threading.Condition()
+
+    def open(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+    def flushInput(self):
+        with self._cond:
+            del self._out[:]
+            self._pending.clear()
+
+    reset_input_buffer = flushInput
+
+    def write(self, data):
+        responses = self.simulator.write(bytes(data))
+        if self.latency or self.bytes_per_second:
+            responses = [self._linkDelay(ready, response) for (ready, response) in responses]
+        with self._cond:
+            self._pending.extend(responses)
+            self._cond.notify_all()
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        with self._cond:
+            self._release(self.simulator.clock())
+            return len(self._out)
+
+    def inWaiting(self):
+        return self.in_waiting
+
+    def read(self, size=1):
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        with self._cond:
+            while True:
+                now = self.simulator.clock()
+                self._release(now)
+                if len(self._out) >= size:
+                    break
+                wait = None if deadline is None else deadline - time.time()
+                if self._pending:
+                    next_ready = self._pending[0][0] - now
+                    wait = next_ready if wait is None else min(wait, next_ready)
+                if wait is not None and wait <= 0:
+                    if deadline is not None and time.time() >= deadline:
+                        break
+                    continue
+                self._cond.wait(wait)
+            data = bytes(self._out[:size])
+            del self._out[:size]
+            return data
+
+    # When a response that's ready at ready has crossed the link
+    def _linkDelay(self, ready, response):
+        if self.bytes_per_second:
+            ready = max(ready, self._link_free) + len(response) / float(self.bytes_per_second)
+            self._link_free = ready
+        return (ready + self.latency, response)
+
+    # Moves responses whose time has come into the readable buffer, in order
+    def _release(self, now):
+        while self._pending and self._pending[0][0] <= now:
+            self._out += self._pending.popleft()[1]
+
+class PtySimulator(object):
+    """Serves a SenselSimulator on a pseudo-terminal so a SenselDevice can open
+    it by name (port_name) through pyserial, exactly like real hardware"""
+
+    def __init__(self, simulator):
+        import tty
+        self.simulator = simulator
+        (self._master, self._slave) = os.openpty()
+        tty.setraw(self._master)
+        tty.setraw(self._slave)
+        self.port_name = os.ttyname(self._slave)
+        self._thread = None
+        self._exit = threading.Event()
+
+    def start(self):
+        self._exit.clear()
+        self._thread = threading.Thread(target=self._serve, name="SENSEL_PTY_SIM")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._exit.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def _serve(self):
+        pending = collections.deque()
+        while not self._exit.is_set():
+            wait = 0.05
+            if pending:
+                wait = max(0, min(wait, pending[0][0] - self.simulator.clock()))
+            (readable, _, _) = select.select([self._master], [], [], wait)
+            if readable:
+                pending.extend(self.simulator.write(os.read(self._master, 4096)))
+            now = self.simulator.clock()
+            while pending and pending[0][0] <= now:
+                data = pending.popleft()[1]
+                while data:
+                    data = data[os.write(self._master, data):]
@@ -0,0 +1,175 @@
+#
+# Per-finger contact tracking.
+#
+#   tracker = ContactTracker(on_start=down, on_move=moved, on_end=up)
+#   while True:
+#       tracker.update(sensel_device.readContactBatch())
+#
+# The device already matches contacts across frames (each finger keeps its id
+# and uid from its START event to its END event), so a track is found with one
+# dict lookup per contact instead of re-matching positions. Each track keeps a
+# bounded history of its recent samples.
+#
+
+import collections
+import time
+
+import sensel
+
+DEFAULT_HISTORY = 64
+
+# Indices into the SenselContact field tuples returned by ContactBatch.rows()
+(_FORCE, _UID, _AREA, _X, _Y, _DX, _DY, _ORIENTATION, _MAJOR, _MINOR,
+ _PEAK_X, _PEAK_Y, _ID, _TYPE) = range(14)
+
+class ContactTrack(object):
+    """One finger, from the frame it touched down to the frame it lifted
+
+    history holds the most recent (time, x_mm, y_mm, force) samples, oldest
+    first. Times are sensor times when the frames have them.
+    """
+
+    def __init__(self, contact_id, uid, start_time, x_mm, y_mm, history):
+        self.id = contact_id
+        self.uid = uid
+        self.start_time = start_time
+        self.start_x_mm = x_mm
+        self.start_y_mm = y_mm
+        self.time = start_time
+        self.x_mm = x_mm
+        self.y_mm = y_mm
+        self.dx_mm = 0.0
+        self.dy_mm = 0.0
+        self.force = 0
+        self.area = 0
+        self.ended = False
+        self.history = collections.deque(maxlen=history)
+        self._frame = -1
+
+    def _update(self, frame, now, row, x_mm, y_mm, mm_factors):
+        self._frame = frame
+        self.time = now
+        self.x_mm = x_mm
+        self.y_mm = y_mm
+        self.dx_mm = row[_DX] * mm_factors[0]
+        self.dy_mm = row[_DY] * mm_factors[1]
+        self.force = row[_FORCE]
+        self.area = row[_AREA]
+        self.history.append((now, x_mm, y_mm, row[_FORCE]))
+
+    def duration(self):
+        return self.time - self.start_time
+
+    # Distance moved since touch down, (x, y) in mm
+    def displacement(self):
+        return (self.x_mm - self.start_x_mm, self.y_mm - self.start_y_mm)
+
+    # Average velocity over the samples in history, (x, y) in mm/s
+    def velocity(self):
+        if len(self.history) < 2:
+            return (0.0, 0.0)
+        (t0, x0, y0, f0) = self.history[0]
+        (t1, x1, y1, f1) = self.history[-1]
+        if t1 <= t0:
+            return (0.0, 0.0)
+        return ((x1 - x0) / (t1 - t0), (y1 - y0) / (t1 - t0))
+
+    def __repr__(self):
+        return "ContactTrack(id=%d, uid=%d, x_mm=%.1f, y_mm=%.1f, force=%d%s)" % (
+            self.id, self.uid, self.x_mm, self.y_mm, self.force, ", ended" if self.ended else "")
+
+class ContactTracker(object):
+    """Keeps a ContactTrack for every finger that is down
+
+    update() takes a frame's contacts (a ContactBatch, or a list of
+    SenselContacts) and calls on_start(track), on_move(track) and
+    on_end(track) as fingers touch down, move and lift. A finger that vanishes
+    without an END event is ended when the frame it's missing from arrives.
+    """
+
+    def __init__(self, history=DEFAULT_HISTORY, on_start=None, on_move=None, on_end=None):
+        self.history = history
+        self.on_start = on_start
+        self.on_move = on_move
+        self.on_end = on_end
+        self.tracks = {}
+        self._frame = 0
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def __iter__(self):
+        return iter(list(self.tracks.values()))
+
+    def track(self, contact_id):
+        return self.tracks.get(contact_id)
+
+    def update(self, contacts, now=None):
+        if contacts is None:
+            return
+        if now is None:
+            now = getattr(contacts, 'sensor_time', None)
+            if now is None:
+                now = time.time()
+        self._frame += 1
+        frame = self._frame
+
+        (rows, mm_factors) = _contactRows(contacts)
+        num_seen = 0
+        for row in rows:
+            contact_id = row[_ID]
+            x_mm = row[_X] * mm_factors[0]
+            y_mm = row[_Y] * mm_factors[1]
+            track = self.tracks.get(contact_id)
+
+            if track is not None and track.uid != row[_UID]:
+                # The id was reused by a new finger before we saw the old one end
+                self._end(track)
+                track = None
+
+            if track is None:
+                if row[_TYPE] == sensel.SENSEL_EVENT_CONTACT_END:
+                    continue
+                track = ContactTrack(contact_id, row[_UID], now, x_mm, y_mm, self.history)
+                self.tracks[contact_id] = track
+                track._update(frame, now, row, x_mm, y_mm, mm_factors)
+                num_seen += 1
+                if self.on_start:
+                    self.on_start(track)
+                continue
+
+            moved = (x_mm != track.x_mm or y_mm != track.y_mm)
+            track._update(frame, now, row, x_mm, y_mm, mm_factors)
+            if row[_TYPE] == sensel.SENSEL_EVENT_CONTACT_END:
+                self._end(track)
+                continue
+            num_seen += 1
+            if moved and self.on_move:
+                self.on_move(track)
+
+        # Only look for vanished fingers when some live track wasn't updated
+        if num_seen != len(self.tracks):
+            for track in list(self.tracks.values()):
+                if track._frame != frame:
+                    self._end(track)
+
+    # Ends every track, e.g. when the device is closed
+    def clear(self):
+        for track in list(self.tracks.values()):
+            self._end(track)
+
+    def _end(self, track):
+        del self.tracks[track.id]
+        track.ended = True
+        if self.on_end:
+            self.on_end(track)
+
+# (field tuples, mm factors) for a ContactBatch or a list of SenselContacts
+def _contactRows(contacts):
+    if isinstance(contacts, sensel.ContactBatch):
+        return (contacts.rows(), (contacts.x_to_mm_factor, contacts.y_to_mm_factor))
+    rows = [(c.total_force, c.uid, c.area, c.x_pos, c.y_pos, c.dx, c.dy, c.orientation, c.major_axis,
+             c.minor_axis, c.peak_x, c.peak_y, c.id, c.type) for c in contacts]
+    if not rows:
+        return (rows, (1.0, 1.0))
+    return (rows, contacts[0]._mm_factors)